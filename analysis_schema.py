@@ -0,0 +1,279 @@
+import json
+
+
+# JSON schema for the report create_analysis_prompt() asks for. It is sent as
+# the response schema so the model is held to the structure, and the same
+# schema drives validate_section() when a response has to be checked or
+# repaired.
+
+def _string():
+    return {'type': 'string'}
+
+
+def _number():
+    return {'type': 'number'}
+
+
+def _integer():
+    return {'type': 'integer'}
+
+
+def _strings():
+    return {'type': 'array', 'items': _string()}
+
+
+def _question_numbers():
+    return {'type': 'array', 'items': {'anyOf': [_integer(), _string()]}}
+
+
+def _object(properties, required=None):
+    return {
+        'type': 'object',
+        'properties': properties,
+        'required': list(properties) if required is None else required,
+    }
+
+
+def _array(items):
+    return {'type': 'array', 'items': items}
+
+
+SECTION_SCHEMAS = {
+    'personal_details': _object({
+        'student_name': _string(),
+        'exam_name': _string(),
+        'date': _string(),
+        'subject': _string(),
+        'class': _string(),
+        'roll_number': _string(),
+        'school_name': _string(),
+    }),
+    'overall_score': _object({
+        'total_questions': _integer(),
+        'attempted_questions': _integer(),
+        'correct_answers': _integer(),
+        'partially_correct': _integer(),
+        'incorrect_answers': _integer(),
+        'unattempted': _integer(),
+        'accuracy_percentage': _number(),
+        'total_marks_obtained': _number(),
+        'total_marks': _number(),
+    }),
+    'topic_wise_performance': _object({
+        'strong_topics': _array(_object({
+            'topic': _string(),
+            'questions': _question_numbers(),
+            'score': _string(),
+            'accuracy': _number(),
+            'details': _string(),
+        })),
+        'areas_for_improvement': _array(_object({
+            'topic': _string(),
+            'questions': _question_numbers(),
+            'score': _string(),
+            'accuracy': _number(),
+            'gaps': _strings(),
+            'recommendations': _string(),
+        })),
+    }),
+    'question_wise_breakdown': _object({
+        'highly_accurate_questions': _array(_object({
+            'question_numbers': _question_numbers(),
+            'topic': _string(),
+            'summary': _string(),
+        })),
+        'needs_improvement': _array(_object({
+            'question_number': {'anyOf': [_integer(), _string()]},
+            'question_text': _string(),
+            'student_answer': _string(),
+            'expected_answer': _string(),
+            'marks_obtained': _number(),
+            'total_marks': _number(),
+            'issues': _strings(),
+            'feedback': _string(),
+            'what_was_correct': _string(),
+            'what_was_wrong': _string(),
+        })),
+    }),
+    'error_analysis': _object({
+        'conceptual_errors': _array(_object({
+            'description': _string(),
+            'questions_affected': _question_numbers(),
+            'severity': _string(),
+            'remedy': _string(),
+            'example': _string(),
+        })),
+        'calculation_mistakes': _array(_object({
+            'description': _string(),
+            'questions_affected': _question_numbers(),
+            'pattern': _string(),
+            'example': _string(),
+        })),
+        'incomplete_steps': _array(_object({
+            'description': _string(),
+            'questions_affected': _question_numbers(),
+            'impact': _string(),
+            'missing_steps': _strings(),
+        })),
+        'poor_explanation': _array(_object({
+            'description': _string(),
+            'questions_affected': _question_numbers(),
+            'suggestion': _string(),
+            'example': _string(),
+        })),
+        'notation_errors': _array(_object({
+            'description': _string(),
+            'questions_affected': _question_numbers(),
+            'correct_notation': _string(),
+            'example': _string(),
+        })),
+    }),
+    'strengths': _strings(),
+    'improvements_needed': _strings(),
+    'personal_feedback': _object({
+        'opening': _string(),
+        'overall_impression': _string(),
+        'detailed_analysis': _string(),
+        'key_takeaways': _strings(),
+        'action_plan': _strings(),
+        'motivation': _string(),
+        'estimated_improvement_potential': _string(),
+    }),
+}
+
+
+def analysis_response_schema(sections=None):
+    # The full report, or only the named sections when re-requesting the
+    # parts of a response that could not be recovered.
+    sections = sections or list(SECTION_SCHEMAS)
+    return _object({key: SECTION_SCHEMAS[key] for key in sections})
+
+
+def _matches(schema, value, path, errors):
+    if 'anyOf' in schema:
+        if not any(not _matches(option, value, path, []) for option in schema['anyOf']):
+            errors.append(f"{path}: unexpected value {value!r}")
+        return errors
+
+    expected = schema.get('type')
+    if expected == 'object':
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected an object")
+            return errors
+        for field in schema.get('required', []):
+            if field not in value:
+                errors.append(f"{path}.{field}: missing")
+        for field, field_schema in schema.get('properties', {}).items():
+            if field in value:
+                _matches(field_schema, value[field], f"{path}.{field}", errors)
+    elif expected == 'array':
+        if not isinstance(value, list):
+            errors.append(f"{path}: expected a list")
+            return errors
+        for i, item in enumerate(value):
+            _matches(schema['items'], item, f"{path}[{i}]", errors)
+    elif expected == 'string':
+        if not isinstance(value, str):
+            errors.append(f"{path}: expected text")
+    elif expected in ('number', 'integer'):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append(f"{path}: expected a number")
+        elif expected == 'integer' and not float(value).is_integer():
+            errors.append(f"{path}: expected a whole number")
+    return errors
+
+
+def _coerce(schema, value):
+    # Fixes the slips that don't need the model: numbers sent as text
+    # ("8", "75%") and scalars where a list was expected.
+    expected = schema.get('type')
+    if expected == 'object' and isinstance(value, dict):
+        properties = schema.get('properties', {})
+        return {field: _coerce(properties[field], item) if field in properties else item
+                for field, item in value.items()}
+    if expected == 'array':
+        if isinstance(value, list):
+            return [_coerce(schema['items'], item) for item in value]
+        if value is not None and not isinstance(value, dict):
+            return [_coerce(schema['items'], value)]
+    if expected in ('number', 'integer') and isinstance(value, str):
+        try:
+            number = float(value.strip().rstrip('%').strip())
+        except ValueError:
+            return value
+        return int(number) if expected == 'integer' and number.is_integer() else number
+    return value
+
+
+def validate_section(key, value):
+    # Returns (coerced value, list of problems); an empty list means valid.
+    schema = SECTION_SCHEMAS[key]
+    value = _coerce(schema, value)
+    return value, _matches(schema, value, key, [])
+
+
+def _repair_candidates(body):
+    # Yields (length, closing) pairs, longest first: body[:length] + closing
+    # is body cut off at a point where a member ended and closed again. Each
+    # cut keeps only its closing brackets, so this needs memory linear in the
+    # length of body; the text itself is only copied for the candidates that
+    # are actually tried.
+    closing = ''
+    in_string = escape = False
+    cuts = []
+    for i, ch in enumerate(body):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            closing = ('}' if ch == '{' else ']') + closing
+            cuts.append((i + 1, closing))
+        elif ch in '}]':
+            closing = closing[1:]
+            cuts.append((i + 1, closing))
+        elif ch == ',':
+            cuts.append((i, closing))
+
+    yield len(body), ('"' if in_string else '') + closing
+    yield from reversed(cuts)
+
+
+def repair_json(text):
+    # Best-effort recovery of a JSON object from model output that is fenced,
+    # followed by stray text, or cut off mid-way. Truncated output is closed
+    # at the last point where a member ended, so at worst the final,
+    # incomplete member is lost. Returns None if nothing can be recovered.
+    start = text.find('{')
+    if start == -1:
+        return None
+    body = text[start:]
+
+    decoder = json.JSONDecoder(strict=False)
+    try:
+        value, _ = decoder.raw_decode(body)
+        return value
+    except json.JSONDecodeError:
+        pass
+
+    # A candidate that fails inside body fails at the same place for every
+    # longer cut, so those are skipped rather than decoded again.
+    limit = len(body)
+    for length, closing in _repair_candidates(body):
+        if length > limit:
+            continue
+        try:
+            value = decoder.decode(body[:length] + closing)
+        except json.JSONDecodeError as e:
+            if e.pos < length:
+                limit = min(limit, e.pos)
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
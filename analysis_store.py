@@ -0,0 +1,194 @@
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime, timezone
+
+from cache_store import get_connection
+
+
+ANALYSIS_DB_PATH = os.getenv('EXAM_ANALYSIS_DB', os.path.join('.cache', 'analyses.sqlite'))
+
+# Every finished report, kept after the browser session ends so class-wide
+# analytics can be computed over them. Re-grading the same files adds a new
+# row that supersedes the old one rather than overwriting it, so readers that
+# consume rows by increasing analysis_id can undo what they counted before.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    analysis_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    result_key TEXT NOT NULL,
+    analysis_hash TEXT NOT NULL,
+    class TEXT,
+    subject TEXT,
+    board TEXT,
+    exam_type TEXT,
+    paper_hash TEXT,
+    student_name TEXT,
+    roll_number TEXT,
+    school_name TEXT,
+    replaces INTEGER,
+    superseded INTEGER NOT NULL DEFAULT 0,
+    analysis_json TEXT NOT NULL,
+    metadata_json TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_analyses_scope ON analyses (class, subject, analysis_id);
+CREATE INDEX IF NOT EXISTS idx_analyses_result_key ON analyses (result_key, superseded);
+"""
+
+# paper_hash (SHA-256 of the question paper, so question numbers from
+# different papers are never compared) was added after the first release.
+_COLUMNS = {'analyses': {'paper_hash': 'TEXT'}}
+
+
+def _analysis_hash(analysis):
+    payload = json.dumps(analysis, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def save_analysis(result_key, analysis, metadata, paper_hash=None):
+    # Returns the new analysis_id, or None if nothing was written (the same
+    # report is already the current one for these files, or the store is
+    # unavailable).
+    analysis_hash = _analysis_hash(analysis)
+    personal_details = analysis.get('personal_details', {})
+    try:
+        conn = get_connection(ANALYSIS_DB_PATH, _SCHEMA, _COLUMNS)
+        try:
+            with conn:
+                current = conn.execute(
+                    "SELECT analysis_id, analysis_hash FROM analyses WHERE result_key = ? AND superseded = 0",
+                    (result_key,)
+                ).fetchone()
+                if current is not None and current['analysis_hash'] == analysis_hash:
+                    return None
+
+                cursor = conn.execute(
+                    """INSERT INTO analyses
+                       (result_key, analysis_hash, class, subject, board, exam_type, paper_hash, student_name,
+                        roll_number, school_name, replaces, analysis_json, metadata_json, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        result_key,
+                        analysis_hash,
+                        str(metadata.get('class')),
+                        metadata.get('subject'),
+                        metadata.get('board'),
+                        metadata.get('exam_type'),
+                        paper_hash,
+                        personal_details.get('student_name'),
+                        personal_details.get('roll_number'),
+                        personal_details.get('school_name'),
+                        current['analysis_id'] if current else None,
+                        json.dumps(analysis, separators=(',', ':')),
+                        json.dumps(metadata, separators=(',', ':'), default=str),
+                        datetime.now(timezone.utc).isoformat()
+                    )
+                )
+                if current is not None:
+                    conn.execute("UPDATE analyses SET superseded = 1 WHERE analysis_id = ?",
+                                 (current['analysis_id'],))
+            return cursor.lastrowid
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def fetch_analyses_since(class_num, subject, exam_type, paper_hash, after_id=0):
+    # Rows for one class, subject, exam type and question paper added after
+    # after_id, oldest first, as (analysis_id, replaces, analysis) tuples.
+    # Superseded rows are included so a reader replaying the log sees every
+    # replacement. A None exam_type or paper_hash matches rows without one.
+    try:
+        conn = get_connection(ANALYSIS_DB_PATH, _SCHEMA, _COLUMNS)
+        try:
+            rows = conn.execute(
+                """SELECT analysis_id, replaces, analysis_json FROM analyses
+                   WHERE class = ? AND subject = ? AND exam_type IS ? AND paper_hash IS ? AND analysis_id > ?
+                   ORDER BY analysis_id""",
+                (str(class_num), subject, exam_type, paper_hash, after_id)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+    return [(row['analysis_id'], row['replaces'], json.loads(row['analysis_json'])) for row in rows]
+
+
+def list_analyses(class_num=None, subject=None):
+    # Current (not superseded) reports, newest first, without their JSON.
+    clauses, params = ["superseded = 0"], []
+    if class_num is not None:
+        clauses.append("class = ?")
+        params.append(str(class_num))
+    if subject is not None:
+        clauses.append("subject = ?")
+        params.append(subject)
+    try:
+        conn = get_connection(ANALYSIS_DB_PATH, _SCHEMA, _COLUMNS)
+        try:
+            rows = conn.execute(
+                f"""SELECT analysis_id, result_key, class, subject, board, exam_type, student_name,
+                           roll_number, school_name, created_at
+                    FROM analyses WHERE {' AND '.join(clauses)} ORDER BY analysis_id DESC""",
+                params
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+    return [dict(row) for row in rows]
+
+
+def get_analysis(analysis_id):
+    try:
+        conn = get_connection(ANALYSIS_DB_PATH, _SCHEMA, _COLUMNS)
+        try:
+            row = conn.execute(
+                "SELECT analysis_json FROM analyses WHERE analysis_id = ?", (analysis_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return json.loads(row['analysis_json']) if row else None
+
+
+def iter_analyses(after_id=0, class_num=None, subject=None, batch_size=500):
+    # Every stored row after after_id, oldest first, read in batches so a
+    # term's worth of reports never sits in memory at once. Yields dicts with
+    # the row's columns plus the parsed 'analysis'.
+    clauses, params = ["analysis_id > ?"], [after_id]
+    if class_num is not None:
+        clauses.append("class = ?")
+        params.append(str(class_num))
+    if subject is not None:
+        clauses.append("subject = ?")
+        params.append(subject)
+
+    last_id = after_id
+    while True:
+        params[0] = last_id
+        try:
+            conn = get_connection(ANALYSIS_DB_PATH, _SCHEMA, _COLUMNS)
+            try:
+                rows = conn.execute(
+                    f"""SELECT analysis_id, result_key, class, subject, board, exam_type, student_name,
+                               roll_number, school_name, replaces, analysis_json, created_at
+                        FROM analyses WHERE {' AND '.join(clauses)} ORDER BY analysis_id LIMIT ?""",
+                    params + [batch_size]
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return
+
+        for row in rows:
+            record = dict(row)
+            record['analysis'] = json.loads(record.pop('analysis_json'))
+            yield record
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['analysis_id']
@@ -1,8 +1,25 @@
 import streamlit as st
-import json
 import os
-from gemini_functions import get_gemini_client, analyze_exam_with_gemini, chat_with_gemini
-from gemini_functions import sync_to_github
+import time
+import uuid
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from gemini_functions import get_gemini_client, stream_chat_with_gemini, QUICK_QUESTIONS
+from gemini_functions import sync_to_github, grade_answer_sheets, AnalysisError, BATCH_MAX_WORKERS
+from gemini_functions import run_analysis_job, schedule_quick_answers, ANALYSIS_SECTIONS
+from gemini_functions import question_paper_hash
+from cache_store import get_result_cache_stats
+from chat_context import build_chat_context
+from report_view import build_report_view
+from class_analytics import get_class_analytics
+from student_history import find_student_for_analysis, get_topic_trends, start_student_index_backfill
+from scheduler import set_request_session, get_scheduler_stats
+from model_router import get_router_stats
+from metadata_registry import get_metadata_registry, MetadataError
+from preprocess import format_preprocess_report, merge_images_to_pdf
+from chat_session import ChatSession, chat_session_id, quick_answers_key, get_quick_answers
+from chat_session import record_quick_answer_lookup, get_quick_answer_stats
+from job_queue import submit_job, get_job, snapshot_files, count_active_jobs, start_job_queue, ACTIVE_STATUSES
+from archive import get_archive_stats
 from datetime import datetime
 
 st.set_page_config(
@@ -33,19 +50,13 @@ st.markdown("""
 """
 , unsafe_allow_html=True)
 
-if 'session_folder' not in st.session_state:
-    st.session_state.session_folder = datetime.now().strftime("%Y%m%d_%H%M%S")
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '1.5'))
 
-def load_class_metadata(class_num: str):
-    try:
-        filepath = f'metadata/class_{class_num}_metadata.json'
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception as e:
-        st.error(f"Error loading metadata: {e}")
-    return None
+SINGLE_MODE = "Single Student"
+BATCH_MODE = "Whole Class (Batch)"
 
+if 'session_folder' not in st.session_state:
+    st.session_state.session_folder = datetime.now().strftime("%Y%m%d_%H%M%S")
 
 def initialize_session_state():
     if 'metadata' not in st.session_state:
@@ -56,32 +67,32 @@ def initialize_session_state():
         st.session_state.analysis_complete = False
     if 'chat_mode' not in st.session_state:
         st.session_state.chat_mode = False
-    if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
-    if 'selected_class' not in st.session_state:
-        st.session_state.selected_class = None
+    if 'chat_session' not in st.session_state:
+        st.session_state.chat_session = None
+    if 'batch_results' not in st.session_state:
+        st.session_state.batch_results = []
+    if 'active_job' not in st.session_state:
+        st.session_state.active_job = None
+    if 'viewer_id' not in st.session_state:
+        # Identifies this browser session; chat history is kept per viewer.
+        ctx = get_script_run_ctx()
+        st.session_state.viewer_id = ctx.session_id if ctx else uuid.uuid4().hex
 
 
 def render_metadata_form():
     st.markdown("### 📋 Exam Configuration")
 
-    class_options = ["5", "6", "7", "8", "9", "10", "11", "12"]
+    registry = get_metadata_registry()
 
     class_num = st.selectbox(
         "Select Class",
-        options=class_options,
+        options=registry.classes(),
         key='class_selector'
     )
 
-    if class_num != st.session_state.selected_class:
-        st.session_state.selected_class = class_num
-        class_metadata = load_class_metadata(class_num)
-
-        if class_metadata:
-            st.session_state.temp_metadata = class_metadata
-
-    if 'temp_metadata' in st.session_state and st.session_state.temp_metadata:
-        metadata = st.session_state.temp_metadata
+    form = registry.form(class_num)
+    if form:
+        fields = form['fields']
 
         col1, col2, col3 = st.columns(3)
 
@@ -90,48 +101,37 @@ def render_metadata_form():
 
             subject = st.selectbox(
                 "Subject",
-                options=metadata.get('available_subjects', ["Mathematics"]),
-                index=metadata.get('available_subjects', ["Mathematics"]).index(
-                    metadata.get('default_subject', 'Mathematics')
-                )
+                options=fields['subject']['options'],
+                index=fields['subject']['index']
             )
 
             board = st.selectbox(
                 "Board",
-                options=metadata.get('boards', ["CBSE"]),
-                index=metadata.get('boards', ["CBSE"]).index(
-                    metadata.get('default_board', 'CBSE')
-                )
+                options=fields['board']['options'],
+                index=fields['board']['index']
             )
 
             exam_type = st.selectbox(
                 "Exam Type",
-                options=metadata.get('exam_types', ["Unit Test"]),
-                index=metadata.get('exam_types', ["Unit Test"]).index(
-                    metadata.get('default_exam_type', 'Unit Test')
-                )
+                options=fields['exam_type']['options'],
+                index=fields['exam_type']['index']
             )
 
         with col2:
             st.markdown("**⚙️ Evaluation Settings**")
 
-            strictness_config = metadata.get('checking_strictness', {})
             strictness = st.select_slider(
                 "Checking Strictness",
-                options=strictness_config.get(
-                    'options',
-                    ['Lenient', 'Moderate', 'Strict', 'Very Strict']
-                ),
-                value=strictness_config.get('default', 'Moderate')
+                options=fields['strictness']['options'],
+                value=fields['strictness']['default']
             )
 
-            st.markdown(f"*{strictness_config.get('description', '')}*")
+            st.markdown(f"*{fields['strictness']['description']}*")
 
-            answer_depth_config = metadata.get('answer_depth', {})
             answer_depth = st.select_slider(
                 "Expected Answer Depth",
-                options=answer_depth_config.get('options', ['Basic', 'Intermediate', 'Advanced', 'Expert']),
-                value=answer_depth_config.get('default', 'Intermediate')
+                options=fields['answer_depth']['options'],
+                value=fields['answer_depth']['default']
             )
 
             focus_areas = st.multiselect(
@@ -144,23 +144,16 @@ def render_metadata_form():
         with col3:
             st.markdown("**💬 Feedback Settings**")
 
-            tone_config = metadata.get('feedback_tone', {})
             feedback_tone = st.selectbox(
                 "Feedback Tone",
-                options=tone_config.get('options', ["Highly Encouraging", "Balanced", "Direct", "Critical"]),
-                index=tone_config.get('options', ["Highly Encouraging", "Balanced", "Direct", "Critical"]).index(
-                    tone_config.get('default', 'Balanced')
-                )
+                options=fields['feedback_tone']['options'],
+                index=fields['feedback_tone']['index']
             )
 
-            explanation_config = metadata.get('explanation_level', {})
             explanation_level = st.selectbox(
                 "Explanation Level",
-                options=explanation_config.get('options', ["Simple", "Moderate", "Grade-appropriate", "Exam-Oriented"]),
-                index=explanation_config.get('options',
-                                             ["Simple", "Moderate", "Grade-appropriate", "Exam-Oriented"]).index(
-                    explanation_config.get('default', 'Grade-appropriate')
-                )
+                options=fields['explanation_level']['options'],
+                index=fields['explanation_level']['index']
             )
 
         return {
@@ -173,12 +166,22 @@ def render_metadata_form():
             'answer_depth': answer_depth,
             'feedback_tone': feedback_tone,
             'explanation_level': explanation_level,
-            'key_topics': metadata.get('key_topics', {}).get(subject, [])
+            'key_topics': list(form['topics'].get(subject, ()))
         }
 
     return None
 
 
+def merged_answer_sheet(page_photos):
+    # Merging is CPU work, so the PDF is kept until the set of photos changes.
+    file_ids = tuple(file.file_id for file in page_photos)
+    cached = st.session_state.get('merged_answer_sheet')
+    if cached is None or cached[0] != file_ids:
+        cached = (file_ids, merge_images_to_pdf(page_photos))
+        st.session_state.merged_answer_sheet = cached
+    return cached[1]
+
+
 def render_upload_section():
     st.markdown("### 📤 Upload Examination Documents")
 
@@ -214,14 +217,21 @@ def render_upload_section():
 
     with col2:
         st.markdown("**✍️ Student Answer Sheet**")
-        answer_file = st.file_uploader(
-            "Upload student's answer sheet",
+        answer_files = st.file_uploader(
+            "Upload student's answer sheet (one file, or one photo per page)",
             type=['pdf', 'txt', 'png', 'jpg', 'jpeg'],
+            accept_multiple_files=True,
             key='answers'
         )
-        if answer_file:
-            files_data['answer_sheet'] = answer_file
-            st.success(f"✓ {answer_file.name}")
+        if len(answer_files) == 1:
+            files_data['answer_sheet'] = answer_files[0]
+            st.success(f"✓ {answer_files[0].name}")
+        elif answer_files:
+            if all(file.type.startswith('image/') for file in answer_files):
+                files_data['answer_sheet'] = merged_answer_sheet(answer_files)
+                st.success(f"✓ {len(answer_files)} page photos merged into one PDF")
+            else:
+                st.error("Upload either a single answer sheet file or one photo per page.")
 
         st.markdown("**🔑 Answer Key (Optional)**")
         answer_key_file = st.file_uploader(
@@ -236,6 +246,62 @@ def render_upload_section():
     return files_data
 
 
+def render_batch_upload_section():
+    st.markdown("### 📤 Upload Class Documents")
+
+    col1, col2 = st.columns(2)
+
+    shared_files = {
+        'syllabus': None,
+        'question_paper': None,
+        'answer_key': None
+    }
+
+    with col1:
+        st.markdown("**📝 Question Paper**")
+        question_file = st.file_uploader(
+            "Upload question paper",
+            type=['pdf', 'txt', 'png', 'jpg', 'jpeg'],
+            key='batch_questions'
+        )
+        if question_file:
+            shared_files['question_paper'] = question_file
+            st.success(f"✓ {question_file.name}")
+
+        st.markdown("**🔑 Answer Key (Optional)**")
+        answer_key_file = st.file_uploader(
+            "Upload answer key for accurate grading",
+            type=['pdf', 'txt', 'png', 'jpg', 'jpeg'],
+            key='batch_answer_key'
+        )
+        if answer_key_file:
+            shared_files['answer_key'] = answer_key_file
+            st.success(f"✓ {answer_key_file.name}")
+
+        st.markdown("**📚 Syllabus (Optional)**")
+        syllabus_file = st.file_uploader(
+            "Upload syllabus to map topics accurately",
+            type=['pdf', 'txt', 'png', 'jpg', 'jpeg'],
+            key='batch_syllabus'
+        )
+        if syllabus_file:
+            shared_files['syllabus'] = syllabus_file
+            st.success(f"✓ {syllabus_file.name}")
+
+    with col2:
+        st.markdown("**✍️ Student Answer Sheets**")
+        answer_files = st.file_uploader(
+            "Upload one answer sheet per student",
+            type=['pdf', 'txt', 'png', 'jpg', 'jpeg'],
+            accept_multiple_files=True,
+            key='batch_answers'
+        )
+        if answer_files:
+            st.success(f"✓ {len(answer_files)} answer sheets")
+
+    return shared_files, answer_files or []
+
+
 def validate_inputs(metadata, files_data):
     errors = []
 
@@ -251,340 +317,226 @@ def validate_inputs(metadata, files_data):
     return errors
 
 
-def render_analysis_results(analysis, metadata):
-    st.markdown("---")
-    st.markdown("# 📊 Examination Analysis Report")
-
-    personal_details = analysis.get('personal_details', {})
-
-    if personal_details:
-        st.markdown(f"""
-        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white; margin-bottom: 2rem;'>
-            <h2 style='margin: 0; color: white;'>Student Performance Overview</h2>
-            <p style='margin: 0.5rem 0 0 0; opacity: 0.9;'>
-                {personal_details.get('student_name', 'Student')} • 
-                Roll No: {personal_details.get('roll_number', 'N/A')} • 
-                Class {personal_details.get('class', metadata['class'])} • 
-                {personal_details.get('subject', metadata['subject'])}
-            </p>
-            <p style='margin: 0.3rem 0 0 0; opacity: 0.8; font-size: 0.9rem;'>
-                {personal_details.get('exam_name', metadata['exam_type'])} • 
-                {personal_details.get('date', 'Date not available')}
-            </p>
-        </div>
-        """, unsafe_allow_html=True)
-    else:
-        st.markdown(f"""
-        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white; margin-bottom: 2rem;'>
-            <h2 style='margin: 0; color: white;'>Student Performance Overview</h2>
-            <p style='margin: 0.5rem 0 0 0; opacity: 0.9;'>Class {metadata['class']} • {metadata['subject']} • {metadata['exam_type']}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    col1, col2, col3, col4 = st.columns(4)
-
-    overall_score = analysis.get('overall_score', {})
-
-    total_marks = overall_score.get('total_marks', 100)
-    marks_obtained = overall_score.get('total_marks_obtained', 0)
-    percentage = (marks_obtained / total_marks * 100) if total_marks > 0 else 0
+def render_personal_details(view):
+    st.markdown(view, unsafe_allow_html=True)
 
-    with col1:
-        st.markdown(f"""
-        <div style='background: #4CAF50; padding: 1.5rem; border-radius: 8px; text-align: center;'>
-            <h3 style='margin: 0; color: white; font-size: 2.5rem;'>{percentage:.1f}%</h3>
-            <p style='margin: 0.5rem 0 0 0; color: white; opacity: 0.9;'>Overall Score</p>
-            <p style='margin: 0.3rem 0 0 0; color: white; opacity: 0.8; font-size: 0.9rem;'>{marks_obtained}/{total_marks} marks</p>
-        </div>
-        """, unsafe_allow_html=True)
 
-    with col2:
-        st.markdown(f"""
-        <div style='background: #2196F3; padding: 1.5rem; border-radius: 8px; text-align: center;'>
-            <h3 style='margin: 0; color: white; font-size: 2.5rem;'>{overall_score.get('total_questions', 0)}</h3>
-            <p style='margin: 0.5rem 0 0 0; color: white; opacity: 0.9;'>Total Questions</p>
-            <p style='margin: 0.3rem 0 0 0; color: white; opacity: 0.8; font-size: 0.9rem;'>Attempted: {overall_score.get('attempted_questions', 0)}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col3:
-        st.markdown(f"""
-        <div style='background: #FF9800; padding: 1.5rem; border-radius: 8px; text-align: center;'>
-            <h3 style='margin: 0; color: white; font-size: 2.5rem;'>{overall_score.get('correct_answers', 0)}</h3>
-            <p style='margin: 0.5rem 0 0 0; color: white; opacity: 0.9;'>Correct Answers</p>
-            <p style='margin: 0.3rem 0 0 0; color: white; opacity: 0.8; font-size: 0.9rem;'>Partial: {overall_score.get('partially_correct', 0)}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col4:
-        accuracy = overall_score.get('accuracy_percentage', 0)
-        st.markdown(f"""
-        <div style='background: #9C27B0; padding: 1.5rem; border-radius: 8px; text-align: center;'>
-            <h3 style='margin: 0; color: white; font-size: 2.5rem;'>{accuracy:.0f}%</h3>
-            <p style='margin: 0.5rem 0 0 0; color: white; opacity: 0.9;'>Accuracy</p>
-            <p style='margin: 0.3rem 0 0 0; color: white; opacity: 0.8; font-size: 0.9rem;'>Incorrect: {overall_score.get('incorrect_answers', 0)}</p>
-        </div>
-        """, unsafe_allow_html=True)
+def render_overall_score(view):
+    for column, card in zip(st.columns(4), view):
+        column.markdown(card, unsafe_allow_html=True)
 
     st.markdown("<br>", unsafe_allow_html=True)
 
-    st.markdown("## 📚 Topic-Wise Performance Analysis")
 
-    topic_analysis = analysis.get('topic_analysis', {})
+def render_topic_performance(view):
+    st.markdown("## 📚 Topic-Wise Performance Analysis")
 
-    if topic_analysis:
+    if view:
         col1, col2 = st.columns(2)
 
         with col1:
             st.markdown("### ✅ Strong Topics")
-            strong_topics = topic_analysis.get('strong_topics', [])
-            if strong_topics:
-                for topic in strong_topics:
-                    st.markdown(f"""
-                    <div style='background: #E8F5E9; padding: 1rem; border-left: 4px solid #4CAF50; margin-bottom: 0.5rem; border-radius: 4px;'>
-                        <strong style='color: #2E7D32;'>{topic['name']}</strong><br>
-                        <span style='color: #66BB6A;'>Score: {topic['score']}%</span><br>
-                        <small style='color: #555;'>{topic['feedback']}</small>
-                    </div>
-                    """, unsafe_allow_html=True)
+            if view['strong']:
+                for card in view['strong']:
+                    st.markdown(card, unsafe_allow_html=True)
             else:
                 st.info("No strong topics identified")
 
         with col2:
             st.markdown("### ⚠️ Areas for Improvement")
-            weak_topics = topic_analysis.get('weak_topics', [])
-            if weak_topics:
-                for topic in weak_topics:
-                    st.markdown(f"""
-                    <div style='background: #FFF3E0; padding: 1rem; border-left: 4px solid #FF9800; margin-bottom: 0.5rem; border-radius: 4px;'>
-                        <strong style='color: #E65100;'>{topic['name']}</strong><br>
-                        <span style='color: #FB8C00;'>Score: {topic['score']}%</span><br>
-                        <small style='color: #555;'>{topic['suggestion']}</small>
-                    </div>
-                    """, unsafe_allow_html=True)
+            if view['weak']:
+                for card in view['weak']:
+                    st.markdown(card, unsafe_allow_html=True)
             else:
                 st.success("All topics show good performance!")
 
-        if topic_analysis.get('not_assessed'):
+        if view['not_assessed']:
             with st.expander("📋 Topics Not Covered in This Exam"):
                 st.info("These syllabus topics were not tested in this examination:")
-                for topic in topic_analysis['not_assessed']:
-                    st.write(f"• {topic}")
+                for topic in view['not_assessed']:
+                    st.write(topic)
 
-    st.markdown("---")
-    st.markdown("## 📝 Question-Wise Detailed Breakdown")
 
-    question_breakdown = analysis.get('question_wise_breakdown', {})
+def render_question_breakdown(view):
+    st.markdown("## 📝 Question-Wise Detailed Breakdown")
 
-    highly_accurate = question_breakdown.get('highly_accurate_questions', [])
-    if highly_accurate:
-        for item in highly_accurate:
-            question_nums = item.get('question_numbers', [])
-            if question_nums:
-                st.success(
-                    f"✅ **Questions {', '.join(map(str, question_nums))}** ({item.get('topic', 'Topic')}): {item.get('summary', 'Perfectly answered')}")
+    for summary in view['accurate']:
+        st.success(summary)
 
-    needs_improvement = question_breakdown.get('needs_improvement', [])
-    if needs_improvement:
+    if view['needs_improvement']:
         st.markdown("### Questions Needing Attention")
-        for q in needs_improvement:
-            with st.expander(
-                    f"❌ Question {q['question_number']}: {q.get('topic', 'Topic')} - {q['marks_obtained']}/{q['total_marks']} marks"):
-                st.markdown(f"**Question:** {q.get('question_text', 'N/A')}")
+        for q in view['needs_improvement']:
+            with st.expander(q['label']):
+                st.markdown(q['question'])
                 st.markdown(f"**Student's Answer:**")
-                st.info(q.get('student_answer', 'N/A'))
+                st.info(q['student_answer'])
                 st.markdown(f"**Expected Answer:**")
-                st.success(q.get('expected_answer', 'N/A'))
+                st.success(q['expected_answer'])
 
-                if q.get('what_was_correct'):
-                    st.markdown(f"✅ **What was correct:** {q['what_was_correct']}")
+                if q['correct']:
+                    st.markdown(q['correct'])
 
-                if q.get('what_was_wrong'):
-                    st.markdown(f"❌ **What was wrong:** {q['what_was_wrong']}")
+                if q['wrong']:
+                    st.markdown(q['wrong'])
 
-                if q.get('issues'):
-                    st.warning(f"**Issues identified:** {', '.join(q['issues'])}")
+                if q['issues']:
+                    st.warning(q['issues'])
 
-                st.markdown(f"**Feedback:** {q.get('feedback', 'N/A')}")
+                st.markdown(q['feedback'])
 
-    st.markdown("---")
+
+def render_error_analysis(view):
     st.markdown("## ❌ Error Analysis")
 
-    error_analysis = analysis.get('error_analysis', {})
-    if error_analysis:
-        col1, col2, col3 = st.columns(3)
+    if view:
+        for column, metrics in zip(st.columns(3), view['columns']):
+            with column:
+                for label, value in metrics:
+                    st.metric(label, value)
 
-        conceptual_errors = error_analysis.get('conceptual_errors', [])
-        calculation_mistakes = error_analysis.get('calculation_mistakes', [])
-        incomplete_steps = error_analysis.get('incomplete_steps', [])
-        poor_explanation = error_analysis.get('poor_explanation', [])
-        notation_errors = error_analysis.get('notation_errors', [])
-        time_management = error_analysis.get('time_management_issues', 0)
+        if view['details']:
+            with st.expander("📋 Detailed Error Breakdown"):
+                for heading, cards in view['details']:
+                    st.markdown(heading)
+                    for card in cards:
+                        st.markdown(card, unsafe_allow_html=True)
 
-        conceptual_count = len(conceptual_errors) if isinstance(conceptual_errors, list) else conceptual_errors
-        calculation_count = len(calculation_mistakes) if isinstance(calculation_mistakes,
-                                                                    list) else calculation_mistakes
-        incomplete_count = len(incomplete_steps) if isinstance(incomplete_steps, list) else incomplete_steps
-        poor_exp_count = len(poor_explanation) if isinstance(poor_explanation, list) else poor_explanation
-        notation_count = len(notation_errors) if isinstance(notation_errors, list) else notation_errors
 
-        with col1:
-            st.metric("Conceptual Errors", conceptual_count)
-            st.metric("Calculation Mistakes", calculation_count)
+def render_strengths(view):
+    st.markdown("## ✅ Strengths Identified")
+    for card in view:
+        st.markdown(card, unsafe_allow_html=True)
 
-        with col2:
-            st.metric("Incomplete Steps", incomplete_count)
-            st.metric("Poor Explanation", poor_exp_count)
 
-        with col3:
-            st.metric("Notation Errors", notation_count)
-            st.metric("Time Management", time_management if isinstance(time_management, (int, float)) else 0)
-
-        detailed_errors_found = False
-
-        if isinstance(conceptual_errors, list) and conceptual_errors:
-            detailed_errors_found = True
-        if isinstance(calculation_mistakes, list) and calculation_mistakes:
-            detailed_errors_found = True
-        if isinstance(incomplete_steps, list) and incomplete_steps:
-            detailed_errors_found = True
-        if isinstance(poor_explanation, list) and poor_explanation:
-            detailed_errors_found = True
-        if isinstance(notation_errors, list) and notation_errors:
-            detailed_errors_found = True
-
-        if detailed_errors_found:
-            with st.expander("📋 Detailed Error Breakdown"):
-                if isinstance(conceptual_errors, list) and conceptual_errors:
-                    st.markdown("### 🧠 Conceptual Errors")
-                    for error in conceptual_errors:
-                        st.markdown(f"""
-                        <div style='background: #FFEBEE; padding: 1rem; border-left: 4px solid #F44336; margin-bottom: 0.5rem; border-radius: 4px;'>
-                            <strong style='color: #C62828;'>Severity: {error.get('severity', 'Medium')}</strong><br>
-                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
-                            <span style='color: #555;'><strong>Questions Affected:</strong> {', '.join(map(str, error.get('questions_affected', [])))}</span><br>
-                            <span style='color: #555;'><strong>Example:</strong> {error.get('example', '')}</span><br>
-                            <small style='color: #1976D2;'>💡 <strong>Remedy:</strong> {error.get('remedy', '')}</small>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                if isinstance(calculation_mistakes, list) and calculation_mistakes:
-                    st.markdown("### 🔢 Calculation Mistakes")
-                    for error in calculation_mistakes:
-                        st.markdown(f"""
-                        <div style='background: #FFF3E0; padding: 1rem; border-left: 4px solid #FF9800; margin-bottom: 0.5rem; border-radius: 4px;'>
-                            <span style='color: #555;'><strong>Type:</strong> {error.get('description', '')}</span><br>
-                            <span style='color: #555;'><strong>Questions Affected:</strong> {', '.join(map(str, error.get('questions_affected', [])))}</span><br>
-                            <span style='color: #555;'><strong>Pattern:</strong> {error.get('pattern', '')}</span><br>
-                            <small style='color: #1976D2;'>💡 <strong>Example:</strong> {error.get('example', '')}</small>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                if isinstance(incomplete_steps, list) and incomplete_steps:
-                    st.markdown("### 📝 Incomplete Steps")
-                    for error in incomplete_steps:
-                        st.markdown(f"""
-                        <div style='background: #E3F2FD; padding: 1rem; border-left: 4px solid #2196F3; margin-bottom: 0.5rem; border-radius: 4px;'>
-                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
-                            <span style='color: #555;'><strong>Questions Affected:</strong> {', '.join(map(str, error.get('questions_affected', [])))}</span><br>
-                            <span style='color: #555;'><strong>Missing Steps:</strong> {', '.join(error.get('missing_steps', []))}</span><br>
-                            <small style='color: #1976D2;'>💡 <strong>Impact:</strong> {error.get('impact', '')}</small>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                if isinstance(poor_explanation, list) and poor_explanation:
-                    st.markdown("### 💬 Poor Explanation")
-                    for error in poor_explanation:
-                        st.markdown(f"""
-                        <div style='background: #F3E5F5; padding: 1rem; border-left: 4px solid #9C27B0; margin-bottom: 0.5rem; border-radius: 4px;'>
-                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
-                            <span style='color: #555;'><strong>Questions Affected:</strong> {', '.join(map(str, error.get('questions_affected', [])))}</span><br>
-                            <small style='color: #1976D2;'>💡 <strong>Suggestion:</strong> {error.get('suggestion', '')}</small><br>
-                            <small style='color: #555;'><strong>Example:</strong> {error.get('example', '')}</small>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                if isinstance(notation_errors, list) and notation_errors:
-                    st.markdown("### 🔤 Notation Errors")
-                    for error in notation_errors:
-                        st.markdown(f"""
-                        <div style='background: #FCE4EC; padding: 1rem; border-left: 4px solid #E91E63; margin-bottom: 0.5rem; border-radius: 4px;'>
-                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
-                            <span style='color: #555;'><strong>Questions Affected:</strong> {', '.join(map(str, error.get('questions_affected', [])))}</span><br>
-                            <small style='color: #1976D2;'>💡 <strong>Correct Notation:</strong> {error.get('correct_notation', '')}</small><br>
-                            <small style='color: #555;'><strong>Example:</strong> {error.get('example', '')}</small>
-                        </div>
-                        """, unsafe_allow_html=True)
+def render_improvements(view):
+    st.markdown("## 🎯 Improvement Recommendations")
+    for card in view:
+        st.markdown(card, unsafe_allow_html=True)
+
+
+def render_personal_feedback(view):
+    st.markdown("## 💬 Personalized Feedback")
+
+    if 'fallback' in view:
+        st.markdown(view['fallback'], unsafe_allow_html=True)
+        return
+
+    st.markdown(view['banner'], unsafe_allow_html=True)
+
+    if view['takeaways']:
+        st.markdown("### 🎯 Key Takeaways")
+        for takeaway in view['takeaways']:
+            st.info(takeaway)
+
+    if view['actions']:
+        st.markdown("### 📋 Action Plan")
+        for action in view['actions']:
+            st.success(action)
+
+    if view['motivation']:
+        st.markdown(view['motivation'], unsafe_allow_html=True)
+
+    if view['potential']:
+        st.markdown(view['potential'], unsafe_allow_html=True)
 
+
+REPORT_SECTION_RENDERERS = {
+    'personal_details': render_personal_details,
+    'overall_score': render_overall_score,
+    'topic_wise_performance': render_topic_performance,
+    'question_wise_breakdown': render_question_breakdown,
+    'error_analysis': render_error_analysis,
+    'strengths': render_strengths,
+    'improvements_needed': render_improvements,
+    'personal_feedback': render_personal_feedback,
+}
+
+
+def create_report_layout():
     st.markdown("---")
+    st.markdown("# 📊 Examination Analysis Report")
 
-    col1, col2 = st.columns(2)
+    slots = {
+        'personal_details': st.empty(),
+        'overall_score': st.empty(),
+        'topic_wise_performance': st.empty(),
+    }
 
-    with col1:
-        st.markdown("## ✅ Strengths Identified")
-        strengths = analysis.get('strengths', [])
-        for strength in strengths:
-            st.markdown(f"""
-            <div style='background: #E8F5E9; padding: 0.8rem; margin-bottom: 0.5rem; border-radius: 4px;'>
-                <span style='color: #2E7D32;'>✓ {strength}</span>
-            </div>
-            """, unsafe_allow_html=True)
+    st.markdown("---")
+    slots['question_wise_breakdown'] = st.empty()
 
-    with col2:
-        st.markdown("## 🎯 Improvement Recommendations")
-        improvements = analysis.get('improvements', [])
-        for improvement in improvements:
-            st.markdown(f"""
-            <div style='background: #FFF3E0; padding: 0.8rem; margin-bottom: 0.5rem; border-radius: 4px;'>
-                <span style='color: #E65100;'>→ {improvement}</span>
-            </div>
-            """, unsafe_allow_html=True)
+    st.markdown("---")
+    slots['error_analysis'] = st.empty()
 
     st.markdown("---")
-    st.markdown("## 💬 Personalized Feedback")
 
-    personal_feedback = analysis.get('personal_feedback', {})
-
-    if personal_feedback:
-        st.markdown(f"""
-        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white;'>
-            <h3 style='margin: 0 0 1rem 0; color: white;'>{personal_feedback.get('opening', 'Dear Student,')}</h3>
-            <p style='margin: 0.5rem 0; line-height: 1.6;'><strong>Overall Impression:</strong> {personal_feedback.get('overall_impression', '')}</p>
-            <p style='margin: 0.5rem 0; line-height: 1.6;'>{personal_feedback.get('detailed_analysis', '')}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-        if personal_feedback.get('key_takeaways'):
-            st.markdown("### 🎯 Key Takeaways")
-            for takeaway in personal_feedback['key_takeaways']:
-                st.info(f"💡 {takeaway}")
-
-        if personal_feedback.get('action_plan'):
-            st.markdown("### 📋 Action Plan")
-            for i, action in enumerate(personal_feedback['action_plan'], 1):
-                st.success(f"**Step {i}:** {action}")
-
-        if personal_feedback.get('motivation'):
-            st.markdown(f"""
-            <div style='background: #E8F5E9; padding: 1.5rem; border-radius: 8px; border-left: 4px solid #4CAF50; margin-top: 1rem;'>
-                <p style='margin: 0; color: #2E7D32; font-style: italic;'>"{personal_feedback['motivation']}"</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-        if personal_feedback.get('estimated_improvement_potential'):
-            st.markdown(f"""
-            <div style='background: #FFF3E0; padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
-                <strong style='color: #E65100;'>📈 Improvement Potential:</strong><br>
-                <span style='color: #555;'>{personal_feedback['estimated_improvement_potential']}</span>
-            </div>
-            """, unsafe_allow_html=True)
-    else:
-        feedback = analysis.get('personalized_feedback', '')
-        st.markdown(f"""
-        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white;'>
-            {feedback}
-        </div>
-        """, unsafe_allow_html=True)
+    col1, col2 = st.columns(2)
+    slots['strengths'] = col1.empty()
+    slots['improvements_needed'] = col2.empty()
+
+    st.markdown("---")
+    slots['personal_feedback'] = st.empty()
+    return slots
+
+
+@st.fragment
+def render_report_fragment(key, view):
+    # Each section is its own fragment, so an interaction inside one section
+    # reruns only that section, from its prebuilt view.
+    REPORT_SECTION_RENDERERS[key](view)
+
+
+def render_report_section(slots, key, view):
+    if key not in REPORT_SECTION_RENDERERS:
+        return
+    with slots[key].container():
+        render_report_fragment(key, view)
+
+
+def get_report_view(analysis, metadata):
+    # Built once per result; reruns for unrelated widgets reuse it.
+    cached = st.session_state.get('report_view')
+    if cached is None or cached[0] is not analysis or cached[1] != metadata:
+        cached = (analysis, metadata, build_report_view(analysis, metadata))
+        st.session_state.report_view = cached
+    return cached[2]
+
+
+def get_student_progress(analysis, metadata):
+    # Topics with more than one result for this student, from the student
+    # history index; looked up once per report.
+    cached = st.session_state.get('student_progress')
+    if cached is None or cached[0] is not analysis:
+        student = find_student_for_analysis(analysis)
+        trends = get_topic_trends(student['student_id'], metadata['subject']) if student else {}
+        cached = (analysis, {topic: points for topic, points in trends.items() if len(points) > 1})
+        st.session_state.student_progress = cached
+    return cached[1]
+
+
+def render_student_progress(analysis, metadata):
+    trends = get_student_progress(analysis, metadata)
+    if not trends:
+        return
+
+    with st.expander("📈 Progress Across Past Exams"):
+        st.dataframe([{
+            'Topic': topic,
+            'Exams': len(points),
+            'First %': points[0]['accuracy'],
+            'Latest %': points[-1]['accuracy'],
+            'Change': round(points[-1]['accuracy'] - points[0]['accuracy'], 1),
+            'History': ' → '.join(f"{point['accuracy']:g} ({point['exam_type']})" for point in points),
+        } for topic, points in trends.items()], use_container_width=True)
+
+
+def render_analysis_results(analysis, metadata):
+    report_view = get_report_view(analysis, metadata)
+    slots = create_report_layout()
+    for key, view in report_view.items():
+        render_report_section(slots, key, view)
+
+    render_student_progress(analysis, metadata)
 
     st.markdown("---")
 
@@ -595,7 +547,26 @@ def render_analysis_results(analysis, metadata):
             st.rerun()
 
 
+def get_chat_state(analysis):
+    # The compact context and the persisted conversation are tied to the
+    # report being discussed; both are rebuilt only when it changes.
+    if st.session_state.get('chat_context_source') is not analysis:
+        st.session_state.chat_context = build_chat_context(analysis)
+        st.session_state.chat_session = ChatSession.load(
+            chat_session_id(analysis, st.session_state.viewer_id)
+        )
+        st.session_state.chat_context_source = analysis
+    return st.session_state.chat_context, st.session_state.chat_session
+
+
 def render_chat_interface(analysis, metadata, client):
+    chat_context, chat_session = get_chat_state(analysis)
+    # Single-student jobs precompute quick answers as soon as grading ends;
+    # any other report (e.g. from a batch) gets them when its chat opens.
+    if st.session_state.get('quick_answers_source') is not analysis:
+        schedule_quick_answers(client, analysis, metadata)
+        st.session_state.quick_answers_source = analysis
+
     st.markdown("---")
     st.markdown("# 💬 Performance Discussion Chat")
 
@@ -606,29 +577,29 @@ def render_chat_interface(analysis, metadata, client):
     st.markdown("Ask questions about your performance, feedback, or request study suggestions!")
     st.markdown("---")
 
-    if st.session_state.chat_history:
-        for message in st.session_state.chat_history:
-            if message['role'] == 'user':
-                with st.chat_message("user"):
-                    st.markdown(message['content'])
-            else:
-                with st.chat_message("assistant"):
-                    st.markdown(message['content'])
-    else:
-        st.info(
-            "👋 Hi! I'm your AI tutor. Ask me anything about your exam performance, specific mistakes, or how to improve!")
+    # New turns are written into this container below the existing history,
+    # so answering a question never needs a full rerun of the page.
+    history = st.container()
+    with history:
+        if chat_session.messages:
+            for message in chat_session.messages:
+                if message['role'] == 'user':
+                    with st.chat_message("user"):
+                        st.markdown(message['content'])
+                else:
+                    with st.chat_message("assistant"):
+                        st.markdown(message['content'])
+        else:
+            greeting = st.empty()
+            greeting.info(
+                "👋 Hi! I'm your AI tutor. Ask me anything about your exam performance, specific mistakes, or how to improve!")
 
     st.markdown("---")
     st.markdown("**💡 Quick Questions:**")
-    q_col1, q_col2, q_col3 = st.columns(3)
-
     quick_question = None
-    if q_col1.button("📚 What should I study first?"):
-        quick_question = "Based on my weak topics, what should I focus on first to improve?"
-    if q_col2.button("🎯 How to avoid silly mistakes?"):
-        quick_question = "I noticed some calculation errors. How can I improve my accuracy?"
-    if q_col3.button("📈 Score improvement tips?"):
-        quick_question = "What is a realistic score improvement I can achieve if I fix my errors?"
+    for column, (label, question) in zip(st.columns(len(QUICK_QUESTIONS)), QUICK_QUESTIONS):
+        if column.button(label):
+            quick_question = question
 
     user_question = st.chat_input("Type your question here...")
 
@@ -636,23 +607,251 @@ def render_chat_interface(analysis, metadata, client):
         user_question = quick_question
 
     if user_question:
-        st.session_state.chat_history.append({
-            'role': 'user',
-            'content': user_question
-        })
-
-        with st.spinner("🤔 Thinking..."):
-            ai_response = chat_with_gemini(client, user_question, analysis, metadata)
-            st.session_state.chat_history.append({
-                'role': 'assistant',
-                'content': ai_response
-            })
+        precomputed = None
+        if quick_question:
+            precomputed = (get_quick_answers(quick_answers_key(analysis, metadata)) or {}).get(quick_question)
+            record_quick_answer_lookup(precomputed is not None)
+
+        with history:
+            if not chat_session.messages:
+                greeting.empty()
+            with st.chat_message("user"):
+                st.markdown(user_question)
+            with st.chat_message("assistant"):
+                if precomputed:
+                    st.markdown(precomputed)
+                    chat_session.add_exchange(user_question, precomputed)
+                    chat_session.save()
+                else:
+                    st.write_stream(stream_chat_with_gemini(client, user_question, analysis, metadata,
+                                                            chat_context=chat_context, session=chat_session))
+
+
+def summarize_batch_result(result):
+    analysis = result['analysis'] or {}
+    personal_details = analysis.get('personal_details', {})
+    overall_score = analysis.get('overall_score', {})
+
+    total_marks = overall_score.get('total_marks', 0) or 0
+    marks_obtained = overall_score.get('total_marks_obtained', 0) or 0
+
+    return {
+        'File': result['file_name'],
+        'Student': personal_details.get('student_name', 'Not found'),
+        'Roll No': personal_details.get('roll_number', 'Not found'),
+        'Marks': f"{marks_obtained}/{total_marks}" if analysis else '-',
+        'Score %': round(marks_obtained / total_marks * 100, 1) if total_marks else None,
+        'Accuracy %': overall_score.get('accuracy_percentage'),
+        'Time (s)': round(result.get('elapsed', 0), 1),
+        'Status': '✅ Graded' if analysis else f"❌ {result['error']}"
+    }
+
+
+def render_batch_results(metadata):
+    results = st.session_state.batch_results
+    if not results:
+        return
+
+    st.markdown("---")
+    st.markdown("# 📊 Class Grading Summary")
+    st.dataframe([summarize_batch_result(r) for r in results], use_container_width=True)
+
+    graded = [r for r in results if r['analysis']]
+    if not graded:
+        return
+
+    selected = st.selectbox(
+        "Open full report for",
+        options=range(len(graded)),
+        format_func=lambda i: summarize_batch_result(graded[i])['Student'] + f" ({graded[i]['file_name']})",
+        key='batch_report_selector'
+    )
+
+    if st.session_state.analysis_results is not graded[selected]['analysis']:
+        st.session_state.analysis_results = graded[selected]['analysis']
+        st.session_state.analysis_complete = True
+
+    render_analysis_results(graded[selected]['analysis'], metadata)
+
+
+def render_class_analytics(metadata, shared_files):
+    # Only reports graded against this exact question paper are compared.
+    if not metadata or not shared_files.get('question_paper'):
+        return
+    summary = get_class_analytics(metadata['class'], metadata['subject'], metadata['exam_type'],
+                                  question_paper_hash(shared_files)).summary()
+    if not summary['reports']:
+        return
+
+    with st.expander(f"📈 Class {metadata['class']} {metadata['subject']} {metadata['exam_type']} analytics "
+                     f"({summary['students']} students, {summary['reports']} stored reports)"):
+        scores = summary['scores']
+        if scores['reports']:
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Mean Score", f"{scores['mean']}%")
+            col2.metric("Median", f"{scores['median']}%")
+            col3.metric("Middle 50%", f"{scores['p25']}–{scores['p75']}%")
+            col4.metric("Std Dev", scores['std'])
+            st.bar_chart({f"{lo}-{hi}%": count for lo, hi, count in scores['histogram']})
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**📚 Topic accuracy (weakest first)**")
+            st.dataframe(summary['topics'], use_container_width=True)
+        with col2:
+            st.markdown("**❓ Hardest questions**")
+            st.dataframe(summary['questions'], use_container_width=True)
+
+        st.markdown("**❌ Error categories**")
+        st.dataframe(summary['errors'], use_container_width=True)
+
+
+def render_batch_mode(client, metadata):
+    shared_files, answer_sheets = render_batch_upload_section()
 
+    st.markdown("---")
+
+    errors = []
+    if not metadata:
+        errors.append("Please configure exam metadata")
+    if not shared_files['question_paper']:
+        errors.append("Question paper is required")
+    if not answer_sheets:
+        errors.append("At least one student answer sheet is required")
+
+    max_workers = st.slider(
+        "Parallel gradings",
+        min_value=1,
+        max_value=16,
+        value=BATCH_MAX_WORKERS,
+        help="Upper bound on concurrent Gemini requests. Lower this if you hit API rate limits."
+    )
+
+    force_regrade = st.checkbox(
+        "🔁 Force re-grade (ignore stored results)",
+        key='batch_force_regrade'
+    )
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+
+    with col2:
+        grade_button = st.button(
+            f"🚀 Grade {len(answer_sheets)} Answer Sheets",
+            type="primary",
+            disabled=len(errors) > 0,
+            use_container_width=True
+        )
+
+    if grade_button:
+        documents = [
+            ("QUES_PAPER", shared_files['question_paper']),
+            ("ANS_KEY", shared_files['answer_key']),
+            ("Syll_KEY", shared_files['syllabus']),
+        ]
+        documents += [(f"ANS_SHEET_{i:02d}", sheet) for i, sheet in enumerate(answer_sheets, 1)]
+        if sync_to_github(documents, st.session_state.session_folder):
+            st.caption("🗄️ Documents queued for archiving in the background")
+
+        st.session_state.batch_results = []
+        progress_bar = st.progress(0, text=f"Grading 0/{len(answer_sheets)} answer sheets...")
+        live_placeholder = st.empty()
+        live_results = live_placeholder.container()
+
+        try:
+            for done, result in enumerate(
+                    grade_answer_sheets(client, shared_files, answer_sheets, metadata, max_workers,
+                                        force_regrade=force_regrade), 1):
+                st.session_state.batch_results.append(result)
+                row = summarize_batch_result(result)
+                with live_results:
+                    if result['analysis']:
+                        timing = "stored result" if result.get('cached') else f"{row['Time (s)']}s"
+                        st.success(f"✅ {row['File']}: {row['Student']} • {row['Marks']} marks ({timing})")
+                    else:
+                        st.error(f"❌ {row['File']}: {result['error']}")
+                progress_bar.progress(done / len(answer_sheets),
+                                      text=f"Grading {done}/{len(answer_sheets)} answer sheets...")
+        except AnalysisError as ae:
+            st.error(f"❌ {ae}")
+
+        progress_bar.empty()
+        live_placeholder.empty()
+
+        preprocessed = [result['preprocess'] for result in st.session_state.batch_results if result.get('preprocess')]
+        if preprocessed:
+            st.caption(format_preprocess_report(dict(enumerate(preprocessed))))
+
+    render_class_analytics(metadata, shared_files)
+    render_batch_results(metadata)
+
+
+def render_job_progress(job_id):
+    job = get_job(job_id)
+
+    if job is None:
+        st.session_state.active_job = None
+        if st.query_params.get('job') == job_id:
+            del st.query_params['job']
+        return
+
+    was_watching = st.session_state.active_job == job_id
+    metadata = job['metadata'] or st.session_state.metadata
+
+    if job['status'] in ACTIVE_STATUSES:
+        st.session_state.active_job = job_id
+
+        for level, message in job['messages']:
+            getattr(st, level)(message)
+
+        sections = job['sections']
+        if job['status'] == 'queued':
+            st.progress(0, text="⏳ Waiting for a free grading worker...")
+        else:
+            st.progress(
+                len(sections) / len(ANALYSIS_SECTIONS),
+                text=f"📥 Received {len(sections)}/{len(ANALYSIS_SECTIONS)} report sections..."
+            )
+
+        if sections:
+            slots = create_report_layout()
+            for key, view in build_report_view(sections, metadata, sections).items():
+                render_report_section(slots, key, view)
+
+        time.sleep(JOB_POLL_SECONDS)
         st.rerun()
 
+    st.session_state.active_job = None
+
+    if job['status'] == 'done':
+        st.session_state.analysis_results = job['result']
+        st.session_state.metadata = metadata
+        st.session_state.analysis_complete = True
+        if was_watching:
+            for level, message in job['messages']:
+                getattr(st, level)(message)
+            st.success("✅ Analysis Complete!")
+            st.balloons()
+    elif was_watching:
+        for level, message in job['messages']:
+            getattr(st, level)(message)
+        st.error(f"❌ {job['error']}")
+        if job['raw_output']:
+            st.expander("View Raw Output").code(job['raw_output'])
+        st.error("Analysis failed. Please try again.")
+
 
 def main():
     initialize_session_state()
+    start_job_queue()
+    start_student_index_backfill()
+    try:
+        get_metadata_registry().load()
+    except MetadataError as e:
+        st.error(f"Exam metadata is invalid, fix it and restart the app:\n\n{e}")
+        st.stop()
+    # Tags this browser session's Gemini requests so the shared scheduler can
+    # share capacity fairly between users.
+    set_request_session(st.session_state.session_folder)
 
     st.sidebar.title("🎓 AI Exam Review System")
     st.sidebar.markdown("---")
@@ -666,6 +865,51 @@ def main():
         unsafe_allow_html=True
     )
 
+    st.sidebar.markdown("---")
+    grading_mode = st.sidebar.radio("Grading Mode", [SINGLE_MODE, BATCH_MODE], key='grading_mode')
+
+    active_jobs = count_active_jobs()
+    if active_jobs:
+        st.sidebar.caption(f"🧵 {active_jobs} grading job(s) running on this server")
+
+    archive_stats = get_archive_stats()
+    if archive_stats and (archive_stats['pending'] or archive_stats['failed']):
+        st.sidebar.caption(
+            f"🗄️ Archive: {archive_stats['pending']} pending • {archive_stats['failed']} failed"
+        )
+
+    cache_stats = get_result_cache_stats()
+    st.sidebar.caption(
+        f"⚡ Result cache: {cache_stats['result_hits']} hits • {cache_stats['result_misses']} misses • "
+        f"{cache_stats.get('entries', 0)} stored"
+    )
+
+    scheduler_stats = get_scheduler_stats()
+    retries = sum(stage['retries'] for stage in scheduler_stats['stages'].values())
+    if scheduler_stats['queue_depth'] or scheduler_stats['in_flight'] or retries:
+        st.sidebar.caption(
+            f"🚦 Gemini requests: {scheduler_stats['in_flight']} in flight • "
+            f"{scheduler_stats['queue_depth']} queued • p95 wait {scheduler_stats['p95_wait_seconds']:.1f}s • "
+            f"{retries} retried"
+        )
+
+    router_stats = get_router_stats()
+    if router_stats:
+        st.sidebar.caption("🧭 Models: " + " • ".join(
+            f"{model} {stats['calls']} calls, avg {stats['avg_seconds']:.1f}s"
+            + (f", {stats['failures']} failed" if stats['failures'] else "")
+            for model, stats in router_stats.items()
+        ))
+
+    quick_stats = get_quick_answer_stats()
+    if quick_stats['precomputed']:
+        hit_rate = quick_stats.get('hit_rate')
+        st.sidebar.caption(
+            f"💬 Quick answers: {quick_stats['precomputed']} precomputed "
+            f"(avg {quick_stats['avg_precompute_seconds']:.1f}s) • "
+            f"hit rate {'n/a' if hit_rate is None else f'{hit_rate:.0%}'}"
+        )
+
     st.title("📝 AI-Powered Exam Analysis")
 
     try:
@@ -685,6 +929,10 @@ def main():
 
     st.markdown("---")
 
+    if grading_mode == BATCH_MODE:
+        render_batch_mode(client, metadata)
+        return
+
     files_data = render_upload_section()
 
     st.markdown("---")
@@ -693,6 +941,8 @@ def main():
 
     st.markdown("---")
 
+    force_regrade = st.checkbox("🔁 Force re-grade (ignore stored results)", key='force_regrade')
+
     col1, col2, col3 = st.columns([1, 2, 1])
 
     with col2:
@@ -708,27 +958,30 @@ def main():
             for error in errors:
                 st.error(f"❌ {error}")
         else:
-            with st.status("🔄 Documents are loading..", expanded=False) as status:
-                session_id = st.session_state.session_folder
-                if files_data['answer_sheet']:
-                    sync_to_github(files_data['answer_sheet'], "ANS_SHEET",session_id)
-                if files_data['question_paper']:
-                    sync_to_github(files_data['question_paper'], "QUES_PAPER",session_id)
-                if files_data['answer_key']:
-                    sync_to_github(files_data['answer_key'], "ANS_KEY",session_id)
-                if files_data['syllabus']:
-                    sync_to_github(files_data['answer_key'], "Syll_KEY",session_id)
-                status.update(label="✅ Documents Loaded Successfully ", state="complete")
-
-            analysis_results = analyze_exam_with_gemini(client, files_data, metadata)
-
-            if analysis_results:
-                st.session_state.analysis_results = analysis_results
-                st.session_state.analysis_complete = True
-                st.success("✅ Analysis Complete!")
-                st.balloons()
-            else:
-                st.error("Analysis failed. Please try again.")
+            documents = [
+                ("ANS_SHEET", files_data['answer_sheet']),
+                ("QUES_PAPER", files_data['question_paper']),
+                ("ANS_KEY", files_data['answer_key']),
+                ("Syll_KEY", files_data['syllabus']),
+            ]
+            if sync_to_github(documents, st.session_state.session_folder):
+                st.caption("🗄️ Documents queued for archiving in the background")
+
+            job_id = submit_job(
+                'analysis', run_analysis_job, client, snapshot_files(files_data), metadata,
+                force_regrade=force_regrade, metadata=metadata
+            )
+            st.session_state.active_job = job_id
+            st.session_state.analysis_results = None
+            st.session_state.analysis_complete = False
+            st.query_params['job'] = job_id
+
+    job_id = st.session_state.active_job
+    if not job_id and not st.session_state.analysis_complete:
+        # A reload starts a fresh session; the job id in the URL reattaches it.
+        job_id = st.query_params.get('job')
+    if job_id:
+        render_job_progress(job_id)
 
     if st.session_state.analysis_complete and st.session_state.analysis_results:
         render_analysis_results(st.session_state.analysis_results, st.session_state.metadata)
@@ -0,0 +1,275 @@
+import json
+import time
+import uuid
+import threading
+from types import SimpleNamespace
+from datetime import datetime, timezone, timedelta
+
+
+# Stand-ins for google.genai.Client that replay a recording instead of
+# calling Gemini. A recording is a JSON object with one entry per kind of
+# call:
+#
+#   upload, cache_create, cache_update   {"latency_seconds": s}
+#   analysis, chat (streamed)            {"first_chunk_seconds": s, "chunk_interval_seconds": s,
+#                                          "chunks": ["...", ...]}
+#   quick_answers, chat_summary,         {"latency_seconds": s, "text": "..."}
+#   analysis_repair
+#
+# RecordingClient produces such a file from real traffic; FakeClient plays it
+# back with adjustable latency and chunking, and can inject failures.
+
+
+def _call_kind(config):
+    # Which recorded response a generate_content call maps to.
+    if getattr(config, 'response_json_schema', None) is not None:
+        return 'analysis_repair'
+    if getattr(config, 'response_mime_type', None) == 'application/json':
+        return 'quick_answers'
+    return 'chat_summary'
+
+
+def _stream_kind(config):
+    return 'analysis' if getattr(config, 'response_mime_type', None) == 'application/json' else 'chat'
+
+
+class _Failures:
+    # Per kind of call, a queue of outcomes for its next calls: an exception
+    # to raise, or None to let the call succeed. For streamed kinds an entry
+    # may also be (chunks, exception), failing after that many chunks.
+    def __init__(self, failures=None):
+        self._lock = threading.Lock()
+        self._queues = {kind: list(outcomes) for kind, outcomes in (failures or {}).items()}
+
+    def inject(self, kind, *outcomes):
+        with self._lock:
+            self._queues.setdefault(kind, []).extend(outcomes)
+
+    def next(self, kind):
+        with self._lock:
+            queue = self._queues.get(kind)
+            return queue.pop(0) if queue else None
+
+
+class _Timings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = []
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.calls.append((kind, seconds))
+
+    def by_kind(self):
+        with self._lock:
+            calls = list(self.calls)
+        grouped = {}
+        for kind, seconds in calls:
+            grouped.setdefault(kind, []).append(seconds)
+        return grouped
+
+    def reset(self):
+        with self._lock:
+            self.calls = []
+
+
+class _FakeFiles:
+    def __init__(self, client):
+        self._client = client
+
+    def upload(self, file, config=None):
+        start = time.perf_counter()
+        size = len(file.getvalue()) if hasattr(file, 'getvalue') else 0
+        self._client._sleep(self._client.recording.get('upload', {}).get('latency_seconds', 0))
+        self._client._call('upload', start)
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        self._client.timings.add('upload', time.perf_counter() - start)
+        return SimpleNamespace(
+            name=name,
+            uri=f"https://generativelanguage.googleapis.com/v1beta/{name}",
+            mime_type=getattr(config, 'mime_type', None) or 'application/octet-stream',
+            size_bytes=size,
+            expiration_time=datetime.now(timezone.utc) + timedelta(hours=48),
+        )
+
+
+class _FakeCaches:
+    def __init__(self, client):
+        self._client = client
+
+    def _respond(self, kind, name):
+        start = time.perf_counter()
+        self._client._sleep(self._client.recording.get(kind, {}).get('latency_seconds', 0))
+        self._client._call(kind, start)
+        self._client.timings.add(kind, time.perf_counter() - start)
+        return SimpleNamespace(name=name, expire_time=datetime.now(timezone.utc) + timedelta(hours=1))
+
+    def create(self, model, config=None):
+        return self._respond('cache_create', f"cachedContents/{uuid.uuid4().hex[:12]}")
+
+    def update(self, name, config=None):
+        return self._respond('cache_update', name)
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        kind = _call_kind(config)
+        entry = self._client.recording.get(kind, {})
+        start = time.perf_counter()
+        self._client._sleep(entry.get('latency_seconds', 0))
+        self._client._call(kind, start)
+        if 'text' in entry:
+            text = entry['text']
+        elif kind == 'analysis_repair':
+            text = ''.join(self._client.recording['analysis']['chunks'])
+        else:
+            text = ''
+        self._client.timings.add(kind, time.perf_counter() - start)
+        return SimpleNamespace(text=text)
+
+    def generate_content_stream(self, model, contents, config=None):
+        kind = _stream_kind(config)
+        entry = self._client.recording[kind]
+        chunks = self._client._chunks(entry)
+        interval = self._client.chunk_interval_seconds
+        if interval is None:
+            interval = entry.get('chunk_interval_seconds', 0)
+
+        self._client._count(kind)
+        failure = self._client.failures.next(kind)
+        fail_after, error = failure if isinstance(failure, tuple) else (0, failure)
+
+        start = time.perf_counter()
+        try:
+            self._client._sleep(entry.get('first_chunk_seconds', 0))
+            for i, chunk in enumerate(chunks):
+                if error is not None and i == fail_after:
+                    raise error
+                if i:
+                    self._client._sleep(interval)
+                yield SimpleNamespace(text=chunk)
+            if error is not None:
+                raise error
+        finally:
+            self._client.timings.add(kind, time.perf_counter() - start)
+
+
+class FakeClient:
+    # latency_scale multiplies every recorded delay (0 measures pure local
+    # overhead); chunk_size re-splits streamed text into pieces of that many
+    # characters; chunk_interval_seconds overrides the recorded gap between
+    # chunks; failures seeds the injected failures (see _Failures). calls
+    # counts every call made, failed ones included, per kind.
+    def __init__(self, recording, latency_scale=1.0, chunk_size=None, chunk_interval_seconds=None, failures=None):
+        self.recording = recording
+        self.latency_scale = latency_scale
+        self.chunk_size = chunk_size
+        self.chunk_interval_seconds = chunk_interval_seconds
+        self.timings = _Timings()
+        self.failures = _Failures(failures)
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        self.files = _FakeFiles(self)
+        self.caches = _FakeCaches(self)
+        self.models = _FakeModels(self)
+
+    @classmethod
+    def from_file(cls, path, **options):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), **options)
+
+    def _sleep(self, seconds):
+        if seconds and self.latency_scale:
+            time.sleep(seconds * self.latency_scale)
+
+    def _count(self, kind):
+        with self._calls_lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def _call(self, kind, start):
+        # Counts a non-streamed call and raises its injected failure, if any.
+        self._count(kind)
+        error = self.failures.next(kind)
+        if error is not None:
+            self.timings.add(kind, time.perf_counter() - start)
+            raise error
+
+    def _chunks(self, entry):
+        if not self.chunk_size:
+            return entry['chunks']
+        text = ''.join(entry['chunks'])
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+
+class _RecordingModels:
+    def __init__(self, recorder):
+        self._recorder = recorder
+        self._models = recorder.client.models
+
+    def generate_content(self, model, contents, config=None):
+        start = time.perf_counter()
+        response = self._models.generate_content(model=model, contents=contents, config=config)
+        self._recorder.record(_call_kind(config), {'latency_seconds': time.perf_counter() - start,
+                                                   'text': response.text})
+        return response
+
+    def generate_content_stream(self, model, contents, config=None):
+        start = time.perf_counter()
+        chunks, stamps = [], []
+        for chunk in self._models.generate_content_stream(model=model, contents=contents, config=config):
+            stamps.append(time.perf_counter())
+            if chunk.text:
+                chunks.append(chunk.text)
+            yield chunk
+        gaps = [later - earlier for earlier, later in zip(stamps, stamps[1:])]
+        self._recorder.record(_stream_kind(config), {
+            'first_chunk_seconds': (stamps[0] - start) if stamps else 0.0,
+            'chunk_interval_seconds': sum(gaps) / len(gaps) if gaps else 0.0,
+            'chunks': chunks,
+        })
+
+
+class _RecordingPassthrough:
+    def __init__(self, recorder, target, kinds):
+        self._recorder = recorder
+        self._target = target
+        self._kinds = kinds
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+        if name not in self._kinds:
+            return method
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            self._recorder.record(self._kinds[name], {'latency_seconds': time.perf_counter() - start})
+            return result
+        return timed
+
+
+class RecordingClient:
+    # Wraps a real genai.Client and keeps the last response of each kind, so
+    # one real analysis and chat turn yield a replayable recording.
+    def __init__(self, client):
+        self.client = client
+        self.recording = {}
+        self._lock = threading.Lock()
+        self.files = _RecordingPassthrough(self, client.files, {'upload': 'upload'})
+        self.caches = _RecordingPassthrough(self, client.caches, {'create': 'cache_create',
+                                                                  'update': 'cache_update'})
+        self.models = _RecordingModels(self)
+
+    def record(self, kind, entry):
+        with self._lock:
+            self.recording[kind] = entry
+
+    def save(self, path):
+        with self._lock:
+            recording = dict(self.recording)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(recording, f, indent=2, ensure_ascii=False)
+            f.write('\n')
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import argparse
+import mimetypes
+
+
+# Records one real analysis and chat exchange through RecordingClient, for
+# replay by benchmarks.run. Needs GEMINI_API_KEY and sample documents:
+#
+#   python -m benchmarks.record --answer-sheet sheet.jpg --question-paper paper.pdf \
+#       --out benchmarks/recordings/mine.json
+#
+# Kinds of call the run did not make (e.g. chat_summary, which only happens
+# once a conversation is long) are kept from --base.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _document(path):
+    from documents import ExamDocument
+
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        return ExamDocument(os.path.basename(path), f.read(), mimetypes.guess_type(path)[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record Gemini responses for the offline benchmark.")
+    parser.add_argument('--answer-sheet', required=True)
+    parser.add_argument('--question-paper', required=True)
+    parser.add_argument('--answer-key')
+    parser.add_argument('--question', default="What should I focus on first to improve?")
+    parser.add_argument('--base', default=os.path.join(REPO_ROOT, 'benchmarks', 'recordings', 'default.json'),
+                        help="Recording that supplies kinds of call not made during this run")
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args(argv)
+
+    if not os.getenv('GEMINI_API_KEY'):
+        parser.error("GEMINI_API_KEY is not set")
+
+    os.chdir(REPO_ROOT)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    import gemini_functions
+    from benchmarks.fake_client import RecordingClient
+    from benchmarks.run import BENCHMARK_METADATA
+
+    client = RecordingClient(gemini_functions.get_gemini_client())
+    files_data = {
+        'answer_sheet': _document(args.answer_sheet),
+        'question_paper': _document(args.question_paper),
+        'answer_key': _document(args.answer_key),
+        'syllabus': None,
+    }
+    analysis = gemini_functions.analyze_exam_with_gemini(client, files_data, BENCHMARK_METADATA, force_regrade=True)
+    if analysis is None:
+        print("Analysis failed; nothing recorded.", file=sys.stderr)
+        return 1
+    gemini_functions.chat_with_gemini(client, args.question, analysis, BENCHMARK_METADATA)
+    gemini_functions.precompute_quick_answers(client, analysis, BENCHMARK_METADATA)
+
+    if args.base and os.path.exists(args.base):
+        with open(args.base, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        base.pop('_note', None)
+        for kind, entry in base.items():
+            client.recording.setdefault(kind, entry)
+    client.save(args.out)
+    print(f"Recorded {', '.join(sorted(client.recording))} to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
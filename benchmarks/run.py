@@ -0,0 +1,468 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import shutil
+import tempfile
+import resource
+import tracemalloc
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Offline benchmark of the grading pipeline. Gemini is replaced by a
+# FakeClient replaying benchmarks/recordings/*.json, and every store (upload
+# cache, chat sessions, analyses, archive repo) lives in a temporary
+# directory, so a run needs no API key, network or GitHub token.
+#
+#   python -m benchmarks.run                          # every scenario, 4 sessions
+#   python -m benchmarks.run --sessions 16 --iterations 5
+#   python -m benchmarks.run --latency-scale 0        # local overhead only, no simulated waits
+#   python -m benchmarks.run --chunk-size 50 --chunk-interval 0.02
+#   python -m benchmarks.run --json out.json --baseline last.json --max-regression 0.2
+#
+# With --baseline the run exits with status 1 if any scenario's p95 latency
+# grew by more than --max-regression (a fraction) over the baseline file.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RECORDING = os.path.join(REPO_ROOT, 'benchmarks', 'recordings', 'default.json')
+
+BENCHMARK_METADATA = {
+    'class': '10',
+    'subject': 'Mathematics',
+    'board': 'CBSE',
+    'exam_type': 'Mid Term',
+    'strictness': 'Moderate',
+    'focus_areas': ['Conceptual Understanding', 'Stepwise method'],
+    'answer_depth': 'Intermediate',
+    'feedback_tone': 'Balanced',
+    'explanation_level': 'Exam-Oriented',
+    'key_topics': ['Trigonometry', 'Circles', 'Statistics'],
+}
+
+CHAT_QUESTIONS = [
+    "What should I focus on first to improve?",
+    "Why did I lose marks in question 12?",
+    "How can I avoid calculation mistakes?",
+    "Explain my mistake in Trigonometry.",
+    "What is a realistic score for the next test?",
+    "Give me a one-week study plan.",
+    "Which of my strong topics can I rely on?",
+    "How should I write geometry proofs?",
+]
+
+# 'chat' answers through chat_with_gemini; 'chat_stream' drives the
+# streaming generator the UI uses and also reports time to first token.
+SCENARIOS = ['analyze', 'chat', 'chat_stream', 'archive']
+
+
+def _isolate(workdir, args):
+    # Must run before any repo module is imported: they read their settings
+    # from the environment at import time.
+    os.environ.update({
+        'EXAM_CACHE_DB': os.path.join(workdir, 'exam_review.sqlite'),
+        'EXAM_CHAT_DB': os.path.join(workdir, 'chat.sqlite'),
+        'EXAM_ANALYSIS_DB': os.path.join(workdir, 'analyses.sqlite'),
+        'EXAM_JOBS_DB': os.path.join(workdir, 'jobs.sqlite'),
+        'SCHEDULER_DEFAULT_RPM': str(args.rpm),
+        'SCHEDULER_RETRY_BASE_SECONDS': '0.01',
+    })
+    if args.max_concurrency:
+        os.environ['SCHEDULER_MAX_CONCURRENCY'] = str(args.max_concurrency)
+    if args.no_preprocess:
+        os.environ['PREPROCESS_ENABLED'] = '0'
+    if 'archive' in args.scenarios:
+        repo = os.path.join(workdir, 'archive.git')
+        subprocess.run(['git', 'init', '--bare', '--quiet', repo], check=True)
+        os.environ['ARCHIVE_LOCAL_REPO'] = repo
+    os.chdir(REPO_ROOT)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    # st.* calls made outside a script run log "missing ScriptRunContext"
+    # every time; keep the report readable.
+    from streamlit.runtime.scriptrunner_utils import script_run_context
+    logging.getLogger(script_run_context.__name__).disabled = True
+
+
+def _sample_documents():
+    # A two-page question paper and a phone-photo-sized answer sheet, so
+    # preprocessing and uploads handle realistic byte counts.
+    from PIL import Image, ImageDraw
+
+    pages = []
+    for number in (1, 2):
+        page = Image.new('RGB', (1240, 1754), 'white')
+        draw = ImageDraw.Draw(page)
+        for line in range(40):
+            draw.text((80, 80 + line * 40), f"Q{number * 40 + line}. Solve and show all steps.", fill='black')
+        pages.append(page)
+    paper = io.BytesIO()
+    pages[0].save(paper, format='PDF', save_all=True, append_images=pages[1:])
+
+    noise = random.Random(7).randbytes(1200 * 1600 * 3)
+    return paper.getvalue(), Image.frombytes('RGB', (1200, 1600), noise)
+
+
+def _answer_sheet(photo, session, iteration):
+    # Every student's sheet differs in its pixels, not just its bytes, so it
+    # stays an upload cache miss even after preprocessing re-encodes it.
+    from PIL import ImageDraw
+
+    sheet = photo.copy()
+    ImageDraw.Draw(sheet).rectangle((40, 40, 440, 120), fill='white')
+    ImageDraw.Draw(sheet).text((60, 70), f"Roll {session}-{iteration}", fill='black')
+    data = io.BytesIO()
+    sheet.save(data, format='JPEG', quality=90)
+    return data.getvalue()
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _summary(latencies):
+    return {
+        'count': len(latencies),
+        'p50': round(_percentile(latencies, 0.5), 4),
+        'p95': round(_percentile(latencies, 0.95), 4),
+        'max': round(max(latencies), 4) if latencies else 0.0,
+    }
+
+
+def _stage_breakdown(client, before, after, local_before, local_after):
+    # Simulated remote time per kind of call (from the fake client) next to
+    # the scheduler's view of the same stages (queue wait and retries) and
+    # the local work around them: hashing, preprocessing, JSON parsing,
+    # store writes and archive submits. Local totals are summed over all
+    # concurrent sessions.
+    remote = {kind: _summary(seconds) for kind, seconds in client.timings.by_kind().items()}
+    local = {}
+    for stage, stats in local_after.items():
+        previous = local_before.get(stage, {})
+        calls = stats['calls'] - previous.get('calls', 0)
+        if not calls:
+            continue
+        seconds = stats['seconds'] - previous.get('seconds', 0.0)
+        local[stage] = {'calls': calls, 'avg': round(seconds / calls, 4), 'total': round(seconds, 4)}
+    scheduler = {}
+    for stage, stats in after['stages'].items():
+        previous = before['stages'].get(stage, {})
+        calls = stats['calls'] - previous.get('calls', 0)
+        if not calls:
+            continue
+        scheduler[stage] = {
+            'calls': calls,
+            'retries': stats['retries'] - previous.get('retries', 0),
+            'failures': stats['failures'] - previous.get('failures', 0),
+            'avg_wait': round((stats['wait_seconds'] - previous.get('wait_seconds', 0.0)) / calls, 4),
+        }
+    return {'remote': remote, 'scheduler': scheduler, 'local': local}
+
+
+def _run_sessions(sessions, iterations, operation, prepare=None):
+    # Runs operation(session, iteration, payload) for every session
+    # concurrently, each session's iterations in order. prepare(session,
+    # iteration) builds the payload outside the timed section. Returns
+    # (latencies, extras, failures, wall).
+    from scheduler import set_request_session
+
+    def session_worker(session):
+        set_request_session(f"bench-{session}")
+        results = []
+        for iteration in range(iterations):
+            payload = prepare(session, iteration) if prepare else None
+            start = time.perf_counter()
+            try:
+                extra = operation(session, iteration, payload)
+                results.append((time.perf_counter() - start, extra, None))
+            except Exception as e:
+                results.append((time.perf_counter() - start, None, e))
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        outcomes = [result for results in executor.map(session_worker, range(sessions)) for result in results]
+    wall = time.perf_counter() - start
+
+    latencies = [seconds for seconds, _, error in outcomes if error is None]
+    extras = [extra for _, extra, error in outcomes if error is None and extra is not None]
+    failures = [repr(error) for _, _, error in outcomes if error is not None]
+    return latencies, extras, failures, wall
+
+
+def bench_analyze(client, args, documents):
+    import gemini_functions
+    from documents import ExamDocument
+
+    paper, photo = documents
+
+    def analyze(session, iteration, sheet):
+        # The shared question paper hits the upload and context caches after
+        # the first run; answer sheets never do, as with real students.
+        files_data = {
+            'answer_sheet': ExamDocument(f"sheet_{session}_{iteration}.jpg", sheet, 'image/jpeg'),
+            'question_paper': ExamDocument('question_paper.pdf', paper, 'application/pdf'),
+            'answer_key': None,
+            'syllabus': None,
+        }
+        analysis = gemini_functions.analyze_exam_with_gemini(client, files_data, BENCHMARK_METADATA,
+                                                            force_regrade=True)
+        if analysis is None:
+            raise RuntimeError("analysis failed")
+        return None
+
+    return _run_sessions(args.sessions, args.iterations, analyze,
+                         prepare=lambda session, iteration: _answer_sheet(photo, session, iteration))
+
+
+def _chat_setup(client):
+    from chat_context import build_chat_context
+
+    analysis = json.loads(''.join(client.recording['analysis']['chunks']))
+    return analysis, build_chat_context(analysis)
+
+
+def bench_chat(client, args, documents):
+    import gemini_functions
+    from chat_session import ChatSession
+
+    analysis, chat_context = _chat_setup(client)
+
+    def conversation(session, iteration, payload):
+        # One conversation of --chat-turns questions, each answered whole.
+        chat_session = ChatSession(f"bench-{session}-{iteration}-{time.time_ns()}")
+        for turn in range(args.chat_turns):
+            gemini_functions.chat_with_gemini(
+                client, CHAT_QUESTIONS[turn % len(CHAT_QUESTIONS)], analysis, BENCHMARK_METADATA,
+                chat_context=chat_context, session=chat_session
+            )
+        if any(message.get('failed') for message in chat_session.messages):
+            raise RuntimeError("chat turn failed")
+        return None
+
+    return _run_sessions(args.sessions, args.iterations, conversation)
+
+
+def bench_chat_stream(client, args, documents):
+    import gemini_functions
+    from chat_session import ChatSession
+
+    analysis, chat_context = _chat_setup(client)
+
+    def conversation(session, iteration, payload):
+        # One conversation of --chat-turns questions; long enough ones also
+        # exercise compaction. Reports time to first token per turn.
+        chat_session = ChatSession(f"bench-{session}-{iteration}-{time.time_ns()}")
+        first_tokens = []
+        for turn in range(args.chat_turns):
+            start = time.perf_counter()
+            stream = gemini_functions.stream_chat_with_gemini(
+                client, CHAT_QUESTIONS[turn % len(CHAT_QUESTIONS)], analysis, BENCHMARK_METADATA,
+                chat_context=chat_context, session=chat_session
+            )
+            for i, _ in enumerate(stream):
+                if i == 0:
+                    first_tokens.append(time.perf_counter() - start)
+        if any(message.get('failed') for message in chat_session.messages):
+            raise RuntimeError("chat turn failed")
+        return first_tokens
+
+    latencies, extras, failures, wall = _run_sessions(args.sessions, args.iterations, conversation)
+    return latencies, [seconds for turns in extras for seconds in turns], failures, wall
+
+
+def bench_archive(client, args, documents):
+    import gemini_functions
+    from archive import get_archive_pipeline
+    from documents import ExamDocument
+
+    paper, photo = documents
+
+    def submit(session, iteration, sheet):
+        documents = [
+            ("ANS_SHEET", ExamDocument(f"sheet_{session}_{iteration}.jpg", sheet, 'image/jpeg')),
+            ("QUES_PAPER", ExamDocument('question_paper.pdf', paper, 'application/pdf')),
+        ]
+        if not gemini_functions.sync_to_github(documents, f"bench_{session}_{iteration}"):
+            raise RuntimeError("archive submit failed")
+        return None
+
+    # Submission is what a grading request waits for; the commits happen on
+    # the pipeline thread, so their cost shows up as the drain time.
+    latencies, extras, failures, wall = _run_sessions(
+        args.sessions, args.iterations, submit,
+        prepare=lambda session, iteration: _answer_sheet(photo, session, iteration)
+    )
+    pipeline = get_archive_pipeline(gemini_functions._archive_backend)
+    start = time.perf_counter()
+    pipeline.flush()
+    drain = time.perf_counter() - start
+    stats = pipeline.stats()
+    if stats['failed']:
+        failures.append(f"{stats['failed']} archive batch(es) failed: {pipeline.last_error}")
+    return latencies, [drain], failures, wall + drain
+
+
+BENCHMARKS = {'analyze': bench_analyze, 'chat': bench_chat, 'chat_stream': bench_chat_stream,
+              'archive': bench_archive}
+
+
+def run(args):
+    from benchmarks.fake_client import FakeClient
+    from scheduler import get_scheduler_stats
+    from gemini_functions import get_stage_stats
+
+    client = FakeClient.from_file(args.recording, latency_scale=args.latency_scale, chunk_size=args.chunk_size,
+                                  chunk_interval_seconds=args.chunk_interval)
+    documents = _sample_documents()
+    report = {
+        'config': {
+            'sessions': args.sessions,
+            'iterations': args.iterations,
+            'latency_scale': args.latency_scale,
+            'chunk_size': args.chunk_size,
+            'chunk_interval': args.chunk_interval,
+            'recording': os.path.relpath(args.recording, REPO_ROOT),
+        },
+        'scenarios': {},
+    }
+
+    if args.memory:
+        tracemalloc.start()
+
+    for name in args.scenarios:
+        client.timings.reset()
+        before = get_scheduler_stats()
+        local_before = get_stage_stats()
+        if args.memory:
+            tracemalloc.reset_peak()
+
+        latencies, extras, failures, wall = BENCHMARKS[name](client, args, documents)
+
+        result = {
+            'latency': _summary(latencies),
+            'throughput_per_second': round(len(latencies) / wall, 3) if wall else 0.0,
+            'wall_seconds': round(wall, 3),
+            'failures': failures,
+            'stages': _stage_breakdown(client, before, get_scheduler_stats(), local_before, get_stage_stats()),
+        }
+        if name == 'chat_stream':
+            result['first_token'] = _summary(extras)
+        if name == 'archive':
+            result['drain_seconds'] = round(extras[0], 3)
+        if args.memory:
+            result['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        report['scenarios'][name] = result
+
+    if args.memory:
+        tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux.
+    report['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def print_report(report):
+    config = report['config']
+    print(f"Sessions: {config['sessions']} • iterations: {config['iterations']} • "
+          f"latency scale: {config['latency_scale']} • recording: {config['recording']}")
+    for name, result in report['scenarios'].items():
+        latency = result['latency']
+        print(f"\n== {name} ==")
+        print(f"  latency   p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  max {latency['max']:.3f}s "
+              f"({latency['count']} ok, {len(result['failures'])} failed)")
+        print(f"  throughput {result['throughput_per_second']:.2f}/s over {result['wall_seconds']:.2f}s")
+        if 'first_token' in result:
+            print(f"  first token p50 {result['first_token']['p50']:.3f}s  p95 {result['first_token']['p95']:.3f}s")
+        if 'drain_seconds' in result:
+            print(f"  archive drain {result['drain_seconds']:.3f}s")
+        if 'peak_traced_mb' in result:
+            print(f"  peak traced memory {result['peak_traced_mb']:.2f} MB")
+        for kind, stats in sorted(result['stages']['remote'].items()):
+            print(f"  remote {kind:<18} {stats['count']:>4} calls  p50 {stats['p50']:.3f}s  p95 {stats['p95']:.3f}s")
+        for stage, stats in sorted(result['stages']['scheduler'].items()):
+            print(f"  queue  {stage:<18} {stats['calls']:>4} calls  avg wait {stats['avg_wait']:.3f}s  "
+                  f"retries {stats['retries']}  failures {stats['failures']}")
+        for stage, stats in sorted(result['stages'].get('local', {}).items()):
+            print(f"  local  {stage:<18} {stats['calls']:>4} calls  avg {stats['avg']:.3f}s  "
+                  f"total {stats['total']:.3f}s")
+        for failure in result['failures'][:3]:
+            print(f"  ! {failure}")
+    print(f"\nPeak RSS: {report['peak_rss_mb']} MB")
+
+
+def regressions(report, baseline, max_regression):
+    found = []
+    for name, result in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not previous['latency']['p95']:
+            continue
+        growth = result['latency']['p95'] / previous['latency']['p95'] - 1
+        if growth > max_regression:
+            found.append(f"{name}: p95 {previous['latency']['p95']:.3f}s -> {result['latency']['p95']:.3f}s "
+                         f"(+{growth:.0%})")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the grading pipeline against recorded Gemini responses.")
+    parser.add_argument('--recording', default=DEFAULT_RECORDING, help="Recording to replay")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--sessions', type=int, default=4, help="Concurrent sessions (default: 4)")
+    parser.add_argument('--iterations', type=int, default=3, help="Operations per session (default: 3)")
+    parser.add_argument('--chat-turns', type=int, default=8, help="Questions per chat conversation (default: 8)")
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="Multiplier for recorded latencies; 0 disables simulated waits")
+    parser.add_argument('--chunk-size', type=int, help="Re-split streamed responses into chunks of N characters")
+    parser.add_argument('--chunk-interval', type=float, help="Seconds between streamed chunks (overrides recording)")
+    parser.add_argument('--rpm', type=float, default=1_000_000,
+                        help="Scheduler requests per minute per model (default: effectively unlimited)")
+    parser.add_argument('--max-concurrency', type=int, help="Scheduler in-flight limit (default: app setting)")
+    parser.add_argument('--no-preprocess', action='store_true', help="Skip document shrinking")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="Skip tracemalloc (it slows Python code down)")
+    parser.add_argument('--json', help="Also write the report to this file")
+    parser.add_argument('--baseline', help="Earlier --json report to compare p95 latencies against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="Allowed p95 growth over the baseline, as a fraction (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    if 'archive' in args.scenarios and shutil.which('git') is None:
+        print("git not found; skipping the archive scenario", file=sys.stderr)
+        args.scenarios.remove('archive')
+    args.recording = os.path.abspath(args.recording)
+
+    with tempfile.TemporaryDirectory(prefix='exam-bench-') as workdir:
+        _isolate(workdir, args)
+        report = run(args)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        if found:
+            print("\nRegressions:")
+            for line in found:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timezone, timedelta
+
+
+CACHE_DB_PATH = os.getenv('EXAM_CACHE_DB', os.path.join('.cache', 'exam_review.sqlite'))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '500'))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Gemini keeps uploaded files for 48 hours; stop reusing a handle a little
+# before that so a request never races the remote expiry.
+UPLOAD_TTL = timedelta(hours=48)
+EXPIRY_MARGIN = timedelta(minutes=15)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploaded_files (
+    content_hash TEXT PRIMARY KEY,
+    remote_name TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    mime_type TEXT,
+    size_bytes INTEGER,
+    expires_at TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS context_caches (
+    cache_key TEXT PRIMARY KEY,
+    cache_name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    expires_at TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS analysis_results (
+    result_key TEXT PRIMARY KEY,
+    analysis_json TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    last_access TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_analysis_results_last_access ON analysis_results (last_access);
+
+CREATE TABLE IF NOT EXISTS cache_stats (
+    counter TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_init_lock = threading.Lock()
+_initialized_schemas = set()
+
+
+def _add_columns(conn, columns):
+    # Columns added to a table after it first shipped: {table: {name: decl}}.
+    # Databases created by an older version gain them on first connect.
+    for table, table_columns in columns.items():
+        existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, declaration in table_columns.items():
+            if name in existing:
+                continue
+            try:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+            except sqlite3.OperationalError as e:
+                # Another process added it first.
+                if 'duplicate column' not in str(e):
+                    raise
+
+
+def get_connection(db_path=None, schema=_SCHEMA, columns=None):
+    path = db_path or CACHE_DB_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+
+    with _init_lock:
+        if (path, schema) not in _initialized_schemas:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(schema)
+            if columns:
+                _add_columns(conn, columns)
+            _initialized_schemas.add((path, schema))
+
+    return conn
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def file_sha256(file):
+    return hashlib.sha256(file.getbuffer()).hexdigest()
+
+
+def get_cached_upload(content_hash, db_path=None):
+    try:
+        conn = get_connection(db_path)
+        try:
+            row = conn.execute(
+                "SELECT * FROM uploaded_files WHERE content_hash = ?",
+                (content_hash,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            if datetime.fromisoformat(row['expires_at']) - EXPIRY_MARGIN <= _now():
+                with conn:
+                    conn.execute("DELETE FROM uploaded_files WHERE content_hash = ?", (content_hash,))
+                return None
+
+            return dict(row)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def store_upload(content_hash, uploaded_file, db_path=None):
+    expires_at = getattr(uploaded_file, 'expiration_time', None) or (_now() + UPLOAD_TTL)
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+
+    try:
+        conn = get_connection(db_path)
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO uploaded_files
+                       (content_hash, remote_name, uri, mime_type, size_bytes, expires_at, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        content_hash,
+                        uploaded_file.name,
+                        uploaded_file.uri,
+                        uploaded_file.mime_type,
+                        uploaded_file.size_bytes,
+                        expires_at.isoformat(),
+                        _now().isoformat()
+                    )
+                )
+        finally:
+            conn.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def purge_expired_uploads(db_path=None):
+    cutoff = (_now() + EXPIRY_MARGIN).isoformat()
+    try:
+        conn = get_connection(db_path)
+        try:
+            with conn:
+                cursor = conn.execute("DELETE FROM uploaded_files WHERE expires_at <= ?", (cutoff,))
+            return cursor.rowcount
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+
+
+def get_cached_context(cache_key, db_path=None):
+    try:
+        conn = get_connection(db_path)
+        try:
+            row = conn.execute(
+                "SELECT * FROM context_caches WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            if datetime.fromisoformat(row['expires_at']) - EXPIRY_MARGIN <= _now():
+                with conn:
+                    conn.execute("DELETE FROM context_caches WHERE cache_key = ?", (cache_key,))
+                return None
+
+            return dict(row)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def store_context(cache_key, cache_name, model, expires_at, db_path=None):
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+
+    try:
+        conn = get_connection(db_path)
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO context_caches
+                       (cache_key, cache_name, model, expires_at, created_at)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (cache_key, cache_name, model, expires_at.isoformat(), _now().isoformat())
+                )
+        finally:
+            conn.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def forget_context(cache_name, db_path=None):
+    try:
+        conn = get_connection(db_path)
+        try:
+            with conn:
+                conn.execute("DELETE FROM context_caches WHERE cache_name = ?", (cache_name,))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def _bump_counter(conn, counter):
+    conn.execute(
+        """INSERT INTO cache_stats (counter, value) VALUES (?, 1)
+           ON CONFLICT(counter) DO UPDATE SET value = value + 1""",
+        (counter,)
+    )
+
+
+def get_cached_result(result_key, db_path=None):
+    try:
+        conn = get_connection(db_path)
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT analysis_json FROM analysis_results WHERE result_key = ?",
+                    (result_key,)
+                ).fetchone()
+
+                if row is None:
+                    _bump_counter(conn, 'result_misses')
+                    return None
+
+                conn.execute(
+                    "UPDATE analysis_results SET last_access = ? WHERE result_key = ?",
+                    (_now().isoformat(), result_key)
+                )
+                _bump_counter(conn, 'result_hits')
+            return json.loads(row['analysis_json'])
+        finally:
+            conn.close()
+    except (sqlite3.Error, json.JSONDecodeError):
+        return None
+
+
+def record_result_bypass(db_path=None):
+    try:
+        conn = get_connection(db_path)
+        try:
+            with conn:
+                _bump_counter(conn, 'result_bypasses')
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def store_result(result_key, analysis, db_path=None):
+    payload = json.dumps(analysis, separators=(',', ':'))
+    now = _now().isoformat()
+
+    try:
+        conn = get_connection(db_path)
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO analysis_results
+                       (result_key, analysis_json, size_bytes, created_at, last_access)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (result_key, payload, len(payload), now, now)
+                )
+                _evict_results(conn)
+        finally:
+            conn.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def _evict_results(conn):
+    # Least recently used entries go first until both bounds are satisfied.
+    entries, total_bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM analysis_results"
+    ).fetchone()
+
+    if entries <= RESULT_CACHE_MAX_ENTRIES and total_bytes <= RESULT_CACHE_MAX_BYTES:
+        return
+
+    rows = conn.execute(
+        "SELECT result_key, size_bytes FROM analysis_results ORDER BY last_access ASC"
+    ).fetchall()
+
+    for row in rows[:-1]:
+        if entries <= RESULT_CACHE_MAX_ENTRIES and total_bytes <= RESULT_CACHE_MAX_BYTES:
+            break
+        conn.execute("DELETE FROM analysis_results WHERE result_key = ?", (row['result_key'],))
+        entries -= 1
+        total_bytes -= row['size_bytes']
+        _bump_counter(conn, 'result_evictions')
+
+
+def get_result_cache_stats(db_path=None):
+    stats = {'result_hits': 0, 'result_misses': 0, 'result_bypasses': 0, 'result_evictions': 0}
+    try:
+        conn = get_connection(db_path)
+        try:
+            for row in conn.execute("SELECT counter, value FROM cache_stats"):
+                stats[row['counter']] = row['value']
+            entries, total_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM analysis_results"
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return stats
+
+    stats['entries'] = entries
+    stats['size_bytes'] = total_bytes
+    return stats
@@ -0,0 +1,116 @@
+import re
+import json
+
+
+ERROR_KEYWORDS = {
+    'conceptual_errors': ['concept', 'understand', 'misconception', 'theory'],
+    'calculation_mistakes': ['calculat', 'silly', 'careless', 'arithmetic', 'accura', 'computation'],
+    'incomplete_steps': ['step', 'incomplete', 'missing', 'working'],
+    'poor_explanation': ['explain', 'explanation', 'writing', 'presentation', 'express'],
+    'notation_errors': ['notation', 'symbol', 'unit', 'sign convention'],
+}
+
+PLANNING_KEYWORDS = ['study', 'focus', 'first', 'improve', 'plan', 'prepare', 'practice', 'weak', 'score', 'marks']
+
+QUESTION_NUMBER_PATTERN = re.compile(r'\b(?:q|ques|question)s?\.?\s*(?:no\.?\s*)?#?\s*(\d+)', re.IGNORECASE)
+
+
+def _compact(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def _question_numbers(value):
+    numbers = value if isinstance(value, list) else [value]
+    return [str(number).strip() for number in numbers if str(number).strip()]
+
+
+def build_chat_context(analysis):
+    # Serializes the report once per analysis: a small always-sent summary,
+    # minified per-section slices, and indexes from question number, topic and
+    # error type to those slices so each chat turn only carries what it needs.
+    personal_feedback = analysis.get('personal_feedback', {}) or {}
+    topic_performance = analysis.get('topic_wise_performance', {}) or {}
+    question_breakdown = analysis.get('question_wise_breakdown', {}) or {}
+    error_analysis = analysis.get('error_analysis', {}) or {}
+
+    summary = {
+        'personal_details': analysis.get('personal_details', {}),
+        'overall_score': analysis.get('overall_score', {}),
+        'strong_topics': [t.get('topic') for t in topic_performance.get('strong_topics', [])],
+        'weak_topics': [t.get('topic') for t in topic_performance.get('areas_for_improvement', [])],
+        'error_counts': {k: len(v) for k, v in error_analysis.items() if isinstance(v, list)},
+    }
+
+    context = {
+        'summary': _compact(summary),
+        'full': _compact(analysis),
+        'planning': _compact({
+            'areas_for_improvement': topic_performance.get('areas_for_improvement', []),
+            'improvements_needed': analysis.get('improvements_needed', []),
+            'action_plan': personal_feedback.get('action_plan', []),
+            'estimated_improvement_potential': personal_feedback.get('estimated_improvement_potential'),
+        }),
+        'questions': {},
+        'topics': {},
+        'errors': {},
+    }
+
+    def index(bucket, key, item):
+        context[bucket].setdefault(key, []).append(_compact(item))
+
+    for group in ('strong_topics', 'areas_for_improvement'):
+        for topic in topic_performance.get(group, []):
+            if topic.get('topic'):
+                index('topics', topic['topic'].lower(), {group: topic})
+            for number in _question_numbers(topic.get('questions', [])):
+                index('questions', number, {'topic': topic.get('topic'), group: True})
+
+    for item in question_breakdown.get('highly_accurate_questions', []):
+        for number in _question_numbers(item.get('question_numbers', [])):
+            index('questions', number, {'question_number': number, 'fully_correct': True,
+                                        'topic': item.get('topic')})
+
+    for item in question_breakdown.get('needs_improvement', []):
+        for number in _question_numbers(item.get('question_number')):
+            index('questions', number, item)
+        if item.get('topic'):
+            index('topics', item['topic'].lower(), item)
+
+    for category, errors in error_analysis.items():
+        if not isinstance(errors, list):
+            continue
+        for error in errors:
+            index('errors', category, error)
+            for number in _question_numbers(error.get('questions_affected', [])):
+                index('questions', number, {category: error})
+
+    return context
+
+
+def select_chat_context(context, question):
+    lowered = question.lower()
+    slices = []
+
+    for number in QUESTION_NUMBER_PATTERN.findall(question):
+        slices += context['questions'].get(number, [])
+
+    for topic, items in context['topics'].items():
+        words = [word for word in re.findall(r'[a-z]+', topic) if len(word) > 3]
+        if topic in lowered or any(word in lowered for word in words):
+            slices += items
+
+    for category, keywords in ERROR_KEYWORDS.items():
+        if any(keyword in lowered for keyword in keywords):
+            slices += context['errors'].get(category, [])
+
+    if any(keyword in lowered for keyword in PLANNING_KEYWORDS):
+        slices.append(context['planning'])
+
+    if not slices:
+        # Nothing specific to point at: fall back to the whole (minified)
+        # report so answers stay grounded in the same data.
+        return context['full']
+
+    selected = context['summary'] + '\n' + '\n'.join(dict.fromkeys(slices))
+    # Overlapping slices can add up to more than the report itself.
+    return selected if len(selected) < len(context['full']) else context['full']
@@ -0,0 +1,194 @@
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime, timezone
+
+from cache_store import get_connection
+
+
+CHAT_DB_PATH = os.getenv('EXAM_CHAT_DB', os.path.join('.cache', 'chat.sqlite'))
+
+# Question/answer exchanges sent to the model word for word. Once twice this
+# many are pending, the older half is folded into the running summary, so a
+# turn costs about the same however long the conversation gets.
+CHAT_RECENT_EXCHANGES = int(os.getenv('CHAT_RECENT_EXCHANGES', '3'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_upto INTEGER NOT NULL DEFAULT 0,
+    messages_json TEXT NOT NULL DEFAULT '[]',
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS quick_answers (
+    answers_key TEXT PRIMARY KEY,
+    answers_json TEXT NOT NULL,
+    elapsed_seconds REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chat_stats (
+    counter TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def analysis_fingerprint(analysis):
+    payload = json.dumps(analysis, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def chat_session_id(analysis, viewer_id):
+    # One conversation per viewer and report: reopening the same analysis
+    # (for example from the result cache) resumes where that viewer left
+    # off, while someone else opening the report starts their own chat.
+    payload = f"{viewer_id}:{analysis_fingerprint(analysis)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def quick_answers_key(analysis, metadata):
+    # Precomputed answers depend on the report and on the tone and language
+    # level the tutor was asked to use.
+    payload = json.dumps({
+        'analysis': analysis_fingerprint(analysis),
+        'feedback_tone': metadata.get('feedback_tone'),
+        'explanation_level': metadata.get('explanation_level'),
+        'subject': metadata.get('subject'),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ChatSession:
+    # messages holds every turn for display. Only turns after summarized_upto
+    # go to the model as they are; everything earlier lives in summary.
+    def __init__(self, session_id, messages=None, summary='', summarized_upto=0):
+        self.session_id = session_id
+        self.messages = messages or []
+        self.summary = summary
+        self.summarized_upto = summarized_upto
+
+    @classmethod
+    def load(cls, session_id):
+        try:
+            conn = get_connection(CHAT_DB_PATH, _SCHEMA)
+            try:
+                row = conn.execute(
+                    "SELECT summary, summarized_upto, messages_json FROM chat_sessions WHERE session_id = ?",
+                    (session_id,)
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            row = None
+
+        if row is None:
+            return cls(session_id)
+        return cls(session_id, json.loads(row['messages_json']), row['summary'], row['summarized_upto'])
+
+    def save(self):
+        try:
+            conn = get_connection(CHAT_DB_PATH, _SCHEMA)
+            try:
+                with conn:
+                    conn.execute(
+                        """INSERT OR REPLACE INTO chat_sessions
+                           (session_id, summary, summarized_upto, messages_json, updated_at)
+                           VALUES (?, ?, ?, ?, ?)""",
+                        (self.session_id, self.summary, self.summarized_upto,
+                         json.dumps(self.messages), datetime.now(timezone.utc).isoformat())
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    def add_exchange(self, question, answer, failed=False):
+        # Failed exchanges stay visible in the chat but are never sent back
+        # to the model or summarized.
+        self.messages.append({'role': 'user', 'content': question, 'failed': failed})
+        self.messages.append({'role': 'assistant', 'content': answer, 'failed': failed})
+
+    def recent_messages(self):
+        return [m for m in self.messages[self.summarized_upto:] if not m.get('failed')]
+
+    def pending_compaction(self):
+        pending = self.messages[self.summarized_upto:]
+        if len(pending) <= 4 * CHAT_RECENT_EXCHANGES:
+            return []
+        return pending[:len(pending) - 2 * CHAT_RECENT_EXCHANGES]
+
+    def fold(self, summary, count):
+        self.summary = summary
+        self.summarized_upto += count
+
+
+def get_quick_answers(answers_key):
+    try:
+        conn = get_connection(CHAT_DB_PATH, _SCHEMA)
+        try:
+            row = conn.execute(
+                "SELECT answers_json FROM quick_answers WHERE answers_key = ?", (answers_key,)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return json.loads(row['answers_json']) if row else None
+
+
+def store_quick_answers(answers_key, answers, elapsed_seconds):
+    try:
+        conn = get_connection(CHAT_DB_PATH, _SCHEMA)
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO quick_answers (answers_key, answers_json, elapsed_seconds, created_at)
+                       VALUES (?, ?, ?, ?)""",
+                    (answers_key, json.dumps(answers), elapsed_seconds, datetime.now(timezone.utc).isoformat())
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def record_quick_answer_lookup(hit):
+    try:
+        conn = get_connection(CHAT_DB_PATH, _SCHEMA)
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT INTO chat_stats (counter, value) VALUES (?, 1)
+                       ON CONFLICT(counter) DO UPDATE SET value = value + 1""",
+                    ('quick_hits' if hit else 'quick_misses',)
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def get_quick_answer_stats():
+    stats = {'quick_hits': 0, 'quick_misses': 0, 'precomputed': 0, 'avg_precompute_seconds': 0.0}
+    try:
+        conn = get_connection(CHAT_DB_PATH, _SCHEMA)
+        try:
+            for row in conn.execute("SELECT counter, value FROM chat_stats"):
+                stats[row['counter']] = row['value']
+            precomputed, avg_seconds = conn.execute(
+                "SELECT COUNT(*), COALESCE(AVG(elapsed_seconds), 0) FROM quick_answers"
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return stats
+
+    stats['precomputed'] = precomputed
+    stats['avg_precompute_seconds'] = avg_seconds
+    lookups = stats['quick_hits'] + stats['quick_misses']
+    stats['hit_rate'] = stats['quick_hits'] / lookups if lookups else None
+    return stats
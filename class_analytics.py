@@ -0,0 +1,269 @@
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from analysis_store import fetch_analyses_since
+from student_history import normalize_name, normalize_roll_number
+from report_view import ERROR_CATEGORIES
+
+
+SCORE_BINS = np.linspace(0, 100, 11)
+
+_SPACE_PATTERN = re.compile(r'\s+')
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().rstrip('%'))
+    except ValueError:
+        return None
+
+
+def _name_key(name):
+    return _SPACE_PATTERN.sub(' ', str(name)).strip().casefold()
+
+
+def _student_key(personal_details):
+    # Same identity as the student index: roll number within a school, else
+    # name within a school. None if the report names nobody.
+    school = normalize_name(personal_details.get('school_name'))
+    roll = normalize_roll_number(personal_details.get('roll_number'))
+    if roll:
+        return school, 'roll', roll
+    name = normalize_name(personal_details.get('student_name'))
+    return (school, 'name', name) if name else None
+
+
+class _Counters:
+    # Named rows of float counters in one growable 2-D array, so totals for
+    # every topic (or question) are read back as whole columns.
+    def __init__(self, fields):
+        self.fields = {field: i for i, field in enumerate(fields)}
+        self.values = np.zeros((16, len(fields)))
+        self.index = {}
+        self.labels = []
+
+    def row(self, key, label):
+        if key not in self.index:
+            if len(self.labels) == len(self.values):
+                self.values = np.vstack([self.values, np.zeros_like(self.values)])
+            self.index[key] = len(self.labels)
+            self.labels.append(label)
+        return self.index[key]
+
+    def column(self, field):
+        return self.values[:len(self.labels), self.fields[field]]
+
+
+class ClassAnalytics:
+    # Class-wide aggregates for one class, subject, exam type and question
+    # paper (by hash, so question 5 of one paper never meets question 5 of
+    # another), kept as running totals
+    # in NumPy arrays. Each stored report is folded in once as it arrives;
+    # a re-graded report first has its old contribution subtracted. Queries
+    # only divide and sort those arrays, so they stay fast with hundreds of
+    # students.
+    def __init__(self, class_num, subject, exam_type=None, paper_hash=None):
+        self.class_num = str(class_num)
+        self.subject = subject
+        self.exam_type = exam_type
+        self.paper_hash = paper_hash
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._contributions = {}
+        self._students = Counter()  # reports per student key
+
+        self._topics = _Counters(['accuracy_sum', 'observations', 'strong', 'weak'])
+        self._questions = _Counters(['score_sum', 'observations', 'perfect'])
+        self._errors = np.zeros((len(ERROR_CATEGORIES), 2))  # occurrences, reports affected
+        self._scores = np.zeros(64)
+        self._active = np.zeros(64, dtype=bool)
+        self._score_rows = 0
+
+    def _contribution(self, analysis):
+        overall_score = analysis.get('overall_score', {})
+        obtained = _number(overall_score.get('total_marks_obtained'))
+        total = _number(overall_score.get('total_marks'))
+        score = min(max(obtained / total * 100, 0.0), 100.0) if obtained is not None and total else None
+
+        topics = {}
+        topic_analysis = analysis.get('topic_wise_performance') or {}
+        for field, strong in (('strong_topics', True), ('areas_for_improvement', False)):
+            for topic in topic_analysis.get(field) or []:
+                name = topic.get('topic')
+                accuracy = _number(topic.get('accuracy'))
+                if not name or accuracy is None:
+                    continue
+                row = self._topics.row(_name_key(name), name)
+                topics[row] = (accuracy, strong)
+
+        # Fraction of marks per question: 1.0 for everything listed as fully
+        # correct, marks_obtained/total_marks for the rest.
+        questions = {}
+        breakdown = analysis.get('question_wise_breakdown') or {}
+        for item in breakdown.get('highly_accurate_questions') or []:
+            for number in item.get('question_numbers') or []:
+                questions[self._questions.row(_name_key(number), str(number))] = 1.0
+        for item in breakdown.get('needs_improvement') or []:
+            marks, out_of = _number(item.get('marks_obtained')), _number(item.get('total_marks'))
+            if item.get('question_number') is None or marks is None or not out_of:
+                continue
+            row = self._questions.row(_name_key(item['question_number']), str(item['question_number']))
+            questions[row] = min(max(marks / out_of, 0.0), 1.0)
+
+        error_analysis = analysis.get('error_analysis') or {}
+        errors = np.zeros(len(ERROR_CATEGORIES))
+        for i, (key, _) in enumerate(ERROR_CATEGORIES):
+            found = error_analysis.get(key, [])
+            errors[i] = len(found) if isinstance(found, list) else (_number(found) or 0)
+
+        return {'score': score, 'topics': topics, 'questions': questions, 'errors': errors,
+                'student': _student_key(analysis.get('personal_details') or {})}
+
+    def _apply(self, contribution, sign):
+        for row, (accuracy, strong) in contribution['topics'].items():
+            self._topics.values[row] += sign * np.array([accuracy, 1, strong, not strong])
+        for row, fraction in contribution['questions'].items():
+            self._questions.values[row] += sign * np.array([fraction, 1, fraction >= 1.0])
+        errors = contribution['errors']
+        self._errors[:, 0] += sign * errors
+        self._errors[:, 1] += sign * (errors > 0)
+        self._students[contribution['student']] += sign
+        if self._students[contribution['student']] <= 0:
+            del self._students[contribution['student']]
+
+    def add(self, analysis_id, analysis):
+        contribution = self._contribution(analysis)
+        if contribution['score'] is not None:
+            if self._score_rows == len(self._scores):
+                self._scores = np.concatenate([self._scores, np.zeros_like(self._scores)])
+                self._active = np.concatenate([self._active, np.zeros_like(self._active)])
+            contribution['score_row'] = self._score_rows
+            self._scores[self._score_rows] = contribution['score']
+            self._active[self._score_rows] = True
+            self._score_rows += 1
+        self._apply(contribution, 1)
+        self._contributions[analysis_id] = contribution
+
+    def remove(self, analysis_id):
+        contribution = self._contributions.pop(analysis_id, None)
+        if contribution is None:
+            return
+        self._apply(contribution, -1)
+        if 'score_row' in contribution:
+            self._active[contribution['score_row']] = False
+
+    def refresh(self):
+        # Folds in reports stored since the last refresh; returns how many.
+        with self._lock:
+            rows = fetch_analyses_since(self.class_num, self.subject, self.exam_type, self.paper_hash,
+                                        self._last_id)
+            for analysis_id, replaces, analysis in rows:
+                if replaces is not None:
+                    self.remove(replaces)
+                self.add(analysis_id, analysis)
+                self._last_id = analysis_id
+            return len(rows)
+
+    @property
+    def report_count(self):
+        return len(self._contributions)
+
+    @property
+    def student_count(self):
+        # Distinct students; each report that names nobody counts as one.
+        return len(self._students) - (None in self._students) + self._students[None]
+
+    def topic_accuracy(self):
+        # Weakest topics first.
+        with self._lock:
+            topics = self._topics
+            observations = topics.column('observations')
+            accuracy = topics.column('accuracy_sum') / np.maximum(observations, 1)
+            order = np.argsort(accuracy, kind='stable')
+            strong, weak = topics.column('strong'), topics.column('weak')
+            return [{
+                'topic': topics.labels[i],
+                'reports': int(observations[i]),
+                'mean_accuracy': round(float(accuracy[i]), 1),
+                'strong': int(strong[i]),
+                'weak': int(weak[i]),
+            } for i in order if observations[i] > 0]
+
+    def error_frequency(self):
+        with self._lock:
+            reports = max(len(self._contributions), 1)
+            share = self._errors[:, 1] / reports
+            return [{
+                'category': key,
+                'label': label,
+                'occurrences': int(self._errors[i, 0]),
+                'reports_affected': int(self._errors[i, 1]),
+                'share_of_reports': round(float(share[i]), 3),
+            } for i, (key, label) in enumerate(ERROR_CATEGORIES)]
+
+    def question_difficulty(self):
+        # Hardest questions first; difficulty is 1 minus the average fraction
+        # of marks scored in the reports that mention the question.
+        with self._lock:
+            questions = self._questions
+            observations = questions.column('observations')
+            difficulty = 1 - questions.column('score_sum') / np.maximum(observations, 1)
+            perfect = questions.column('perfect')
+            order = np.argsort(-difficulty, kind='stable')
+            return [{
+                'question': questions.labels[i],
+                'reports': int(observations[i]),
+                'difficulty': round(float(difficulty[i]), 3),
+                'full_marks': int(perfect[i]),
+            } for i in order if observations[i] > 0]
+
+    def score_distribution(self):
+        with self._lock:
+            scores = self._scores[:self._score_rows][self._active[:self._score_rows]]
+        if not len(scores):
+            return {'reports': 0, 'histogram': []}
+        counts, edges = np.histogram(scores, bins=SCORE_BINS)
+        p25, median, p75 = np.percentile(scores, [25, 50, 75])
+        return {
+            'reports': int(len(scores)),
+            'mean': round(float(scores.mean()), 1),
+            'median': round(float(median), 1),
+            'p25': round(float(p25), 1),
+            'p75': round(float(p75), 1),
+            'std': round(float(scores.std()), 1),
+            'histogram': [(int(lo), int(hi), int(count)) for lo, hi, count in zip(edges[:-1], edges[1:], counts)],
+        }
+
+    def summary(self):
+        self.refresh()
+        return {
+            'students': self.student_count,
+            'reports': self.report_count,
+            'topics': self.topic_accuracy(),
+            'errors': self.error_frequency(),
+            'questions': self.question_difficulty(),
+            'scores': self.score_distribution(),
+        }
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_class_analytics(class_num, subject, exam_type=None, paper_hash=None):
+    # One engine per class, subject, exam type and paper for the life of the
+    # process; each call folds in whatever was stored since the previous one.
+    key = (str(class_num), subject, exam_type, paper_hash)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = ClassAnalytics(*key)
+        engine = _engines[key]
+    engine.refresh()
+    return engine
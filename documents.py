@@ -0,0 +1,10 @@
+import io
+
+
+class ExamDocument(io.BytesIO):
+    # Detached copy of a Streamlit UploadedFile that outlives the script run.
+    # Preprocessing, sharding and the job queue all produce these.
+    def __init__(self, name, data, type=None):
+        super().__init__(data)
+        self.name = name
+        self.type = type
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from analysis_store import iter_analyses
+from report_view import ERROR_CATEGORIES
+
+
+# Flattens stored reports into four Parquet datasets that can be scanned
+# without parsing any JSON:
+#   exports/students/   one row per report (scores, student details)
+#   exports/questions/  one row per question listed in a report
+#   exports/topics/     one row per strong or weak topic
+#   exports/errors/     one row per identified error
+# Each is partitioned as date=YYYY-MM-DD/class=N/subject=S. Exports only ever
+# add files: each run writes the reports stored since the previous run, which
+# is recorded in exports/_export_state.json. A --class/--subject run keeps its
+# own watermark there, so a later full run skips what it already wrote and
+# every report is exported exactly once.
+#
+#   python export_analyses.py                      # export new reports to ./exports
+#   python export_analyses.py --out /data/exports
+#   python export_analyses.py --class 10 --subject Mathematics
+#   python export_analyses.py --dry-run            # count what would be exported
+#
+# A re-graded report is exported as a new analysis_id; its students row names
+# the report it replaces, so readers drop analysis_ids found in 'replaces'.
+
+EXPORT_DIR = os.getenv('EXAM_EXPORT_DIR', 'exports')
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))
+STATE_FILE = '_export_state.json'
+
+PARTITION_COLUMNS = ['date', 'class', 'subject']
+
+_KEYS = [
+    ('analysis_id', pa.int64()),
+    ('date', pa.string()),
+    ('class', pa.string()),
+    ('subject', pa.string()),
+]
+
+SCHEMAS = {
+    'students': pa.schema(_KEYS + [
+        ('replaces', pa.int64()),
+        ('result_key', pa.string()),
+        ('created_at', pa.string()),
+        ('board', pa.string()),
+        ('exam_type', pa.string()),
+        ('exam_name', pa.string()),
+        ('exam_date', pa.string()),
+        ('student_name', pa.string()),
+        ('roll_number', pa.string()),
+        ('school_name', pa.string()),
+        ('total_questions', pa.float64()),
+        ('attempted_questions', pa.float64()),
+        ('correct_answers', pa.float64()),
+        ('partially_correct', pa.float64()),
+        ('incorrect_answers', pa.float64()),
+        ('unattempted', pa.float64()),
+        ('accuracy_percentage', pa.float64()),
+        ('total_marks_obtained', pa.float64()),
+        ('total_marks', pa.float64()),
+        ('score_percentage', pa.float64()),
+    ]),
+    'questions': pa.schema(_KEYS + [
+        ('question_number', pa.string()),
+        ('full_marks', pa.bool_()),
+        ('topic', pa.string()),
+        ('marks_obtained', pa.float64()),
+        ('total_marks', pa.float64()),
+        ('issues', pa.list_(pa.string())),
+    ]),
+    'topics': pa.schema(_KEYS + [
+        ('topic', pa.string()),
+        ('strong', pa.bool_()),
+        ('score', pa.string()),
+        ('accuracy', pa.float64()),
+        ('questions', pa.list_(pa.string())),
+    ]),
+    'errors': pa.schema(_KEYS + [
+        ('category', pa.string()),
+        ('description', pa.string()),
+        ('severity', pa.string()),
+        ('questions_affected', pa.list_(pa.string())),
+    ]),
+}
+
+SCORE_FIELDS = ['total_questions', 'attempted_questions', 'correct_answers', 'partially_correct',
+                'incorrect_answers', 'unattempted', 'accuracy_percentage', 'total_marks_obtained', 'total_marks']
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().rstrip('%'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _texts(values):
+    return [str(value) for value in values] if isinstance(values, list) else []
+
+
+def flatten_analysis(record):
+    # One stored row (see analysis_store.iter_analyses) -> {table: [rows]}.
+    analysis = record['analysis']
+    keys = {
+        'analysis_id': record['analysis_id'],
+        'date': record['created_at'][:10],
+        'class': record['class'] or 'unknown',
+        'subject': record['subject'] or 'unknown',
+    }
+
+    personal_details = analysis.get('personal_details') or {}
+    overall_score = analysis.get('overall_score') or {}
+    student = dict(keys, **{field: _number(overall_score.get(field)) for field in SCORE_FIELDS})
+    obtained, total = student['total_marks_obtained'], student['total_marks']
+    student.update({
+        'replaces': record.get('replaces'),
+        'result_key': record['result_key'],
+        'created_at': record['created_at'],
+        'board': record.get('board'),
+        'exam_type': record.get('exam_type'),
+        'exam_name': _text(personal_details.get('exam_name')),
+        'exam_date': _text(personal_details.get('date')),
+        'student_name': _text(personal_details.get('student_name')),
+        'roll_number': _text(personal_details.get('roll_number')),
+        'school_name': _text(personal_details.get('school_name')),
+        'score_percentage': obtained / total * 100 if obtained is not None and total else None,
+    })
+
+    questions = []
+    breakdown = analysis.get('question_wise_breakdown') or {}
+    for item in breakdown.get('highly_accurate_questions') or []:
+        for number in item.get('question_numbers') or []:
+            questions.append(dict(keys, question_number=str(number), full_marks=True,
+                                  topic=_text(item.get('topic')), marks_obtained=None, total_marks=None,
+                                  issues=[]))
+    for item in breakdown.get('needs_improvement') or []:
+        questions.append(dict(keys, question_number=_text(item.get('question_number')), full_marks=False,
+                              topic=_text(item.get('topic')), marks_obtained=_number(item.get('marks_obtained')),
+                              total_marks=_number(item.get('total_marks')), issues=_texts(item.get('issues'))))
+
+    topics = []
+    topic_analysis = analysis.get('topic_wise_performance') or {}
+    for field, strong in (('strong_topics', True), ('areas_for_improvement', False)):
+        for topic in topic_analysis.get(field) or []:
+            topics.append(dict(keys, topic=_text(topic.get('topic')), strong=strong,
+                               score=_text(topic.get('score')), accuracy=_number(topic.get('accuracy')),
+                               questions=_texts(topic.get('questions'))))
+
+    errors = []
+    error_analysis = analysis.get('error_analysis') or {}
+    for category, _ in ERROR_CATEGORIES:
+        found = error_analysis.get(category)
+        if not isinstance(found, list):
+            continue
+        for error in found:
+            errors.append(dict(keys, category=category, description=_text(error.get('description')),
+                               severity=_text(error.get('severity')),
+                               questions_affected=_texts(error.get('questions_affected'))))
+
+    return {'students': [student], 'questions': questions, 'topics': topics, 'errors': errors}
+
+
+def _read_state(out_dir):
+    # last_analysis_id: every report up to it has been exported. scopes:
+    # [{'class', 'subject', 'last_analysis_id'}] from filtered runs, where a
+    # None class or subject matches any.
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        state = {}
+    return {'last_analysis_id': state.get('last_analysis_id', 0), 'scopes': state.get('scopes', [])}
+
+
+def _scope_matches(scope, class_num, subject):
+    # True when every report of (class_num, subject) falls inside scope.
+    return ((scope['class'] is None or scope['class'] == class_num)
+            and (scope['subject'] is None or scope['subject'] == subject))
+
+
+def _already_exported(state, record):
+    return any(record['analysis_id'] <= scope['last_analysis_id']
+               and _scope_matches(scope, record['class'], record['subject'])
+               for scope in state['scopes'])
+
+
+def _advance_state(state, class_num, subject, last_id):
+    if class_num is None and subject is None:
+        state['last_analysis_id'] = max(state['last_analysis_id'], last_id)
+    else:
+        for scope in state['scopes']:
+            if scope['class'] == class_num and scope['subject'] == subject:
+                scope['last_analysis_id'] = max(scope['last_analysis_id'], last_id)
+                break
+        else:
+            state['scopes'].append({'class': class_num, 'subject': subject, 'last_analysis_id': last_id})
+    # Scopes the global watermark, or a broader scope, has caught up with
+    # carry no information.
+    state['scopes'] = [
+        scope for scope in state['scopes']
+        if scope['last_analysis_id'] > state['last_analysis_id']
+        and not any(other is not scope and other['last_analysis_id'] >= scope['last_analysis_id']
+                    and _scope_matches(other, scope['class'], scope['subject'])
+                    for other in state['scopes'])
+    ]
+    return state
+
+
+def _write_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def _write_batch(out_dir, rows, run_id, batch_number):
+    for table, schema in SCHEMAS.items():
+        if not rows[table]:
+            continue
+        ds.write_dataset(
+            pa.Table.from_pylist(rows[table], schema=schema),
+            os.path.join(out_dir, table),
+            format='parquet',
+            partitioning=PARTITION_COLUMNS,
+            partitioning_flavor='hive',
+            basename_template=f"part-{run_id}-{batch_number}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore',
+        )
+
+
+def export_analyses(out_dir=EXPORT_DIR, class_num=None, subject=None, dry_run=False,
+                    batch_size=EXPORT_BATCH_SIZE):
+    # Appends every report stored since the last export that no earlier run
+    # (full or filtered) has written yet.
+    state = _read_state(out_dir)
+    class_num = None if class_num is None else str(class_num)
+    # Scopes covering the whole requested one let the scan start later.
+    after_id = max([state['last_analysis_id']] + [scope['last_analysis_id'] for scope in state['scopes']
+                                                  if _scope_matches(scope, class_num, subject)])
+    run_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    totals = {table: 0 for table in SCHEMAS}
+    totals['reports'] = 0
+
+    rows = {table: [] for table in SCHEMAS}
+    pending = 0
+    batch_number = 0
+    last_id = after_id
+
+    for record in iter_analyses(after_id, class_num, subject):
+        last_id = record['analysis_id']
+        if _already_exported(state, record):
+            continue
+        for table, table_rows in flatten_analysis(record).items():
+            rows[table].extend(table_rows)
+            totals[table] += len(table_rows)
+        totals['reports'] += 1
+        pending += 1
+
+        if pending >= batch_size:
+            if not dry_run:
+                _write_batch(out_dir, rows, run_id, batch_number)
+            rows = {table: [] for table in SCHEMAS}
+            pending = 0
+            batch_number += 1
+
+    if pending and not dry_run:
+        _write_batch(out_dir, rows, run_id, batch_number)
+
+    if last_id > after_id and not dry_run:
+        os.makedirs(out_dir, exist_ok=True)
+        _write_state(out_dir, _advance_state(state, class_num, subject, last_id))
+    return totals
+
+
+def read_table(table, out_dir=EXPORT_DIR, filter=None, columns=None):
+    # Loads an exported table as a pyarrow.Table; partition columns are
+    # pruned by the filter, e.g.
+    #   read_table('topics', filter=(ds.field('class') == '10') & (ds.field('date') >= '2026-01-01'))
+    dataset = ds.dataset(os.path.join(out_dir, table), format='parquet', partitioning='hive',
+                         schema=SCHEMAS[table])
+    return dataset.to_table(filter=filter, columns=columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export stored exam reports as partitioned Parquet tables.")
+    parser.add_argument('--out', default=EXPORT_DIR, help=f"Export root (default: {EXPORT_DIR})")
+    parser.add_argument('--class', dest='class_num', help="Only export this class")
+    parser.add_argument('--subject', help="Only export this subject")
+    parser.add_argument('--dry-run', action='store_true', help="Count what would be exported without writing")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    totals = export_analyses(args.out, args.class_num, args.subject, dry_run=args.dry_run)
+    elapsed = time.perf_counter() - start
+
+    if not totals['reports']:
+        print("No new reports to export")
+        return 0
+
+    print(f"{'Would export' if args.dry_run else 'Exported'} {totals['reports']} report(s) in {elapsed:.1f}s: "
+          f"{totals['questions']} question rows, {totals['topics']} topic rows, {totals['errors']} error rows"
+          f"{'' if args.dry_run else f' -> {args.out}'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
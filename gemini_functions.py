@@ -3,17 +3,95 @@ from google.genai import types
 import os
 import streamlit as st
 import json
+import time
+import hashlib
+import io
+import mimetypes
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
 # from googleapiclient.discovery import build
 # from googleapiclient.http import MediaIoBaseUpload
 # from google.oauth2 import service_account
 # import io
-from github import Github
+from archive import GitHubArchiveBackend, LocalGitBackend, get_archive_pipeline
+from cache_store import file_sha256, get_cached_upload, store_upload
+from cache_store import get_cached_context, store_context, forget_context
+from cache_store import get_cached_result, store_result, record_result_bypass
+from analysis_store import save_analysis
+from student_history import index_student_analysis
+from streaming_json import JSONSectionStream
+from analysis_schema import analysis_response_schema, validate_section, repair_json
+from scheduler import get_scheduler, set_request_session
+from model_router import route_models, record_model_call, is_overloaded
+from preprocess import preprocess_documents, preprocess_files, format_preprocess_report
+from sharding import ANSWER_SHEET_SHARD_PAGES, SHARD_MAX_WORKERS, split_answer_sheet, merge_shard_analyses
+from chat_context import build_chat_context, select_chat_context
+from chat_session import quick_answers_key, get_quick_answers, store_quick_answers
 
 
 load_dotenv()
 
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4'))
+USE_CONTEXT_CACHE = os.getenv('USE_CONTEXT_CACHE', '1') != '0'
+CONTEXT_CACHE_TTL = timedelta(seconds=int(os.getenv('CONTEXT_CACHE_TTL_SECONDS', '3600')))
+
+# (button label, question sent) for the chat's quick-question buttons. Their
+# answers are precomputed in the background as soon as a report is ready.
+QUICK_QUESTIONS = [
+    ("📚 What should I study first?", "Based on my weak topics, what should I focus on first to improve?"),
+    ("🎯 How to avoid silly mistakes?", "I noticed some calculation errors. How can I improve my accuracy?"),
+    ("📈 Score improvement tips?", "What is a realistic score improvement I can achieve if I fix my errors?"),
+]
+
+# Cumulative wall time per local pipeline stage (hashing, preprocessing,
+# JSON parsing, store writes...), summed over every thread. The remote
+# calls are timed by the scheduler and model router instead.
+_stage_stats = {}
+_stage_stats_lock = threading.Lock()
+
+
+def record_stage_time(stage, seconds):
+    with _stage_stats_lock:
+        stats = _stage_stats.setdefault(stage, {'calls': 0, 'seconds': 0.0})
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+
+
+@contextmanager
+def timed_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage_time(stage, time.perf_counter() - start)
+
+
+def get_stage_stats():
+    with _stage_stats_lock:
+        return {stage: dict(stats) for stage, stats in _stage_stats.items()}
+
+
+ANALYSIS_SECTIONS = [
+    'personal_details',
+    'overall_score',
+    'topic_wise_performance',
+    'question_wise_breakdown',
+    'error_analysis',
+    'strengths',
+    'improvements_needed',
+    'personal_feedback',
+]
+
+
+class AnalysisError(Exception):
+    def __init__(self, message, raw_output=None):
+        super().__init__(message)
+        self.raw_output = raw_output
+
 def get_gemini_client():
     api_key = os.getenv('GEMINI_API_KEY')
     if not api_key:
@@ -62,40 +140,107 @@ def get_gemini_client():
 #         return None
 
 
-def sync_to_github(file, category,session_folder):
-    try:
-        g = Github(st.secrets["GITHUB_TOKEN"].strip())
-        repo = g.get_repo(st.secrets["GITHUB_REPO"].strip())
-
-        file_path = f"database/{session_folder}/{category}_{file.name}"
+def _archive_backend():
+    local_repo = os.getenv('ARCHIVE_LOCAL_REPO')
+    if local_repo:
+        return LocalGitBackend(local_repo)
+    return GitHubArchiveBackend(st.secrets["GITHUB_TOKEN"].strip(), st.secrets["GITHUB_REPO"].strip())
 
-        content = file.getbuffer().tobytes()
 
-        repo.create_file(
-            path=file_path,
-            message=f"Archive Session: {session_folder}",
-            content=content,
-            branch="main"
-        )
+def sync_to_github(documents, session_folder):
+    # Queues every (category, file) of a session as one archive commit and
+    # returns immediately; the commit is made by the background pipeline.
+    try:
+        with timed_stage('archive_submit'):
+            get_archive_pipeline(_archive_backend).submit(session_folder, documents)
         return True
     except Exception as e:
         st.error(f"❌ GitHub Archive Failed: {e}")
         return False
 
+
+UPLOAD_ORDER = [
+    ('answer_sheet', 'answer sheet'),
+    ('question_paper', 'question paper'),
+    ('answer_key', 'answer key'),
+]
+
+
+def _upload_file(client, file):
+    content_hash = file_sha256(file)
+    cached = get_cached_upload(content_hash)
+    if cached:
+        return types.Part.from_uri(file_uri=cached['uri'], mime_type=cached['mime_type'])
+
+    # Upload straight from memory: nothing touches the disk and concurrent
+    # sessions can't collide on a shared filename. BytesIO over getvalue()
+    # shares the bytes instead of copying them, and gives the SDK its own
+    # read position so the caller's buffer is left untouched.
+    uploaded_file = get_scheduler().call(
+        'upload', 'files', client.files.upload,
+        file=io.BytesIO(file.getvalue()),
+        config=types.UploadFileConfig(
+            mime_type=getattr(file, 'type', None) or mimetypes.guess_type(file.name)[0] or 'application/octet-stream',
+            display_name=file.name
+        )
+    )
+
+    store_upload(content_hash, uploaded_file)
+    return uploaded_file
+
+
 def upload_to_gemini(client, file):
     try:
-        temp_path = f"./{file.name}"
-        with open(temp_path, "wb") as f:
-            f.write(file.getbuffer())
-        uploaded_file = client.files.upload(file=temp_path)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        return uploaded_file
+        return _upload_file(client, file)
     except Exception as e:
         st.error(f"Error uploading file: {str(e)}")
         return None
 
 
+def _timed_upload(client, file):
+    start = time.perf_counter()
+    try:
+        return _upload_file(client, file), None, time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+
+def upload_exam_documents(client, files_data, keys=None):
+    # Runs off the script thread, so nothing in here may touch st.*; errors
+    # are returned per document and reported by the caller.
+    keys = keys or [key for key, _ in UPLOAD_ORDER]
+    pending = {key: files_data[key] for key in keys if files_data.get(key)}
+
+    uploads, errors, timings = {}, {}, {}
+    if not pending:
+        return uploads, errors, timings
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+        futures = {
+            key: executor.submit(contextvars.copy_context().run, _timed_upload, client, file)
+            for key, file in pending.items()
+        }
+        for key, future in futures.items():
+            uploaded, error, elapsed = future.result()
+            timings[key] = elapsed
+            if error:
+                errors[key] = error
+            else:
+                uploads[key] = uploaded
+    timings['wall'] = time.perf_counter() - wall_start
+
+    return uploads, errors, timings
+
+
+def format_upload_timings(timings):
+    labels = dict(UPLOAD_ORDER)
+    per_file = [f"{labels.get(key, key)} {seconds:.1f}s" for key, seconds in timings.items() if key != 'wall']
+    sequential = sum(seconds for key, seconds in timings.items() if key != 'wall')
+    return (f"⏱️ Uploaded in {timings.get('wall', 0):.1f}s "
+            f"(sequential ≈ {sequential:.1f}s) — {', '.join(per_file)}")
+
+
 def create_analysis_prompt(metadata, has_answer_key, has_syllabus):
     subject = metadata.get('subject', 'Subject')
     class_num = metadata.get('class', '9')
@@ -295,9 +440,328 @@ OUTPUT: Provide ONLY the JSON structure above with actual analysis data. No addi
     return prompt
 
 
-def analyze_exam_with_gemini(client, files_data, metadata):
-    answer_sheet = files_data.get('answer_sheet')
-    question_paper = files_data.get('question_paper')
+def build_analysis_contents(prompt, uploads, syllabus_text=None):
+    contents = [prompt]
+    for key, _ in UPLOAD_ORDER:
+        if key in uploads:
+            contents.append(uploads[key])
+    if syllabus_text is not None:
+        contents.append(f"\n\nSYLLABUS CONTENT:\n{syllabus_text}")
+    return contents
+
+
+def _as_part(upload):
+    if isinstance(upload, types.Part):
+        return upload
+    return types.Part.from_uri(file_uri=upload.uri, mime_type=upload.mime_type)
+
+
+def _shared_context_parts(uploads, syllabus_text):
+    parts = []
+    for key, label in (('question_paper', "QUESTION PAPER:"), ('answer_key', "ANSWER KEY:")):
+        if key in uploads:
+            parts.append(types.Part.from_text(text=label))
+            parts.append(_as_part(uploads[key]))
+    if syllabus_text is not None:
+        parts.append(types.Part.from_text(text=f"SYLLABUS CONTENT:\n{syllabus_text}"))
+    return parts
+
+
+def _context_cache_key(model, prompt, parts):
+    digest = hashlib.sha256()
+    pieces = [model, prompt]
+    for part in parts:
+        pieces.append(part.file_data.file_uri if part.file_data else part.text)
+    for piece in pieces:
+        digest.update(piece.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_context_cache(client, prompt, uploads, syllabus_text=None, model=None):
+    # Returns the name of a cached-content handle holding the prompt, question
+    # paper, answer key and syllabus, or None when the uncached path should be
+    # used instead. Cached content only works with the model it was made for,
+    # which defaults to the primary analysis model.
+    model = model or route_models('analysis')[0]
+    if not USE_CONTEXT_CACHE or 'question_paper' not in uploads:
+        return None
+
+    parts = _shared_context_parts(uploads, syllabus_text)
+    cache_key = _context_cache_key(model, prompt, parts)
+    ttl = f"{int(CONTEXT_CACHE_TTL.total_seconds())}s"
+
+    cached = get_cached_context(cache_key)
+    if cached:
+        remaining = datetime.fromisoformat(cached['expires_at']) - datetime.now(timezone.utc)
+        if remaining < CONTEXT_CACHE_TTL / 2:
+            try:
+                updated = get_scheduler().call(
+                    'context_cache', model, client.caches.update,
+                    name=cached['cache_name'],
+                    config=types.UpdateCachedContentConfig(ttl=ttl)
+                )
+                store_context(cache_key, cached['cache_name'], model,
+                              updated.expire_time or datetime.now(timezone.utc) + CONTEXT_CACHE_TTL)
+            except Exception:
+                pass
+        return cached['cache_name']
+
+    try:
+        # Not retried: a create that timed out may still have made a cache,
+        # and grading works without one anyway.
+        cache = get_scheduler().call(
+            'context_cache', model, client.caches.create,
+            idempotent=False,
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name='exam-review-shared-context',
+                system_instruction=prompt,
+                contents=[types.Content(role='user', parts=parts)],
+                ttl=ttl,
+            )
+        )
+    except Exception:
+        # Below the model's minimum cacheable size, caching unavailable for
+        # the model, or quota exhausted: grade without the cache.
+        return None
+
+    store_context(cache_key, cache.name, model,
+                  cache.expire_time or datetime.now(timezone.utc) + CONTEXT_CACHE_TTL)
+    return cache.name
+
+
+def generate_analysis(client, contents, model, on_chunk=None, on_section=None, cached_content=None,
+                      max_retries=None):
+    response_stream = get_scheduler().stream(
+        'analysis', model, client.models.generate_content_stream,
+        max_retries=max_retries,
+        model=model,
+        contents=contents,
+        config=types.GenerateContentConfig(
+            response_mime_type='application/json',
+            response_json_schema=analysis_response_schema(),
+            temperature=0.1,
+            cached_content=cached_content,
+        )
+    )
+
+    parser = JSONSectionStream()
+    parse_seconds = 0.0
+    for i, chunk in enumerate(response_stream):
+        if chunk.text:
+            start = time.perf_counter()
+            completed = parser.feed(chunk.text)
+            parse_seconds += time.perf_counter() - start
+            if on_chunk:
+                on_chunk(i, chunk.text)
+            if on_section:
+                for key, value in completed:
+                    on_section(key, value)
+
+    full_response_text = parser.text
+    if not full_response_text:
+        raise AnalysisError("Empty response from AI.")
+
+    # Sections that streamed cleanly are kept as they are; whatever is left
+    # is recovered from the raw text (fences, a truncated tail, stray text).
+    start = time.perf_counter()
+    analysis = dict(parser.sections)
+    if not (parser.complete and not parser.malformed):
+        recovered = repair_json(full_response_text)
+        if isinstance(recovered, dict):
+            for key, value in recovered.items():
+                analysis.setdefault(key, value)
+
+    broken = _validate_sections(analysis)
+    record_stage_time('json_parse', parse_seconds + time.perf_counter() - start)
+    if len(broken) == len(ANALYSIS_SECTIONS):
+        raise AnalysisError("Failed to parse AI output: no usable report sections.", full_response_text)
+
+    if broken:
+        # Only the sections that could not be repaired are asked for again,
+        # instead of regenerating the whole report.
+        analysis.update(_request_sections(client, contents, model, broken, cached_content, max_retries))
+        missing = [key for key in broken if key not in analysis]
+        if missing:
+            raise AnalysisError(f"Failed to parse AI output: missing {', '.join(missing)}.", full_response_text)
+
+    if on_section:
+        for key in ANALYSIS_SECTIONS:
+            if key in analysis and (key in broken or key not in parser.sections):
+                on_section(key, analysis[key])
+    return analysis
+
+
+def _validate_sections(analysis):
+    # Coerces each section in place and returns the keys that are missing or
+    # still don't match the schema.
+    broken = []
+    for key in ANALYSIS_SECTIONS:
+        if key not in analysis:
+            broken.append(key)
+            continue
+        analysis[key], problems = validate_section(key, analysis[key])
+        if problems:
+            broken.append(key)
+    return broken
+
+
+def _request_sections(client, contents, model, keys, cached_content=None, max_retries=None):
+    # One extra request for just the named sections, against the same
+    # documents (or context cache) as the original analysis. Returns only the
+    # sections that came back valid.
+    instruction = (f"Return ONLY a JSON object with these keys from the structure described above: "
+                   f"{', '.join(keys)}. Grade exactly as you would for the full report.")
+    response = get_scheduler().call(
+        'analysis_repair', model, client.models.generate_content,
+        max_retries=max_retries,
+        model=model,
+        contents=list(contents) + [instruction],
+        config=types.GenerateContentConfig(
+            response_mime_type='application/json',
+            response_json_schema=analysis_response_schema(keys),
+            temperature=0.1,
+            cached_content=cached_content,
+        )
+    )
+
+    recovered = repair_json(response.text or '') or {}
+    sections = {}
+    for key in keys:
+        if key in recovered:
+            value, problems = validate_section(key, recovered[key])
+            if not problems:
+                sections[key] = value
+    return sections
+
+
+def _generate_for_model(client, model, prompt, uploads, syllabus_text, context_cache, on_chunk, on_section,
+                        sheet_note, max_retries):
+    if context_cache and 'answer_sheet' in uploads:
+        student_contents = [
+            types.Part.from_text(text="STUDENT ANSWER SHEET:"),
+            _as_part(uploads['answer_sheet'])
+        ]
+        if sheet_note:
+            student_contents.append(types.Part.from_text(text=sheet_note))
+        try:
+            return generate_analysis(client, student_contents, model, on_chunk=on_chunk, on_section=on_section,
+                                     cached_content=context_cache, max_retries=max_retries)
+        except AnalysisError:
+            raise
+        except Exception as e:
+            if is_overloaded(e):
+                raise
+            # Expired or evicted remotely; drop it and send everything inline.
+            forget_context(context_cache)
+
+    contents = build_analysis_contents(prompt, uploads, syllabus_text)
+    if sheet_note:
+        contents.append(sheet_note)
+    return generate_analysis(client, contents, model, on_chunk=on_chunk, on_section=on_section,
+                             max_retries=max_retries)
+
+
+def run_with_fallback(stage, models, attempt):
+    # Calls attempt(model, max_retries) for each routed model in turn. A busy
+    # model (after a single retry) or unusable JSON moves on to the next one;
+    # any other error, or a failure on the last model, is raised.
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        start = time.perf_counter()
+        try:
+            result = attempt(model, None if last else 1)
+        except Exception as e:
+            if isinstance(e, (AnalysisError, json.JSONDecodeError)):
+                outcome = 'invalid_json'
+            elif is_overloaded(e):
+                outcome = 'overloaded'
+            else:
+                outcome = 'error'
+            record_model_call(stage, model, time.perf_counter() - start, outcome)
+            if last or outcome == 'error':
+                raise
+            continue
+        record_model_call(stage, model, time.perf_counter() - start, 'ok')
+        return result
+
+
+def generate_exam_analysis(client, prompt, uploads, syllabus_text=None, context_cache=None,
+                           on_chunk=None, on_section=None, sheet_note=None, models=None):
+    # models is the routed list for this exam (primary first); context_cache
+    # must have been built for models[0] and is only used with it. sheet_note
+    # travels with the answer sheet rather than the prompt, so page-range
+    # shards still share one context cache.
+    models = models or route_models('analysis')
+
+    def attempt(model, max_retries):
+        return _generate_for_model(client, model, prompt, uploads, syllabus_text,
+                                   context_cache if model == models[0] else None,
+                                   on_chunk, on_section, sheet_note, max_retries)
+
+    return run_with_fallback('analysis', models, attempt)
+
+
+def grade_answer_sheet_shards(client, prompt, shared_uploads, shards, syllabus_text=None, context_cache=None,
+                              max_workers=SHARD_MAX_WORKERS, models=None):
+    # Grades each page range of one answer sheet concurrently against the
+    # same question paper and key, then merges them into a single report.
+    def grade(shard):
+        uploads = dict(shared_uploads)
+        uploads['answer_sheet'] = _upload_file(client, shard['document'])
+        return generate_exam_analysis(client, prompt, uploads, syllabus_text, context_cache=context_cache,
+                                      sheet_note=shard['note'], models=models)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shards)))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, grade, shard) for shard in shards]
+        analyses = [future.result() for future in futures]
+    return merge_shard_analyses(analyses)
+
+
+def normalize_metadata(metadata):
+    normalized = dict(metadata)
+    if isinstance(normalized.get('focus_areas'), list):
+        normalized['focus_areas'] = sorted(normalized['focus_areas'])
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def analysis_result_key(files_data, metadata, model=None):
+    model = model or route_models('analysis', metadata)[0]
+    digest = hashlib.sha256()
+    digest.update(model.encode('utf-8'))
+    digest.update(normalize_metadata(metadata).encode('utf-8'))
+    for key in ('answer_sheet', 'question_paper', 'answer_key', 'syllabus'):
+        file = files_data.get(key)
+        digest.update(f"|{key}:{file_sha256(file) if file else '-'}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def question_paper_hash(files_data):
+    # Class analytics only compares reports graded against the same paper.
+    paper = files_data.get('question_paper')
+    return file_sha256(paper) if paper else None
+
+
+def record_analysis(result_key, analysis, metadata, paper_hash=None):
+    # Keeps the finished report for class analytics and links it to the
+    # student's earlier reports.
+    with timed_stage('save_analysis'):
+        analysis_id = save_analysis(result_key, analysis, metadata, paper_hash=paper_hash)
+    with timed_stage('student_index'):
+        index_student_analysis(analysis_id, analysis, metadata)
+    return analysis_id
+
+
+def run_exam_analysis(client, files_data, metadata, on_status=None, on_chunk=None, on_section=None,
+                      force_regrade=False, shard_pages=ANSWER_SHEET_SHARD_PAGES):
+    # Streamlit-free grading pipeline shared by the inline UI path and the
+    # background job workers. Progress is reported as (level, message) pairs
+    # where level names the st.* call the UI should use; failures raise.
+    def notify(level, message):
+        if on_status:
+            on_status(level, message)
+
     answer_key = files_data.get('answer_key')
     syllabus = files_data.get('syllabus')
 
@@ -306,106 +770,203 @@ def analyze_exam_with_gemini(client, files_data, metadata):
 
     prompt = create_analysis_prompt(metadata, has_answer_key, has_syllabus)
 
-    try:
-        contents = [prompt]
-
-        if answer_sheet:
-            st.info("📄 Uploading answer sheet to Gemini cloud...")
-            uploaded_answer = upload_to_gemini(client, answer_sheet)
-            if uploaded_answer:
-                contents.append(uploaded_answer)
-
-        if question_paper:
-            st.info("📄 Uploading question paper...")
-            uploaded_question = upload_to_gemini(client, question_paper)
-            if uploaded_question:
-                contents.append(uploaded_question)
-
-        if answer_key:
-            st.info("📄 Uploading answer key...")
-            uploaded_key = upload_to_gemini(client, answer_key)
-            if uploaded_key:
-                contents.append(uploaded_key)
-
-        if syllabus:
-            st.info("📄 Reading syllabus...")
-            syllabus_text = syllabus.read().decode('utf-8')
-            contents.append(f"\n\nSYLLABUS CONTENT:\n{syllabus_text}")
-
-        # st.info("🤖 Analyzing with Gemini AI... This may take 30-60 seconds...")
-        #
-        # response = client.models.generate_content(
-        #     model='gemini-2.5-flash',
-        #     contents=contents,
-        #     config=types.GenerateContentConfig(
-        #         response_mime_type='application/json',
-        #         temperature=0.3
-        #     )
-        # )
-        #
-        # if not response or not response.text:
-        #     st.error("Empty response from AI.")
-        #     return None
-        #
-        # response_text = response.text.strip()
-        #
-        # if "```" in response_text:
-        #     response_text = response_text.replace("```json", "").replace("```", "").strip()
-        #
-        # try:
-        #     analysis = json.loads(response_text)
-        #     return analysis
-        # except json.JSONDecodeError as je:
-        #     st.error(f"Failed to parse AI output as JSON: {str(je)}")
-        #     with st.expander("Show Raw Output"):
-        #         st.code(response_text)
-        #     return None
-        st.info("🤖 Analyzing with Gemini AI... (Streaming mode active)")
+    models = route_models('analysis', metadata)
+    with timed_stage('hashing'):
+        result_key = analysis_result_key(files_data, metadata, model=models[0])
+        paper_hash = question_paper_hash(files_data)
+    if force_regrade:
+        record_result_bypass()
+    else:
+        with timed_stage('result_lookup'):
+            cached_analysis = get_cached_result(result_key)
+        if cached_analysis is not None:
+            notify('info', "⚡ Loaded the stored analysis for these exact files and settings")
+            return cached_analysis
 
-        try:
-            response_stream = client.models.generate_content_stream(
-                model='gemini-3-flash-preview',
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    response_mime_type='application/json',
-                    temperature=0.1,
-                )
-            )
+    with timed_stage('preprocess'):
+        files_data, preprocess_report = preprocess_documents(files_data, [key for key, _ in UPLOAD_ORDER])
 
-            full_response_text = ""
-            progress_bar = st.progress(0, text="AI is thinking and grading...")
+    # Long PDFs are graded as page ranges; their pieces are uploaded by the
+    # shard workers, so only the shared documents are uploaded here.
+    with timed_stage('split_pages'):
+        shards = split_answer_sheet(files_data['answer_sheet'], shard_pages) if files_data.get('answer_sheet') else []
+    upload_keys = ['question_paper', 'answer_key'] if shards else None
 
-            for i, chunk in enumerate(response_stream):
-                if chunk.text:
-                    full_response_text += chunk.text
-                    progress_bar.progress(min((i + 1) * 5, 100), text="📥 Receiving detailed analysis...")
+    notify('info', "📄 Uploading documents to Gemini cloud...")
+    with timed_stage('upload'):
+        uploads, upload_errors, upload_timings = upload_exam_documents(client, files_data, keys=upload_keys)
 
-            if not full_response_text:
-                st.error("Empty response from AI.")
-                return None
+    for key, label in UPLOAD_ORDER:
+        if key in upload_errors:
+            notify('error', f"Error uploading {label}: {upload_errors[key]}")
 
-            clean_json = full_response_text.replace("```json", "").replace("```", "").strip()
+    if upload_timings:
+        notify('caption', format_upload_timings(upload_timings))
+    if preprocess_report:
+        notify('caption', format_preprocess_report(preprocess_report, upload_timings))
 
-            try:
-                analysis = json.loads(clean_json)
-                progress_bar.empty()
-                return analysis
-            except json.JSONDecodeError as je:
-                st.error(f"Failed to parse AI output: {str(je)}")
-                st.expander("View Raw Output").code(full_response_text)
-                return None
+    syllabus_text = None
+    if syllabus:
+        notify('info', "📄 Reading syllabus...")
+        syllabus_text = syllabus.getvalue().decode('utf-8')
 
-        except Exception as e:
-            st.error(f"Error during streaming analysis: {str(e)}")
-            return None
+    with timed_stage('context_cache'):
+        context_cache = get_context_cache(client, prompt, uploads, syllabus_text, model=models[0])
+    if context_cache:
+        notify('caption', "♻️ Question paper and grading instructions served from context cache")
+
+    if shards:
+        notify('info', f"🧩 Grading {len(shards)} page ranges of the answer sheet in parallel...")
+        analysis = grade_answer_sheet_shards(client, prompt, uploads, shards, syllabus_text,
+                                             context_cache=context_cache, models=models)
+        if on_section:
+            for key in ANALYSIS_SECTIONS:
+                if key in analysis:
+                    on_section(key, analysis[key])
+    else:
+        notify('info', "🤖 Analyzing with Gemini AI... (Streaming mode active)")
+        analysis = generate_exam_analysis(client, prompt, uploads, syllabus_text,
+                                          context_cache=context_cache, on_chunk=on_chunk,
+                                          on_section=on_section, models=models)
+    with timed_stage('store_result'):
+        store_result(result_key, analysis)
+    record_analysis(result_key, analysis, metadata, paper_hash=paper_hash)
+    return analysis
+
+
+def analyze_exam_with_gemini(client, files_data, metadata, on_section=None, force_regrade=False,
+                             shard_pages=ANSWER_SHEET_SHARD_PAGES):
+    progress = {}
+    received = set()
+
+    def progress_bar():
+        if 'bar' not in progress:
+            progress['bar'] = st.progress(0, text="AI is thinking and grading...")
+        return progress['bar']
 
+    def on_status(level, message):
+        getattr(st, level)(message)
+
+    def on_chunk(i, text):
+        if not received:
+            progress_bar().progress(min((i + 1) * 2, 10), text="📥 Receiving detailed analysis...")
+
+    def on_section_received(key, value):
+        received.add(key)
+        progress_bar().progress(
+            min(len(received) / len(ANALYSIS_SECTIONS), 1.0),
+            text=f"📥 Received {len(received)}/{len(ANALYSIS_SECTIONS)} report sections..."
+        )
+        if on_section:
+            on_section(key, value)
+
+    try:
+        analysis = run_exam_analysis(client, files_data, metadata, on_status=on_status, on_chunk=on_chunk,
+                                     on_section=on_section_received, force_regrade=force_regrade,
+                                     shard_pages=shard_pages)
+        if 'bar' in progress:
+            progress['bar'].empty()
+        return analysis
+    except AnalysisError as ae:
+        st.error(str(ae))
+        if ae.raw_output:
+            st.expander("View Raw Output").code(ae.raw_output)
+        return None
     except Exception as e:
         st.error(f"Error during analysis: {str(e)}")
         return None
 
 
-def chat_with_gemini(client, user_question, analysis, metadata):
-    context_prompt = f"""You are a supportive, expert AI tutor discussing exam performance with a student.
+def run_analysis_job(context, client, files_data, metadata, force_regrade=False):
+    set_request_session(context.job_id)
+    analysis = run_exam_analysis(client, files_data, metadata, on_status=context.log, on_section=context.section,
+                                 force_regrade=force_regrade)
+    schedule_quick_answers(client, analysis, metadata)
+    return analysis
+
+
+def _grade_answer_sheet(client, answer_sheet, shared_uploads, prompt, syllabus_text, context_cache, result_key,
+                        metadata, models, paper_hash=None, preprocess_report=None):
+    start = time.perf_counter()
+    result = {'file_name': answer_sheet.name, 'analysis': None, 'error': None, 'preprocess': preprocess_report}
+    try:
+        uploads = dict(shared_uploads)
+        uploads['answer_sheet'] = _upload_file(client, answer_sheet)
+        result['analysis'] = generate_exam_analysis(client, prompt, uploads, syllabus_text,
+                                                    context_cache=context_cache, models=models)
+        with timed_stage('store_result'):
+            store_result(result_key, result['analysis'])
+        record_analysis(result_key, result['analysis'], metadata, paper_hash=paper_hash)
+    except Exception as e:
+        result['error'] = str(e)
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+
+def grade_answer_sheets(client, shared_files, answer_sheets, metadata, max_workers=BATCH_MAX_WORKERS,
+                        force_regrade=False):
+    # Yields one result dict per answer sheet in completion order. Sheets with
+    # a stored result come back first; for the rest the question paper and
+    # answer key are uploaded once up front and shared by every worker, and
+    # max_workers bounds how many gradings hit the API at once.
+    models = route_models('analysis', metadata)
+    pending = []
+    for sheet in answer_sheets:
+        result_key = analysis_result_key(dict(shared_files, answer_sheet=sheet), metadata, model=models[0])
+        if force_regrade:
+            record_result_bypass()
+        else:
+            cached_analysis = get_cached_result(result_key)
+            if cached_analysis is not None:
+                yield {'file_name': sheet.name, 'analysis': cached_analysis, 'error': None,
+                       'elapsed': 0.0, 'cached': True}
+                continue
+        pending.append((sheet, result_key))
+
+    if not pending:
+        return
+
+    # All CPU-bound shrinking happens up front in one pass over the process
+    # pool; every result then carries its sheet's before/after sizes.
+    paper_hash = question_paper_hash(shared_files)
+    shared_files, _ = preprocess_documents(shared_files, ['question_paper', 'answer_key'])
+    sheets, sheet_reports = preprocess_files([sheet for sheet, _ in pending])
+    pending = [(sheet, result_key, report)
+               for sheet, (_, result_key), report in zip(sheets, pending, sheet_reports)]
+
+    shared_uploads, shared_errors, _ = upload_exam_documents(
+        client, shared_files, keys=['question_paper', 'answer_key']
+    )
+    if shared_errors:
+        labels = dict(UPLOAD_ORDER)
+        details = '; '.join(f"{labels[key]}: {error}" for key, error in shared_errors.items())
+        raise AnalysisError(f"Could not upload shared documents ({details})")
+
+    syllabus = shared_files.get('syllabus')
+    syllabus_text = syllabus.getvalue().decode('utf-8') if syllabus else None
+
+    prompt = create_analysis_prompt(
+        metadata,
+        shared_files.get('answer_key') is not None,
+        syllabus is not None
+    )
+
+    context_cache = get_context_cache(client, prompt, shared_uploads, syllabus_text, model=models[0])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _grade_answer_sheet,
+                            client, sheet, shared_uploads, prompt, syllabus_text,
+                            context_cache, result_key, metadata, models, paper_hash=paper_hash,
+                            preprocess_report=report)
+            for sheet, result_key, report in pending
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def chat_system_instruction(metadata, summary=''):
+    instruction = f"""You are a supportive, expert AI tutor discussing exam performance with a student.
 
 STUDENT DETAILS:
 - Subject: {metadata.get('subject')}
@@ -414,14 +975,8 @@ STUDENT DETAILS:
 - Exam Type: {metadata.get('exam_type')}
 - Feedback Tone: {metadata.get('feedback_tone', 'Encouraging')}
 
-COMPLETE EXAM ANALYSIS DATA:
-{json.dumps(analysis, indent=2)}
-
-STUDENT'S QUESTION:
-{user_question}
-
-INSTRUCTIONS FOR YOUR RESPONSE:
-1. Answer based ONLY on the provided analysis data above
+INSTRUCTIONS FOR YOUR RESPONSES:
+1. Answer based ONLY on the exam analysis data provided with the student's message
 2. Be {metadata.get('feedback_tone', 'encouraging').lower()} but honest about areas needing work
 3. If they ask about specific questions, refer to 'question_wise_breakdown' section
 4. If they ask about topics, refer to 'topic_wise_performance' section
@@ -431,18 +986,200 @@ INSTRUCTIONS FOR YOUR RESPONSE:
 8. Keep response focused and conversational (150-250 words)
 9. Reference actual question numbers and topics when relevant
 10. Format with markdown for readability (use bullet points, bold, etc.)
+11. Build on earlier turns of the conversation instead of repeating yourself"""
+
+    if summary:
+        instruction += f"\n\nSUMMARY OF THE EARLIER CONVERSATION:\n{summary}"
+    return instruction
+
+
+def chat_turn_prompt(chat_context, user_question):
+    return f"""EXAM ANALYSIS DATA (summary plus the sections relevant to the question, compact JSON):
+{select_chat_context(chat_context, user_question)}
+
+STUDENT'S QUESTION:
+{user_question}"""
+
+
+def chat_contents(session, chat_context, user_question):
+    # Earlier turns go back as plain question/answer text; only the new
+    # question carries analysis excerpts.
+    contents = []
+    if session is not None:
+        for message in session.recent_messages():
+            contents.append(types.Content(
+                role='user' if message['role'] == 'user' else 'model',
+                parts=[types.Part.from_text(text=message['content'])]
+            ))
+    contents.append(types.Content(
+        role='user',
+        parts=[types.Part.from_text(text=chat_turn_prompt(chat_context, user_question))]
+    ))
+    return contents
+
 
-Your response:"""
+def compact_chat_session(client, session, metadata=None):
+    folded = session.pending_compaction()
+    if not folded:
+        return
+
+    transcript = '\n'.join(
+        f"{'STUDENT' if m['role'] == 'user' else 'TUTOR'}: {m['content']}"
+        for m in folded if not m.get('failed')
+    )
+    prompt = f"""Update the running summary of a tutoring conversation about a student's exam results.
+Keep it under 150 words. Keep the question numbers, topics and advice already discussed and anything the student said about themselves.
+
+CURRENT SUMMARY:
+{session.summary or '(none yet)'}
+
+NEW TURNS:
+{transcript}
+
+Updated summary:"""
+
+    def attempt(model, max_retries):
+        return get_scheduler().call(
+            'chat_summary', model, client.models.generate_content,
+            max_retries=max_retries,
+            model=model,
+            contents=prompt,
+            config=types.GenerateContentConfig(temperature=0.2)
+        )
 
     try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=context_prompt,
+        response = run_with_fallback('chat_summary', route_models('chat', metadata), attempt)
+    except Exception:
+        # Keep the turns verbatim; the fold is retried after the next answer.
+        return
+    if response.text:
+        session.fold(response.text.strip(), len(folded))
+
+
+def stream_chat_with_gemini(client, user_question, analysis, metadata, chat_context=None, session=None):
+    # Yields the answer text as it streams in. chat_context comes from
+    # build_chat_context(); callers keep it for the whole session so the
+    # report is only serialized and indexed once. With a ChatSession the
+    # finished answer is recorded and the session persisted.
+    if chat_context is None:
+        with timed_stage('chat_context'):
+            chat_context = build_chat_context(analysis)
+
+    chunks = []
+    failed = False
+    models = route_models('chat', metadata)
+    # Same fallback rules as run_with_fallback, except that once text has
+    # reached the student the answer can't be restarted on another model.
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        start = time.perf_counter()
+        try:
+            stream = get_scheduler().stream(
+                'chat', model, client.models.generate_content_stream,
+                max_retries=None if last else 1,
+                model=model,
+                contents=chat_contents(session, chat_context, user_question),
+                config=types.GenerateContentConfig(
+                    temperature=0.7,
+                    system_instruction=chat_system_instruction(metadata, session.summary if session else '')
+                )
+            )
+            for chunk in stream:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+        except Exception as e:
+            outcome = 'overloaded' if is_overloaded(e) else 'error'
+            record_model_call('chat', model, time.perf_counter() - start, outcome)
+            if chunks or last or outcome == 'error':
+                failed = True
+                error = f"❌ Error getting response: {str(e)}"
+                chunks.append(("\n\n" if chunks else "") + error)
+                yield chunks[-1]
+                break
+            continue
+        record_model_call('chat', model, time.perf_counter() - start, 'ok')
+        break
+
+    if session is not None:
+        with timed_stage('chat_session_save'):
+            session.add_exchange(user_question, ''.join(chunks), failed=failed)
+            session.save()
+        if not failed:
+            compact_chat_session(client, session, metadata)
+            with timed_stage('chat_session_save'):
+                session.save()
+
+
+def chat_with_gemini(client, user_question, analysis, metadata, chat_context=None, session=None):
+    return ''.join(stream_chat_with_gemini(client, user_question, analysis, metadata,
+                                           chat_context=chat_context, session=session))
+
+
+_quick_answer_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='quick-answers')
+_quick_answers_in_flight = set()
+_quick_answers_lock = threading.Lock()
+
+
+def precompute_quick_answers(client, analysis, metadata):
+    # Answers every quick question in one JSON request and stores the
+    # answers next to the report so a button click needs no model call.
+    answers_key = quick_answers_key(analysis, metadata)
+    if get_quick_answers(answers_key) is not None:
+        return
+
+    start = time.perf_counter()
+    questions = '\n'.join(f"{i}. {question}" for i, (_, question) in enumerate(QUICK_QUESTIONS, 1))
+    prompt = f"""EXAM ANALYSIS DATA (compact JSON):
+{build_chat_context(analysis)['full']}
+
+The student is about to ask each of these questions. Answer every one separately, as if it were asked on its own:
+{questions}
+
+Return a JSON object {{"answers": [...]}} holding exactly {len(QUICK_QUESTIONS)} markdown answers in the same order."""
+
+    def attempt(model, max_retries):
+        response = get_scheduler().call(
+            'quick_answers', model, client.models.generate_content,
+            max_retries=max_retries,
+            model=model,
+            contents=prompt,
             config=types.GenerateContentConfig(
-                temperature=0.7
+                temperature=0.7,
+                system_instruction=chat_system_instruction(metadata),
+                response_mime_type='application/json'
             )
         )
-        return response.text
-    except Exception as e:
-        return f"❌ Error getting response: {str(e)}"
+        answers = json.loads(response.text)['answers']
+        if len(answers) != len(QUICK_QUESTIONS):
+            raise AnalysisError(f"Expected {len(QUICK_QUESTIONS)} quick answers, got {len(answers)}")
+        return answers
+
+    answers = run_with_fallback('quick_answers', route_models('chat', metadata), attempt)
+
+    store_quick_answers(
+        answers_key,
+        {question: answer for (_, question), answer in zip(QUICK_QUESTIONS, answers)},
+        time.perf_counter() - start
+    )
+
+
+def schedule_quick_answers(client, analysis, metadata):
+    # Fire and forget: a failed precompute only means the buttons fall back
+    # to a live answer.
+    answers_key = quick_answers_key(analysis, metadata)
+    with _quick_answers_lock:
+        if answers_key in _quick_answers_in_flight:
+            return
+        _quick_answers_in_flight.add(answers_key)
+
+    def run():
+        try:
+            precompute_quick_answers(client, analysis, metadata)
+        except Exception:
+            pass
+        finally:
+            with _quick_answers_lock:
+                _quick_answers_in_flight.discard(answers_key)
 
+    _quick_answer_executor.submit(contextvars.copy_context().run, run)
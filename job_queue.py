@@ -0,0 +1,242 @@
+import os
+import json
+import uuid
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from cache_store import get_connection
+from documents import ExamDocument
+
+
+JOBS_DB_PATH = os.getenv('EXAM_JOBS_DB', os.path.join('.cache', 'jobs.sqlite'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+# Each process stamps its active jobs every JOB_HEARTBEAT_SECONDS; a job
+# whose stamp is older than JOB_STALE_SECONDS belongs to a dead process.
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', '5'))
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', '30'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    metadata_json TEXT,
+    messages_json TEXT NOT NULL DEFAULT '[]',
+    sections_json TEXT NOT NULL DEFAULT '{}',
+    result_json TEXT,
+    error TEXT,
+    raw_output TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    heartbeat_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+"""
+
+# Added after the first release; older job databases gain it on connect.
+_COLUMNS = {'jobs': {'heartbeat_at': 'TEXT'}}
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# Random per process, so a restarted server never mistakes jobs from its
+# previous life for its own, even with the same hostname and PID (as in a
+# restarted container).
+BOOT_ID = uuid.uuid4().hex
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='exam-job')
+_write_lock = threading.Lock()
+
+
+def snapshot_files(files_data):
+    return {
+        key: ExamDocument(file.name, file.getvalue(), getattr(file, 'type', None)) if file else None
+        for key, file in files_data.items()
+    }
+
+
+class JobContext:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._messages = []
+        self._sections = {}
+
+    def log(self, level, message):
+        self._messages.append([level, message])
+        _update(self.job_id, messages_json=json.dumps(self._messages))
+
+    def section(self, key, value):
+        self._sections[key] = value
+        _update(self.job_id, sections_json=json.dumps(self._sections))
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _connect():
+    return get_connection(JOBS_DB_PATH, _SCHEMA, _COLUMNS)
+
+
+def _update(job_id, **fields):
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    with _write_lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+        finally:
+            conn.close()
+
+
+def _run(job_id, target, args, kwargs):
+    _update(job_id, status='running', started_at=_now())
+    context = JobContext(job_id)
+    try:
+        result = target(context, *args, **kwargs)
+    except Exception as e:
+        _update(job_id, status='failed', error=str(e), raw_output=getattr(e, 'raw_output', None),
+                finished_at=_now())
+        return
+    _update(job_id, status='done', result_json=json.dumps(result), finished_at=_now())
+
+
+def submit_job(kind, target, *args, metadata=None, **kwargs):
+    # target(context, *args, **kwargs) runs on the worker pool and must return
+    # something JSON-serializable; context.log / context.section publish
+    # progress that get_job() readers can show while it runs.
+    job_id = uuid.uuid4().hex
+    now = _now()
+    _start_heartbeat()
+    with _write_lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT INTO jobs (job_id, kind, status, worker, metadata_json, created_at, heartbeat_at)
+                       VALUES (?, ?, 'queued', ?, ?, ?, ?)""",
+                    (job_id, kind, BOOT_ID, json.dumps(metadata) if metadata is not None else None, now, now)
+                )
+        finally:
+            conn.close()
+
+    _executor.submit(_run, job_id, target, args, kwargs)
+    return job_id
+
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+
+    job = dict(row)
+    job['metadata'] = json.loads(job.pop('metadata_json')) if job['metadata_json'] else None
+    job['messages'] = json.loads(job.pop('messages_json'))
+    job['sections'] = json.loads(job.pop('sections_json'))
+    job['result'] = json.loads(job.pop('result_json')) if job['result_json'] else None
+    return job
+
+
+def get_job_status(job_id):
+    job = get_job(job_id)
+    return job['status'] if job else None
+
+
+def get_job_result(job_id):
+    job = get_job(job_id)
+    if job is None or job['status'] != 'done':
+        return None
+    return job['result']
+
+
+def count_active_jobs():
+    conn = _connect()
+    try:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM jobs WHERE status IN ({', '.join('?' for _ in ACTIVE_STATUSES)})",
+            ACTIVE_STATUSES
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def recover_interrupted_jobs():
+    # Jobs of a process that stopped heartbeating can never finish; fail them
+    # so pollers stop waiting instead of spinning forever after a restart.
+    # Another live process sharing the database keeps its jobs fresh.
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=JOB_STALE_SECONDS)).isoformat()
+    try:
+        with _write_lock:
+            conn = _connect()
+            try:
+                with conn:
+                    conn.execute(
+                        f"""UPDATE jobs SET status = 'failed', error = ?, finished_at = ?
+                            WHERE status IN ({', '.join('?' for _ in ACTIVE_STATUSES)})
+                              AND worker != ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)""",
+                        ("Interrupted by a server restart. Please analyze again.", _now(),
+                         *ACTIVE_STATUSES, BOOT_ID, cutoff)
+                    )
+            finally:
+                conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def _heartbeat():
+    try:
+        with _write_lock:
+            conn = _connect()
+            try:
+                with conn:
+                    conn.execute(
+                        f"""UPDATE jobs SET heartbeat_at = ?
+                            WHERE worker = ? AND status IN ({', '.join('?' for _ in ACTIVE_STATUSES)})""",
+                        (_now(), BOOT_ID, *ACTIVE_STATUSES)
+                    )
+            finally:
+                conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        _heartbeat()
+        recover_interrupted_jobs()
+
+
+_heartbeat_thread = None
+_started = False
+_start_lock = threading.Lock()
+
+
+def _start_heartbeat():
+    global _heartbeat_thread
+    with _start_lock:
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name='exam-job-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+
+def start_job_queue():
+    # Called by the app on every script run; recovery happens once per server
+    # process. It is not done at import time because preprocessing pool
+    # workers import this module too and must not touch the job table.
+    global _started
+    _start_heartbeat()
+    with _start_lock:
+        if not _started:
+            recover_interrupted_jobs()
+            _started = True
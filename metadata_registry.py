@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+
+METADATA_DIR = os.getenv('EXAM_METADATA_DIR', 'metadata')
+# How often, at most, the class files are checked for changes. Between checks
+# a Streamlit rerun reads everything from memory.
+METADATA_RELOAD_SECONDS = float(os.getenv('METADATA_RELOAD_SECONDS', '5'))
+
+CLASS_FILE_PATTERN = re.compile(r'^class_(\w+)_metadata\.json$')
+
+# (metadata key, default key) for the dropdowns, with the options the form
+# falls back to when a class file leaves them out.
+SELECT_FIELDS = {
+    'subject': ('available_subjects', 'default_subject', ["Mathematics"], "Mathematics"),
+    'board': ('boards', 'default_board', ["CBSE"], "CBSE"),
+    'exam_type': ('exam_types', 'default_exam_type', ["Unit Test"], "Unit Test"),
+}
+# Settings stored as {"options": [...], "default": ...}.
+CHOICE_FIELDS = {
+    'strictness': ('checking_strictness', ['Lenient', 'Moderate', 'Strict', 'Very Strict'], 'Moderate'),
+    'answer_depth': ('answer_depth', ['Basic', 'Intermediate', 'Advanced', 'Expert'], 'Intermediate'),
+    'feedback_tone': ('feedback_tone', ["Highly Encouraging", "Balanced", "Direct", "Critical"], 'Balanced'),
+    'explanation_level': ('explanation_level', ["Simple", "Moderate", "Grade-appropriate", "Exam-Oriented"],
+                          'Grade-appropriate'),
+}
+
+logger = logging.getLogger('exam_review.metadata')
+
+
+class MetadataError(Exception):
+    pass
+
+
+def _options(value, path, problems):
+    if not isinstance(value, list) or not value or not all(isinstance(item, str) for item in value):
+        problems.append(f"{path} must be a non-empty list of strings")
+        return None
+    return value
+
+
+def _field(options, default, path, problems):
+    # (options, index of the default) so the form never searches a list.
+    if options is None:
+        return None
+    if default not in options:
+        problems.append(f"{path} default {default!r} is not one of its options")
+        return None
+    return {'options': options, 'index': options.index(default), 'default': default}
+
+
+def build_class_form(class_num, metadata):
+    # Validates one class file and precomputes everything the exam
+    # configuration form needs. Raises MetadataError listing every problem.
+    problems = []
+    if not isinstance(metadata, dict):
+        raise MetadataError(f"class {class_num}: expected a JSON object")
+    if str(metadata.get('class', class_num)) != class_num:
+        problems.append(f"'class' is {metadata.get('class')!r} but the file is for class {class_num}")
+
+    fields = {}
+    for name, (options_key, default_key, fallback, fallback_default) in SELECT_FIELDS.items():
+        options = _options(metadata.get(options_key, fallback), options_key, problems)
+        fields[name] = _field(options, metadata.get(default_key, fallback_default), options_key, problems)
+
+    for name, (config_key, fallback, fallback_default) in CHOICE_FIELDS.items():
+        config = metadata.get(config_key, {})
+        if not isinstance(config, dict):
+            problems.append(f"{config_key} must be an object with 'options' and 'default'")
+            continue
+        options = _options(config.get('options', fallback), f"{config_key}.options", problems)
+        fields[name] = _field(options, config.get('default', fallback_default), config_key, problems)
+        if fields[name] is not None:
+            fields[name]['description'] = config.get('description', '')
+
+    key_topics = metadata.get('key_topics', {})
+    if not isinstance(key_topics, dict):
+        problems.append("key_topics must map subjects to lists of topics")
+        key_topics = {}
+    topics = {}
+    for subject, subject_topics in key_topics.items():
+        if _options(subject_topics, f"key_topics.{subject}", problems) is not None:
+            topics[subject] = tuple(subject_topics)
+
+    if problems:
+        raise MetadataError(f"class {class_num}: " + '; '.join(problems))
+
+    subjects = fields['subject']['options']
+    return {
+        'class': class_num,
+        'metadata': metadata,
+        'fields': fields,
+        'topics': {subject: topics.get(subject, ()) for subject in subjects},
+    }
+
+
+def _class_sort_key(class_num):
+    return (0, int(class_num)) if class_num.isdigit() else (1, class_num)
+
+
+class MetadataRegistry:
+    # Every class file under METADATA_DIR, parsed and validated once per
+    # process. A file that changes on disk is reloaded on the next check; if
+    # the new version is invalid the previous one is kept and the error is
+    # logged. The first load raises instead, so a bad deploy fails at startup.
+    def __init__(self, metadata_dir=METADATA_DIR, reload_seconds=METADATA_RELOAD_SECONDS):
+        self.metadata_dir = metadata_dir
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._forms = {}
+        self._mtimes = {}
+        self._classes = ()
+        self._checked = None
+
+    def _scan(self):
+        files = {}
+        with os.scandir(self.metadata_dir) as entries:
+            for entry in entries:
+                match = CLASS_FILE_PATTERN.match(entry.name)
+                if match and entry.is_file():
+                    files[match.group(1)] = (entry.path, entry.stat().st_mtime)
+        return files
+
+    def _refresh(self, strict):
+        try:
+            files = self._scan()
+        except OSError as e:
+            if strict:
+                raise MetadataError(f"Cannot read metadata directory {self.metadata_dir}: {e}")
+            logger.warning("Keeping loaded metadata; %s is unreadable: %s", self.metadata_dir, e)
+            return
+
+        errors = []
+        for class_num, (path, mtime) in files.items():
+            if self._mtimes.get(class_num) == mtime:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    form = build_class_form(class_num, json.load(f))
+            except (OSError, json.JSONDecodeError, MetadataError) as e:
+                errors.append(f"{path}: {e}")
+                continue
+            self._forms[class_num] = form
+            self._mtimes[class_num] = mtime
+            logger.info("Loaded metadata for class %s from %s", class_num, path)
+
+        for class_num in set(self._forms) - set(files):
+            del self._forms[class_num]
+            del self._mtimes[class_num]
+
+        if errors:
+            if strict:
+                raise MetadataError("Invalid exam metadata:\n" + '\n'.join(errors))
+            for error in errors:
+                logger.warning("Keeping previous metadata; %s", error)
+        if not self._forms and strict:
+            raise MetadataError(f"No class metadata files found in {self.metadata_dir}")
+        self._classes = tuple(sorted(self._forms, key=_class_sort_key))
+
+    def _current(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked is None:
+                self._refresh(strict=True)
+                self._checked = now
+            elif now - self._checked >= self.reload_seconds:
+                self._refresh(strict=False)
+                self._checked = now
+            return self._forms, self._classes
+
+    def load(self):
+        # Loads everything now; raises MetadataError if any file is invalid.
+        self._current()
+
+    def classes(self):
+        return self._current()[1]
+
+    def form(self, class_num):
+        return self._current()[0].get(class_num)
+
+    def topics(self, class_num, subject):
+        form = self.form(class_num)
+        return list(form['topics'].get(subject, ())) if form else []
+
+
+_registry = MetadataRegistry()
+
+
+def get_metadata_registry():
+    return _registry
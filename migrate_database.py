@@ -0,0 +1,113 @@
+import os
+import re
+import sys
+import argparse
+
+from archive import BLOB_DIR, MANIFEST_NAME, manifest_entry, merge_manifest
+
+
+# Rewrites database/<timestamp>/<CATEGORY>_<name> folders into the
+# content-addressed layout used by the archive pipeline:
+#   database/blobs/<aa>/<sha256>       one copy per distinct document
+#   database/<timestamp>/manifest.json what the session archived
+#
+#   python migrate_database.py                 # migrate ./database in place
+#   python migrate_database.py --dry-run       # report savings only
+#   python migrate_database.py --keep-originals
+
+CATEGORY_PATTERN = re.compile(r'^(ANS_SHEET(?:_\d+)?|QUES_PAPER|ANS_KEY|Syll_KEY)_(.+)$')
+
+
+def split_archived_name(filename):
+    match = CATEGORY_PATTERN.match(filename)
+    if match:
+        return match.group(1), match.group(2)
+    return None, filename
+
+
+def migrate_session(root, session, seen, dry_run=False, keep_originals=False):
+    session_dir = os.path.join(root, session)
+    entries = []
+    written = 0
+    deduplicated = 0
+
+    for filename in sorted(os.listdir(session_dir)):
+        source = os.path.join(session_dir, filename)
+        if filename == MANIFEST_NAME or not os.path.isfile(source):
+            continue
+
+        with open(source, 'rb') as f:
+            data = f.read()
+
+        category, name = split_archived_name(filename)
+        entry = manifest_entry(category, name, data)
+        entries.append(entry)
+
+        target = os.path.join(root, entry['blob'])
+        if entry['sha256'] in seen or os.path.exists(target):
+            deduplicated += len(data)
+        else:
+            written += len(data)
+            if not dry_run:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f:
+                    f.write(data)
+        seen.add(entry['sha256'])
+
+    if entries and not dry_run:
+        manifest_path = os.path.join(session_dir, MANIFEST_NAME)
+        existing = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'rb') as f:
+                existing = f.read()
+        with open(manifest_path, 'wb') as f:
+            f.write(merge_manifest(existing, session, entries))
+
+        if not keep_originals:
+            for entry in entries:
+                os.remove(os.path.join(session_dir, entry['path']))
+
+    return len(entries), written, deduplicated
+
+
+def migrate(root, dry_run=False, keep_originals=False):
+    totals = {'sessions': 0, 'files': 0, 'bytes_written': 0, 'bytes_deduplicated': 0}
+    seen = set()
+
+    for session in sorted(os.listdir(root)):
+        if session == BLOB_DIR or not os.path.isdir(os.path.join(root, session)):
+            continue
+
+        files, written, deduplicated = migrate_session(root, session, seen, dry_run, keep_originals)
+        if not files:
+            continue
+
+        totals['sessions'] += 1
+        totals['files'] += files
+        totals['bytes_written'] += written
+        totals['bytes_deduplicated'] += deduplicated
+        print(f"{session}: {files} file(s), {written} bytes stored, {deduplicated} bytes deduplicated")
+
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the database/ archive to content-addressed blobs.")
+    parser.add_argument('--root', default='database', help="Archive root (default: database)")
+    parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing")
+    parser.add_argument('--keep-originals', action='store_true', help="Leave the per-session copies in place")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        print(f"Archive root not found: {args.root}", file=sys.stderr)
+        return 1
+
+    totals = migrate(args.root, dry_run=args.dry_run, keep_originals=args.keep_originals)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {totals['files']} file(s) "
+          f"in {totals['sessions']} session(s): {totals['bytes_written']} bytes stored, "
+          f"{totals['bytes_deduplicated']} bytes deduplicated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import os
+import json
+import logging
+import threading
+
+from google.genai import errors
+
+
+MODEL_ROUTING_CONFIG = os.getenv('MODEL_ROUTING_CONFIG', os.path.join('metadata', 'model_routing.json'))
+
+# Used when the routing file is missing or unreadable.
+DEFAULT_ROUTES = {
+    'analysis': ['gemini-3-flash-preview', 'gemini-2.5-flash'],
+    'chat': ['gemini-2.5-flash', 'gemini-2.5-flash-lite'],
+}
+
+# Errors that mean "this model is busy right now", as opposed to a bad
+# request that would fail on any model.
+OVERLOAD_STATUS_CODES = {429, 500, 503, 504}
+
+logger = logging.getLogger('exam_review.model_router')
+
+
+def is_overloaded(error):
+    return isinstance(error, errors.APIError) and error.code in OVERLOAD_STATUS_CODES
+
+
+class ModelRouter:
+    # Picks an ordered list of models (primary first, then fallbacks) per
+    # stage from metadata/model_routing.json. The first rule whose "match"
+    # fields all contain the request's class/subject/exam type wins. The file
+    # is re-read when it changes, so routing can be tuned on a live server.
+    def __init__(self, config_path=MODEL_ROUTING_CONFIG):
+        self.config_path = config_path
+        self._config = {'defaults': DEFAULT_ROUTES, 'rules': []}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            return self._config
+        if mtime != self._mtime:
+            try:
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    self._config = json.load(f)
+                logger.info("Loaded model routing from %s", self.config_path)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning("Keeping previous model routing; %s is unreadable: %s", self.config_path, e)
+            self._mtime = mtime
+        return self._config
+
+    def models(self, stage, metadata=None):
+        metadata = metadata or {}
+        with self._lock:
+            config = self._load()
+
+        for rule in config.get('rules', []):
+            match = rule.get('match', {})
+            if stage in rule and all(str(metadata.get(field)) in values for field, values in match.items()):
+                chosen, source = rule[stage], rule.get('name', 'unnamed rule')
+                break
+        else:
+            chosen = config.get('defaults', {}).get(stage) or DEFAULT_ROUTES[stage]
+            source = 'defaults'
+
+        logger.info("Routing %s (class=%s, subject=%s, exam_type=%s) via %s -> %s", stage,
+                    metadata.get('class'), metadata.get('subject'), metadata.get('exam_type'), source, chosen)
+        return list(chosen)
+
+    def record(self, stage, model, seconds, outcome):
+        # outcome: 'ok', 'overloaded', 'invalid_json' or 'error'.
+        logger.info("%s on %s: %s in %.2fs", stage, model, outcome, seconds)
+        with self._lock:
+            stats = self._stats.setdefault(model, {'calls': 0, 'ok': 0, 'failures': 0, 'total_seconds': 0.0})
+            stats['calls'] += 1
+            stats['total_seconds'] += seconds
+            if outcome == 'ok':
+                stats['ok'] += 1
+            else:
+                stats['failures'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                model: dict(stats, avg_seconds=stats['total_seconds'] / stats['calls'])
+                for model, stats in self._stats.items()
+            }
+
+
+_router = ModelRouter()
+
+
+def route_models(stage, metadata=None):
+    return _router.models(stage, metadata)
+
+
+def record_model_call(stage, model, seconds, outcome):
+    _router.record(stage, model, seconds, outcome)
+
+
+def get_router_stats():
+    return _router.stats()
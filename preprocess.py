@@ -0,0 +1,205 @@
+import io
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from documents import ExamDocument
+
+try:
+    import pymupdf  # re-renders scanned PDFs
+except ImportError:
+    pymupdf = None
+
+logger = logging.getLogger('exam_review.preprocess')
+
+
+PREPROCESS_ENABLED = os.getenv('PREPROCESS_ENABLED', '1') != '0'
+PREPROCESS_DPI = int(os.getenv('PREPROCESS_DPI', '150'))
+PREPROCESS_JPEG_QUALITY = int(os.getenv('PREPROCESS_JPEG_QUALITY', '70'))
+PREPROCESS_GRAYSCALE = os.getenv('PREPROCESS_GRAYSCALE', '1') != '0'
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', str(os.cpu_count() or 2)))
+
+# Phone photos carry no meaningful DPI, so images are sized as if they were
+# a full A4 page scanned at PREPROCESS_DPI.
+A4_LONG_SIDE_INCHES = 11.69
+
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _settings():
+    return {
+        'dpi': PREPROCESS_DPI,
+        'quality': PREPROCESS_JPEG_QUALITY,
+        'grayscale': PREPROCESS_GRAYSCALE,
+    }
+
+
+def _prepare_image(image, settings):
+    image = ImageOps.exif_transpose(image)
+    max_side = int(A4_LONG_SIDE_INCHES * settings['dpi'])
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if settings['grayscale']:
+        return image.convert('L')
+    return image.convert('RGB') if image.mode not in ('RGB', 'L') else image
+
+
+def _encode_image(image, mime_type, settings):
+    # Saving without exif/icc arguments drops the source metadata.
+    out = io.BytesIO()
+    if mime_type == 'image/png':
+        image.save(out, format='PNG', optimize=True)
+    else:
+        image.save(out, format='JPEG', quality=settings['quality'], optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _shrink_image(data, mime_type, settings):
+    with Image.open(io.BytesIO(data)) as image:
+        prepared = _prepare_image(image, settings)
+        encoded_type = 'image/png' if mime_type == 'image/png' else 'image/jpeg'
+        return _encode_image(prepared, encoded_type, settings), encoded_type
+
+
+class Skipped(Exception):
+    # Raised by a shrinker that leaves the document as uploaded; the message
+    # says why and ends up in the preprocess report.
+    pass
+
+
+def _shrink_pdf(data, settings):
+    # Only scans are re-rendered; a PDF with a text layer is already compact
+    # and rasterizing it would throw that text away.
+    if pymupdf is None:
+        raise Skipped("PyMuPDF is not installed")
+    with pymupdf.open(stream=data, filetype='pdf') as source:
+        if any(page.get_text().strip() for page in source):
+            raise Skipped("PDF has a text layer")
+        colorspace = pymupdf.csGRAY if settings['grayscale'] else pymupdf.csRGB
+        output = pymupdf.open()
+        for page in source:
+            pixmap = page.get_pixmap(dpi=settings['dpi'], colorspace=colorspace)
+            jpeg = pixmap.tobytes('jpeg', jpg_quality=settings['quality'])
+            target = output.new_page(width=page.rect.width, height=page.rect.height)
+            target.insert_image(target.rect, stream=jpeg)
+        rendered = output.tobytes(garbage=4, deflate=True)
+        output.close()
+    return rendered
+
+
+def _process_document(name, mime_type, data, settings):
+    # Runs in a worker process: takes and returns plain bytes so nothing
+    # Streamlit-specific has to be pickled.
+    start = time.perf_counter()
+    skipped = None
+    try:
+        if mime_type in IMAGE_TYPES:
+            processed, processed_type = _shrink_image(data, mime_type, settings)
+        elif mime_type == 'application/pdf':
+            processed, processed_type = _shrink_pdf(data, settings), mime_type
+        else:
+            raise Skipped(f"unsupported type {mime_type}")
+    except Skipped as e:
+        processed, processed_type, skipped = data, mime_type, str(e)
+    except Exception as e:
+        processed, processed_type, skipped = data, mime_type, f"could not be processed ({e})"
+
+    if skipped is None and len(processed) >= len(data):
+        processed, processed_type, skipped = data, mime_type, "already compact"
+    return processed, processed_type, time.perf_counter() - start, skipped
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the server process runs many threads and a
+            # forked child could inherit a lock held by one of them.
+            _pool = ProcessPoolExecutor(max_workers=max(1, PREPROCESS_WORKERS),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def preprocess_files(files):
+    # Returns (processed files, reports), both in input order. Each processed
+    # file is a detached ExamDocument; each report holds before/after bytes,
+    # the seconds spent on that file and, if it was left as uploaded, why.
+    if not PREPROCESS_ENABLED or not files:
+        return list(files), [None] * len(files)
+
+    settings = _settings()
+    jobs = [(file.name, getattr(file, 'type', None), file.getvalue(), settings) for file in files]
+    if len(jobs) > 1:
+        results = list(_get_pool().map(_process_document, *zip(*jobs)))
+    else:
+        results = [_process_document(*jobs[0])]
+
+    processed_files, reports = [], []
+    for (name, mime_type, data, _), (processed, processed_type, seconds, skipped) in zip(jobs, results):
+        if skipped:
+            logger.info("Left %s as uploaded: %s", name, skipped)
+        processed_files.append(ExamDocument(name, processed, processed_type))
+        reports.append({'before': len(data), 'after': len(processed), 'seconds': seconds, 'skipped': skipped})
+    return processed_files, reports
+
+
+def preprocess_documents(files_data, keys):
+    # Same as preprocess_files for the named entries of a files_data dict;
+    # report is keyed by files_data key.
+    present = [key for key in keys if files_data.get(key) is not None]
+    processed, reports = preprocess_files([files_data[key] for key in present])
+    result = dict(files_data)
+    report = {}
+    for key, file, file_report in zip(present, processed, reports):
+        result[key] = file
+        if file_report:
+            report[key] = file_report
+    return result, report
+
+
+def merge_images_to_pdf(files, name='answer_sheet.pdf'):
+    # Combines one-photo-per-page answer sheets into a single PDF, pages in
+    # upload order, each prepared like a standalone image.
+    settings = _settings()
+    pages = []
+    for file in files:
+        with Image.open(io.BytesIO(file.getvalue())) as image:
+            pages.append(_prepare_image(image, settings))
+
+    out = io.BytesIO()
+    pages[0].save(out, format='PDF', save_all=True, append_images=pages[1:],
+                  resolution=float(settings['dpi']), quality=settings['quality'])
+    return ExamDocument(name, out.getvalue(), 'application/pdf')
+
+
+def format_preprocess_report(report, upload_timings=None):
+    # upload_timings (from upload_exam_documents) lets the saving be stated
+    # in seconds: each upload is scaled back up to its original size.
+    shrunk = {key: item for key, item in report.items() if not item.get('skipped')}
+    skipped = sorted({item['skipped'] for item in report.values() if item.get('skipped')})
+    before = sum(item['before'] for item in shrunk.values())
+    after = sum(item['after'] for item in shrunk.values())
+    cpu_seconds = sum(item['seconds'] for item in report.values())
+    if not shrunk:
+        return f"🗜️ Left {len(report)} document(s) as uploaded ({', '.join(skipped)})"
+    message = (f"🗜️ Preprocessed {len(shrunk)} document(s): {before / 1024:.0f} KB → {after / 1024:.0f} KB "
+               f"({cpu_seconds:.1f}s CPU)")
+
+    if upload_timings:
+        saved = sum(
+            upload_timings[key] * (item['before'] / item['after'] - 1)
+            for key, item in shrunk.items()
+            if upload_timings.get(key) and item['after']
+        )
+        message += f", ≈{saved:.1f}s upload time saved"
+    if skipped:
+        message += f"; {len(report) - len(shrunk)} left as uploaded ({', '.join(skipped)})"
+    return message
@@ -0,0 +1,300 @@
+# Turns an analysis into render-ready pieces (HTML cards, labels, counts) so
+# the Streamlit page only has to place them. A report's view is built once
+# per result; reruns and fragment reruns reuse it.
+
+ERROR_CATEGORIES = [
+    ('conceptual_errors', "Conceptual Errors"),
+    ('calculation_mistakes', "Calculation Mistakes"),
+    ('incomplete_steps', "Incomplete Steps"),
+    ('poor_explanation', "Poor Explanation"),
+    ('notation_errors', "Notation Errors"),
+]
+
+
+def _questions(error):
+    return ', '.join(map(str, error.get('questions_affected', [])))
+
+
+def personal_details_view(analysis, metadata):
+    personal_details = analysis.get('personal_details', {})
+
+    if personal_details:
+        return f"""
+        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white; margin-bottom: 2rem;'>
+            <h2 style='margin: 0; color: white;'>Student Performance Overview</h2>
+            <p style='margin: 0.5rem 0 0 0; opacity: 0.9;'>
+                {personal_details.get('student_name', 'Student')} •
+                Roll No: {personal_details.get('roll_number', 'N/A')} •
+                Class {personal_details.get('class', metadata['class'])} •
+                {personal_details.get('subject', metadata['subject'])}
+            </p>
+            <p style='margin: 0.3rem 0 0 0; opacity: 0.8; font-size: 0.9rem;'>
+                {personal_details.get('exam_name', metadata['exam_type'])} •
+                {personal_details.get('date', 'Date not available')}
+            </p>
+        </div>
+        """
+    return f"""
+        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white; margin-bottom: 2rem;'>
+            <h2 style='margin: 0; color: white;'>Student Performance Overview</h2>
+            <p style='margin: 0.5rem 0 0 0; opacity: 0.9;'>Class {metadata['class']} • {metadata['subject']} • {metadata['exam_type']}</p>
+        </div>
+        """
+
+
+def _score_card(colour, value, label, detail):
+    return f"""
+        <div style='background: {colour}; padding: 1.5rem; border-radius: 8px; text-align: center;'>
+            <h3 style='margin: 0; color: white; font-size: 2.5rem;'>{value}</h3>
+            <p style='margin: 0.5rem 0 0 0; color: white; opacity: 0.9;'>{label}</p>
+            <p style='margin: 0.3rem 0 0 0; color: white; opacity: 0.8; font-size: 0.9rem;'>{detail}</p>
+        </div>
+        """
+
+
+def overall_score_view(analysis, metadata):
+    # The four score cards, left to right.
+    overall_score = analysis.get('overall_score', {})
+
+    total_marks = overall_score.get('total_marks', 100)
+    marks_obtained = overall_score.get('total_marks_obtained', 0)
+    percentage = (marks_obtained / total_marks * 100) if total_marks > 0 else 0
+    accuracy = overall_score.get('accuracy_percentage', 0)
+
+    return [
+        _score_card('#4CAF50', f"{percentage:.1f}%", "Overall Score", f"{marks_obtained}/{total_marks} marks"),
+        _score_card('#2196F3', overall_score.get('total_questions', 0), "Total Questions",
+                    f"Attempted: {overall_score.get('attempted_questions', 0)}"),
+        _score_card('#FF9800', overall_score.get('correct_answers', 0), "Correct Answers",
+                    f"Partial: {overall_score.get('partially_correct', 0)}"),
+        _score_card('#9C27B0', f"{accuracy:.0f}%", "Accuracy",
+                    f"Incorrect: {overall_score.get('incorrect_answers', 0)}"),
+    ]
+
+
+def format_topic_score(topic):
+    score = topic.get('score', 'N/A')
+    if 'accuracy' in topic:
+        return f"{score} • {topic['accuracy']}% accuracy"
+    return f"{score}%"
+
+
+def topic_performance_view(analysis, metadata):
+    topic_analysis = analysis.get('topic_wise_performance') or analysis.get('topic_analysis', {})
+    if not topic_analysis:
+        return None
+
+    strong = [f"""
+                    <div style='background: #E8F5E9; padding: 1rem; border-left: 4px solid #4CAF50; margin-bottom: 0.5rem; border-radius: 4px;'>
+                        <strong style='color: #2E7D32;'>{topic.get('topic', topic.get('name', 'Topic'))}</strong><br>
+                        <span style='color: #66BB6A;'>Score: {format_topic_score(topic)}</span><br>
+                        <small style='color: #555;'>{topic.get('details', topic.get('feedback', ''))}</small>
+                    </div>
+                    """ for topic in topic_analysis.get('strong_topics', [])]
+
+    weak_topics = topic_analysis.get('areas_for_improvement', topic_analysis.get('weak_topics', []))
+    weak = [f"""
+                    <div style='background: #FFF3E0; padding: 1rem; border-left: 4px solid #FF9800; margin-bottom: 0.5rem; border-radius: 4px;'>
+                        <strong style='color: #E65100;'>{topic.get('topic', topic.get('name', 'Topic'))}</strong><br>
+                        <span style='color: #FB8C00;'>Score: {format_topic_score(topic)}</span><br>
+                        <small style='color: #555;'>{topic.get('recommendations', topic.get('suggestion', ''))}</small>
+                    </div>
+                    """ for topic in weak_topics]
+
+    return {
+        'strong': strong,
+        'weak': weak,
+        'not_assessed': [f"• {topic}" for topic in topic_analysis.get('not_assessed') or []],
+    }
+
+
+def question_breakdown_view(analysis, metadata):
+    question_breakdown = analysis.get('question_wise_breakdown', {})
+
+    accurate = [
+        f"✅ **Questions {', '.join(map(str, item['question_numbers']))}** ({item.get('topic', 'Topic')}): "
+        f"{item.get('summary', 'Perfectly answered')}"
+        for item in question_breakdown.get('highly_accurate_questions', [])
+        if item.get('question_numbers')
+    ]
+
+    needs_improvement = [{
+        'label': f"❌ Question {q['question_number']}: {q.get('topic', 'Topic')} - "
+                 f"{q['marks_obtained']}/{q['total_marks']} marks",
+        'question': f"**Question:** {q.get('question_text', 'N/A')}",
+        'student_answer': q.get('student_answer', 'N/A'),
+        'expected_answer': q.get('expected_answer', 'N/A'),
+        'correct': f"✅ **What was correct:** {q['what_was_correct']}" if q.get('what_was_correct') else None,
+        'wrong': f"❌ **What was wrong:** {q['what_was_wrong']}" if q.get('what_was_wrong') else None,
+        'issues': f"**Issues identified:** {', '.join(q['issues'])}" if q.get('issues') else None,
+        'feedback': f"**Feedback:** {q.get('feedback', 'N/A')}",
+    } for q in question_breakdown.get('needs_improvement', [])]
+
+    return {'accurate': accurate, 'needs_improvement': needs_improvement}
+
+
+def _conceptual_error(error):
+    return f"""
+                        <div style='background: #FFEBEE; padding: 1rem; border-left: 4px solid #F44336; margin-bottom: 0.5rem; border-radius: 4px;'>
+                            <strong style='color: #C62828;'>Severity: {error.get('severity', 'Medium')}</strong><br>
+                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
+                            <span style='color: #555;'><strong>Questions Affected:</strong> {_questions(error)}</span><br>
+                            <span style='color: #555;'><strong>Example:</strong> {error.get('example', '')}</span><br>
+                            <small style='color: #1976D2;'>💡 <strong>Remedy:</strong> {error.get('remedy', '')}</small>
+                        </div>
+                        """
+
+
+def _calculation_mistake(error):
+    return f"""
+                        <div style='background: #FFF3E0; padding: 1rem; border-left: 4px solid #FF9800; margin-bottom: 0.5rem; border-radius: 4px;'>
+                            <span style='color: #555;'><strong>Type:</strong> {error.get('description', '')}</span><br>
+                            <span style='color: #555;'><strong>Questions Affected:</strong> {_questions(error)}</span><br>
+                            <span style='color: #555;'><strong>Pattern:</strong> {error.get('pattern', '')}</span><br>
+                            <small style='color: #1976D2;'>💡 <strong>Example:</strong> {error.get('example', '')}</small>
+                        </div>
+                        """
+
+
+def _incomplete_step(error):
+    return f"""
+                        <div style='background: #E3F2FD; padding: 1rem; border-left: 4px solid #2196F3; margin-bottom: 0.5rem; border-radius: 4px;'>
+                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
+                            <span style='color: #555;'><strong>Questions Affected:</strong> {_questions(error)}</span><br>
+                            <span style='color: #555;'><strong>Missing Steps:</strong> {', '.join(error.get('missing_steps', []))}</span><br>
+                            <small style='color: #1976D2;'>💡 <strong>Impact:</strong> {error.get('impact', '')}</small>
+                        </div>
+                        """
+
+
+def _poor_explanation(error):
+    return f"""
+                        <div style='background: #F3E5F5; padding: 1rem; border-left: 4px solid #9C27B0; margin-bottom: 0.5rem; border-radius: 4px;'>
+                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
+                            <span style='color: #555;'><strong>Questions Affected:</strong> {_questions(error)}</span><br>
+                            <small style='color: #1976D2;'>💡 <strong>Suggestion:</strong> {error.get('suggestion', '')}</small><br>
+                            <small style='color: #555;'><strong>Example:</strong> {error.get('example', '')}</small>
+                        </div>
+                        """
+
+
+def _notation_error(error):
+    return f"""
+                        <div style='background: #FCE4EC; padding: 1rem; border-left: 4px solid #E91E63; margin-bottom: 0.5rem; border-radius: 4px;'>
+                            <span style='color: #555;'><strong>Issue:</strong> {error.get('description', '')}</span><br>
+                            <span style='color: #555;'><strong>Questions Affected:</strong> {_questions(error)}</span><br>
+                            <small style='color: #1976D2;'>💡 <strong>Correct Notation:</strong> {error.get('correct_notation', '')}</small><br>
+                            <small style='color: #555;'><strong>Example:</strong> {error.get('example', '')}</small>
+                        </div>
+                        """
+
+
+ERROR_DETAILS = {
+    'conceptual_errors': ("### 🧠 Conceptual Errors", _conceptual_error),
+    'calculation_mistakes': ("### 🔢 Calculation Mistakes", _calculation_mistake),
+    'incomplete_steps': ("### 📝 Incomplete Steps", _incomplete_step),
+    'poor_explanation': ("### 💬 Poor Explanation", _poor_explanation),
+    'notation_errors': ("### 🔤 Notation Errors", _notation_error),
+}
+
+
+def error_analysis_view(analysis, metadata):
+    error_analysis = analysis.get('error_analysis', {})
+    if not error_analysis:
+        return None
+
+    # Older reports give a bare count instead of a list of errors.
+    metrics, details = [], []
+    for key, label in ERROR_CATEGORIES:
+        errors = error_analysis.get(key, [])
+        metrics.append((label, len(errors) if isinstance(errors, list) else errors))
+        if isinstance(errors, list) and errors:
+            heading, card = ERROR_DETAILS[key]
+            details.append((heading, [card(error) for error in errors]))
+
+    time_management = error_analysis.get('time_management_issues', 0)
+    metrics.append(("Time Management", time_management if isinstance(time_management, (int, float)) else 0))
+
+    # Metrics in three columns of two, as (label, value) pairs.
+    return {'columns': [metrics[0:2], metrics[2:4], metrics[4:6]], 'details': details}
+
+
+def strengths_view(analysis, metadata):
+    return [f"""
+        <div style='background: #E8F5E9; padding: 0.8rem; margin-bottom: 0.5rem; border-radius: 4px;'>
+            <span style='color: #2E7D32;'>✓ {strength}</span>
+        </div>
+        """ for strength in analysis.get('strengths', [])]
+
+
+def improvements_view(analysis, metadata):
+    return [f"""
+        <div style='background: #FFF3E0; padding: 0.8rem; margin-bottom: 0.5rem; border-radius: 4px;'>
+            <span style='color: #E65100;'>→ {improvement}</span>
+        </div>
+        """ for improvement in analysis.get('improvements_needed', analysis.get('improvements', []))]
+
+
+def personal_feedback_view(analysis, metadata):
+    personal_feedback = analysis.get('personal_feedback', {})
+
+    if not personal_feedback:
+        return {'fallback': f"""
+        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white;'>
+            {analysis.get('personalized_feedback', '')}
+        </div>
+        """}
+
+    view = {
+        'banner': f"""
+        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 10px; color: white;'>
+            <h3 style='margin: 0 0 1rem 0; color: white;'>{personal_feedback.get('opening', 'Dear Student,')}</h3>
+            <p style='margin: 0.5rem 0; line-height: 1.6;'><strong>Overall Impression:</strong> {personal_feedback.get('overall_impression', '')}</p>
+            <p style='margin: 0.5rem 0; line-height: 1.6;'>{personal_feedback.get('detailed_analysis', '')}</p>
+        </div>
+        """,
+        'takeaways': [f"💡 {takeaway}" for takeaway in personal_feedback.get('key_takeaways') or []],
+        'actions': [f"**Step {i}:** {action}"
+                    for i, action in enumerate(personal_feedback.get('action_plan') or [], 1)],
+        'motivation': None,
+        'potential': None,
+    }
+
+    if personal_feedback.get('motivation'):
+        view['motivation'] = f"""
+            <div style='background: #E8F5E9; padding: 1.5rem; border-radius: 8px; border-left: 4px solid #4CAF50; margin-top: 1rem;'>
+                <p style='margin: 0; color: #2E7D32; font-style: italic;'>"{personal_feedback['motivation']}"</p>
+            </div>
+            """
+
+    if personal_feedback.get('estimated_improvement_potential'):
+        view['potential'] = f"""
+            <div style='background: #FFF3E0; padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
+                <strong style='color: #E65100;'>📈 Improvement Potential:</strong><br>
+                <span style='color: #555;'>{personal_feedback['estimated_improvement_potential']}</span>
+            </div>
+            """
+    return view
+
+
+SECTION_VIEWS = {
+    'personal_details': personal_details_view,
+    'overall_score': overall_score_view,
+    'topic_wise_performance': topic_performance_view,
+    'question_wise_breakdown': question_breakdown_view,
+    'error_analysis': error_analysis_view,
+    'strengths': strengths_view,
+    'improvements_needed': improvements_view,
+    'personal_feedback': personal_feedback_view,
+}
+
+
+def build_section_view(key, analysis, metadata):
+    return SECTION_VIEWS[key](analysis, metadata)
+
+
+def build_report_view(analysis, metadata, sections=None):
+    # sections limits the view to the keys received so far while a report is
+    # still streaming in.
+    keys = SECTION_VIEWS if sections is None else [key for key in SECTION_VIEWS if key in sections]
+    return {key: build_section_view(key, analysis, metadata) for key in keys}
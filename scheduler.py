@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+
+import httpx
+from google.genai import errors
+
+
+# Requests per minute allowed per model, e.g. '{"gemini-3-flash-preview": 30}'.
+# Models not listed get SCHEDULER_DEFAULT_RPM; uploads are limited under 'files'.
+SCHEDULER_RPM = json.loads(os.getenv('SCHEDULER_RPM', '{}'))
+SCHEDULER_DEFAULT_RPM = float(os.getenv('SCHEDULER_DEFAULT_RPM', '120'))
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', '8'))
+SCHEDULER_MAX_RETRIES = int(os.getenv('SCHEDULER_MAX_RETRIES', '4'))
+SCHEDULER_RETRY_BASE_SECONDS = float(os.getenv('SCHEDULER_RETRY_BASE_SECONDS', '1.0'))
+SCHEDULER_RETRY_MAX_SECONDS = float(os.getenv('SCHEDULER_RETRY_MAX_SECONDS', '30.0'))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Which grading/chat session a request belongs to. Queued requests are
+# granted round-robin across sessions so one teacher's batch of forty sheets
+# can't starve a single student's report.
+_request_session = contextvars.ContextVar('request_session', default='default')
+
+
+def set_request_session(session_id):
+    _request_session.set(session_id)
+
+
+def is_retryable(error):
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, rate_per_minute / 60.0 * 5)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a token is available; returns the seconds waited.
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class RequestScheduler:
+    # Every Gemini call goes through here: at most max_concurrency in flight,
+    # a token bucket per rate-limit bucket (the model name, or 'files'), fair
+    # round-robin between sessions for the free slots, and jittered
+    # exponential backoff on 429/5xx and transport errors. Stages that are
+    # not idempotent are never retried.
+    def __init__(self, rpm=None, default_rpm=SCHEDULER_DEFAULT_RPM, max_concurrency=SCHEDULER_MAX_CONCURRENCY,
+                 max_retries=SCHEDULER_MAX_RETRIES, retry_base_seconds=SCHEDULER_RETRY_BASE_SECONDS,
+                 retry_max_seconds=SCHEDULER_RETRY_MAX_SECONDS):
+        self.rpm = dict(SCHEDULER_RPM if rpm is None else rpm)
+        self.default_rpm = default_rpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+
+        self._buckets = {}
+        self._cond = threading.Condition()
+        self._waiting = {}
+        self._rotation = deque()
+        self._in_flight = 0
+        self._stats = {}
+        self._recent_waits = deque(maxlen=500)
+
+    def _bucket(self, bucket):
+        with self._cond:
+            if bucket not in self._buckets:
+                self._buckets[bucket] = TokenBucket(self.rpm.get(bucket, self.default_rpm))
+            return self._buckets[bucket]
+
+    def _stage_stats(self, stage):
+        return self._stats.setdefault(stage, {'calls': 0, 'retries': 0, 'failures': 0,
+                                              'wait_seconds': 0.0, 'max_wait_seconds': 0.0})
+
+    def _acquire_slot(self, session):
+        ticket = object()
+        with self._cond:
+            self._waiting.setdefault(session, deque()).append(ticket)
+            if session not in self._rotation:
+                self._rotation.append(session)
+            while not (self._in_flight < self.max_concurrency
+                       and self._waiting[self._rotation[0]][0] is ticket):
+                self._cond.wait()
+
+            self._waiting[session].popleft()
+            self._rotation.popleft()
+            if self._waiting[session]:
+                self._rotation.append(session)
+            else:
+                del self._waiting[session]
+            self._in_flight += 1
+            self._cond.notify_all()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _admit(self, stage, bucket):
+        # The rate-limit token comes first: a request throttled on one model
+        # waits without holding a slot that other models and sessions need.
+        start = time.monotonic()
+        self._bucket(bucket).acquire()
+        self._acquire_slot(_request_session.get())
+        waited = time.monotonic() - start
+        with self._cond:
+            stats = self._stage_stats(stage)
+            stats['calls'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+            self._recent_waits.append(waited)
+
+    def _backoff(self, stage, attempt, error, idempotent, max_retries=None):
+        # Returns normally when the caller should retry; re-raises otherwise.
+        max_retries = self.max_retries if max_retries is None else max_retries
+        if not idempotent or attempt >= max_retries or not is_retryable(error):
+            with self._cond:
+                self._stage_stats(stage)['failures'] += 1
+            raise error
+        with self._cond:
+            self._stage_stats(stage)['retries'] += 1
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * (2 ** attempt))
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+    def call(self, stage, bucket, fn, *args, idempotent=True, max_retries=None, **kwargs):
+        # max_retries overrides the default, e.g. to give up on a busy model
+        # sooner when a fallback model is available.
+        attempt = 0
+        while True:
+            self._admit(stage, bucket)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+            finally:
+                self._release_slot()
+            self._backoff(stage, attempt, error, idempotent, max_retries)
+            attempt += 1
+
+    def stream(self, stage, bucket, fn, *args, max_retries=None, **kwargs):
+        # For generate_content_stream: the request is retried until the first
+        # chunk arrives. After that, output has already reached the caller, so
+        # a failure mid-stream is raised instead of replayed. The slot is held
+        # until the stream is drained.
+        attempt = 0
+        while True:
+            self._admit(stage, bucket)
+            try:
+                iterator = iter(fn(*args, **kwargs))
+                first = next(iterator, None)
+                break
+            except Exception as e:
+                self._release_slot()
+                self._backoff(stage, attempt, e, True, max_retries)
+                attempt += 1
+
+        try:
+            if first is not None:
+                yield first
+            yield from iterator
+        except Exception:
+            with self._cond:
+                self._stage_stats(stage)['failures'] += 1
+            raise
+        finally:
+            self._release_slot()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._recent_waits)
+            return {
+                'queue_depth': sum(len(tickets) for tickets in self._waiting.values()),
+                'in_flight': self._in_flight,
+                'sessions_waiting': len(self._waiting),
+                'p50_wait_seconds': waits[len(waits) // 2] if waits else 0.0,
+                'p95_wait_seconds': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'stages': {stage: dict(stats) for stage, stats in self._stats.items()},
+            }
+
+
+_scheduler = RequestScheduler()
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def get_scheduler_stats():
+    return _scheduler.stats()
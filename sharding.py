@@ -0,0 +1,228 @@
+import io
+import os
+import re
+import math
+
+from pypdf import PdfReader, PdfWriter
+
+from documents import ExamDocument
+
+
+# Answer sheets longer than this many pages are graded as several page
+# ranges in parallel; 0 turns sharding off.
+ANSWER_SHEET_SHARD_PAGES = int(os.getenv('ANSWER_SHEET_SHARD_PAGES', '8'))
+SHARD_MAX_WORKERS = int(os.getenv('SHARD_MAX_WORKERS', '4'))
+
+# A topic graded strong in one page range and weak in another is placed by
+# its combined accuracy: at or above this percentage it counts as strong.
+STRONG_TOPIC_ACCURACY = float(os.getenv('STRONG_TOPIC_ACCURACY', '70'))
+
+SCORE_PATTERN = re.compile(r'([\d.]+)\s*/\s*([\d.]+)')
+
+# Per-shard counts that add up across page ranges; everything else in
+# overall_score describes the whole paper and is the same in every shard.
+SUMMED_SCORE_FIELDS = ['attempted_questions', 'correct_answers', 'partially_correct',
+                       'incorrect_answers', 'total_marks_obtained']
+
+
+def _shard_note(first_page, last_page, total_pages, has_context_page):
+    context = (f" plus page {last_page + 1} for context. Page {last_page + 1} is there only so you can "
+               f"finish reading an answer that continues past page {last_page}") if has_context_page else ""
+    return f"""ANSWER SHEET SECTION: this file holds pages {first_page}-{last_page} of a {total_pages}-page answer sheet{context}.
+- Grade ONLY answers that begin on pages {first_page}-{last_page}. Ignore text at the top of page {first_page} that continues an answer begun on an earlier page.
+- Count only those answers in attempted_questions, correct_answers, partially_correct, incorrect_answers, total_marks_obtained and question_wise_breakdown.
+- Still report total_questions and total_marks for the whole question paper, and set unattempted to 0.
+- Student details are usually only on page 1; use 'Not found' when they are not on these pages."""
+
+
+def split_answer_sheet(file, pages_per_shard=ANSWER_SHEET_SHARD_PAGES):
+    # Returns a list of shards (dicts with document, first_page, last_page
+    # and note), or [] when the sheet is not a PDF or is short enough to grade
+    # in one request. Shards are balanced so the longest one, which sets the
+    # wall-clock time, is as short as possible.
+    if not pages_per_shard or getattr(file, 'type', None) != 'application/pdf':
+        return []
+
+    try:
+        reader = PdfReader(io.BytesIO(file.getvalue()))
+        total_pages = len(reader.pages)
+    except Exception:
+        return []
+
+    if total_pages <= pages_per_shard:
+        return []
+
+    shard_count = math.ceil(total_pages / pages_per_shard)
+    shard_size = math.ceil(total_pages / shard_count)
+    base = os.path.splitext(file.name)[0]
+
+    shards = []
+    for start in range(0, total_pages, shard_size):
+        end = min(start + shard_size, total_pages)
+        has_context_page = end < total_pages
+
+        writer = PdfWriter()
+        for index in range(start, end + 1 if has_context_page else end):
+            writer.add_page(reader.pages[index])
+        out = io.BytesIO()
+        writer.write(out)
+
+        shards.append({
+            'document': ExamDocument(f"{base}_p{start + 1}-{end}.pdf", out.getvalue(), 'application/pdf'),
+            'first_page': start + 1,
+            'last_page': end,
+            'note': _shard_note(start + 1, end, total_pages, has_context_page),
+        })
+    return shards
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+def _unique(items):
+    seen, result = set(), []
+    for item in items:
+        marker = repr(item)
+        if marker not in seen:
+            seen.add(marker)
+            result.append(item)
+    return result
+
+
+def _topic_key(name):
+    return ' '.join(str(name).casefold().split())
+
+
+def _topic_accuracy(topic):
+    score = SCORE_PATTERN.search(str(topic.get('score', '')))
+    if score and float(score.group(2)):
+        return float(score.group(1)) / float(score.group(2)) * 100
+    return topic.get('accuracy') if isinstance(topic.get('accuracy'), (int, float)) else None
+
+
+def _merge_topics(topic_wise):
+    # topic_wise: each shard's topic_wise_performance. Topics are matched by
+    # normalized name across both lists, so a topic that is strong in one
+    # page range and weak in another ends up in exactly one list: the one
+    # all its shards agree on, or otherwise the one its combined accuracy
+    # points to.
+    merged, lists = {}, {}
+    for performance in topic_wise:
+        for list_name in ('strong_topics', 'areas_for_improvement'):
+            for topic in performance.get(list_name, []):
+                key = _topic_key(topic.get('topic', ''))
+                lists.setdefault(key, set()).add(list_name)
+                if key not in merged:
+                    merged[key] = dict(topic, questions=list(topic.get('questions', [])))
+                    continue
+
+                existing = merged[key]
+                existing['questions'] = _unique(existing['questions'] + topic.get('questions', []))
+                for field in ('details', 'recommendations'):
+                    if topic.get(field) and topic.get(field) != existing.get(field):
+                        existing[field] = f"{existing.get(field, '')} {topic[field]}".strip()
+                if 'gaps' in topic:
+                    existing['gaps'] = _unique(existing.get('gaps', []) + topic['gaps'])
+
+                ours = SCORE_PATTERN.search(str(existing.get('score', '')))
+                theirs = SCORE_PATTERN.search(str(topic.get('score', '')))
+                if ours and theirs:
+                    obtained = float(ours.group(1)) + float(theirs.group(1))
+                    possible = float(ours.group(2)) + float(theirs.group(2))
+                    existing['score'] = f"{obtained:g}/{possible:g} marks"
+                    existing['accuracy'] = round(obtained / possible * 100, 1) if possible else 0
+
+    result = {'strong_topics': [], 'areas_for_improvement': []}
+    for key, topic in merged.items():
+        if len(lists[key]) == 1:
+            list_name = next(iter(lists[key]))
+        else:
+            accuracy = _topic_accuracy(topic)
+            strong = accuracy is not None and accuracy >= STRONG_TOPIC_ACCURACY
+            list_name = 'strong_topics' if strong else 'areas_for_improvement'
+        if list_name == 'areas_for_improvement':
+            topic.setdefault('gaps', [])
+            topic.setdefault('recommendations', '')
+        else:
+            topic.setdefault('details', '')
+        result[list_name].append(topic)
+    return result
+
+
+def merge_shard_analyses(analyses):
+    # Folds per-page-range analyses (in page order) back into one report with
+    # the regular schema.
+    first = analyses[0]
+
+    personal_details = {}
+    for analysis in analyses:
+        for field, value in analysis.get('personal_details', {}).items():
+            if personal_details.get(field) in (None, '', 'Not found'):
+                personal_details[field] = value
+
+    scores = [analysis.get('overall_score', {}) for analysis in analyses]
+    overall_score = {field: sum(_number(score.get(field)) for score in scores) for field in SUMMED_SCORE_FIELDS}
+    overall_score['total_questions'] = max(_number(score.get('total_questions')) for score in scores)
+    overall_score['total_marks'] = max(_number(score.get('total_marks')) for score in scores)
+    overall_score['unattempted'] = max(0, overall_score['total_questions'] - overall_score['attempted_questions'])
+    attempted = overall_score['attempted_questions']
+    overall_score['accuracy_percentage'] = (
+        round(overall_score['correct_answers'] / attempted * 100, 1) if attempted else 0
+    )
+
+    topics = [analysis.get('topic_wise_performance', {}) for analysis in analyses]
+    breakdowns = [analysis.get('question_wise_breakdown', {}) for analysis in analyses]
+
+    needs_improvement, graded_questions = [], set()
+    for breakdown in breakdowns:
+        for item in breakdown.get('needs_improvement', []):
+            # A question straddling a shard boundary is kept from the shard
+            # where its answer begins, which comes first in page order.
+            number = str(item.get('question_number'))
+            if number not in graded_questions:
+                graded_questions.add(number)
+                needs_improvement.append(item)
+
+    # Context pages shared by two shards can get the same question listed as
+    # accurate twice, or accurate in one shard and wrong in the other; each
+    # question is listed once, and not at all if it needs improvement.
+    highly_accurate = []
+    for breakdown in breakdowns:
+        for item in breakdown.get('highly_accurate_questions', []):
+            numbers = []
+            for number in item.get('question_numbers') or []:
+                if str(number) not in graded_questions:
+                    graded_questions.add(str(number))
+                    numbers.append(number)
+            if numbers:
+                highly_accurate.append({**item, 'question_numbers': numbers})
+
+    error_analysis = {}
+    for analysis in analyses:
+        for category, errors in analysis.get('error_analysis', {}).items():
+            error_analysis.setdefault(category, []).extend(errors)
+
+    feedback = [analysis.get('personal_feedback', {}) for analysis in analyses]
+    personal_feedback = dict(first.get('personal_feedback', {}))
+    personal_feedback['detailed_analysis'] = '\n\n'.join(
+        item['detailed_analysis'] for item in feedback if item.get('detailed_analysis')
+    )
+    for field in ('key_takeaways', 'action_plan'):
+        personal_feedback[field] = _unique([entry for item in feedback for entry in item.get(field, [])])
+
+    return {
+        'personal_details': personal_details,
+        'overall_score': overall_score,
+        'topic_wise_performance': _merge_topics(topics),
+        'question_wise_breakdown': {
+            'highly_accurate_questions': highly_accurate,
+            'needs_improvement': needs_improvement,
+        },
+        'error_analysis': error_analysis,
+        'strengths': _unique([entry for analysis in analyses for entry in analysis.get('strengths', [])]),
+        'improvements_needed': _unique(
+            [entry for analysis in analyses for entry in analysis.get('improvements_needed', [])]
+        ),
+        'personal_feedback': personal_feedback,
+    }
@@ -0,0 +1,82 @@
+import json
+
+
+# Scans a streamed JSON object and emits each top-level member as soon as its
+# value is complete. Every character is looked at once and the raw text is
+# kept as a list of chunks, so long outputs stay linear. Anything before the
+# opening brace (such as a ```json fence) is ignored.
+class JSONSectionStream:
+    def __init__(self):
+        self.sections = {}
+        self.complete = False
+        self.malformed = False
+        self._chunks = []
+        self._member = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def text(self):
+        return ''.join(self._chunks)
+
+    def feed(self, text):
+        self._chunks.append(text)
+        if self.complete:
+            return []
+
+        completed = []
+        start = 0
+
+        for i, ch in enumerate(text):
+            if self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                    start = i + 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._member.append(text[start:i])
+                    self._emit(completed)
+                    self.complete = True
+                    return completed
+            elif ch == ',' and self._depth == 1:
+                self._member.append(text[start:i])
+                self._emit(completed)
+                start = i + 1
+
+        if self._depth > 0:
+            self._member.append(text[start:])
+
+        return completed
+
+    def _emit(self, completed):
+        member_text = ''.join(self._member).strip()
+        self._member = []
+        if not member_text:
+            return
+
+        try:
+            parsed = json.loads('{' + member_text + '}')
+        except json.JSONDecodeError:
+            self.malformed = True
+            return
+
+        for key, value in parsed.items():
+            self.sections[key] = value
+            completed.append((key, value))
@@ -0,0 +1,421 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import difflib
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+
+from cache_store import get_connection
+from analysis_store import ANALYSIS_DB_PATH
+
+
+# Names at least this similar (difflib ratio) are taken to be the same
+# student when a report has no usable roll number.
+STUDENT_NAME_MATCH_RATIO = float(os.getenv('STUDENT_NAME_MATCH_RATIO', '0.85'))
+
+logger = logging.getLogger('exam_review.student_history')
+
+# Lives next to the analyses table. Students are found by (school, roll
+# number) through a unique index, or by name within a school. Topic results
+# are stored as one row per (student, subject, topic, report) in a
+# WITHOUT ROWID table whose primary key is exactly that order, so a topic's
+# trend is a single B-tree range scan.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    student_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    school_key TEXT NOT NULL,
+    roll_key TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    student_name TEXT,
+    roll_number TEXT,
+    school_name TEXT,
+    created_at TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_students_roll ON students (school_key, roll_key) WHERE roll_key != '';
+CREATE INDEX IF NOT EXISTS idx_students_name ON students (school_key, name_key);
+
+CREATE TABLE IF NOT EXISTS student_analyses (
+    analysis_id INTEGER PRIMARY KEY,
+    student_id INTEGER NOT NULL,
+    class TEXT,
+    subject TEXT,
+    exam_type TEXT,
+    exam_date TEXT,
+    score_percentage REAL,
+    created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_student_analyses_student ON student_analyses (student_id, subject, created_at);
+
+CREATE TABLE IF NOT EXISTS student_topic_points (
+    student_id INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    topic_key TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    analysis_id INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    exam_type TEXT,
+    accuracy REAL NOT NULL,
+    PRIMARY KEY (student_id, subject, topic_key, created_at, analysis_id)
+) WITHOUT ROWID;
+"""
+
+MISSING_VALUES = {'', 'not found', 'n/a', 'na', 'none', 'unknown', 'not available', 'not visible'}
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+')
+_ROLL_PATTERN = re.compile(r'[^A-Z0-9]')
+
+
+def _connect():
+    return get_connection(ANALYSIS_DB_PATH, _SCHEMA)
+
+
+def _is_missing(value):
+    return value is None or str(value).strip().casefold() in MISSING_VALUES
+
+
+def normalize_name(value):
+    # "  Aarav  K. Sharma " -> "aarav k sharma"
+    if _is_missing(value):
+        return ''
+    return ' '.join(_WORD_PATTERN.findall(str(value).casefold()))
+
+
+def normalize_roll_number(value):
+    # "Roll No: 07-A" style noise is dropped; leading zeros don't matter.
+    if _is_missing(value):
+        return ''
+    roll = _ROLL_PATTERN.sub('', str(value).upper())
+    return roll.lstrip('0') or roll
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().rstrip('%'))
+    except ValueError:
+        return None
+
+
+def _match_by_name(conn, school_key, name_key, roll_key):
+    # Closest name in the same school, ignoring students already known under
+    # a different roll number.
+    if not name_key:
+        return None
+    rows = conn.execute(
+        "SELECT student_id, name_key, roll_key FROM students WHERE school_key = ?", (school_key,)
+    ).fetchall()
+    best, best_ratio = None, STUDENT_NAME_MATCH_RATIO
+    for row in rows:
+        if roll_key and row['roll_key'] and row['roll_key'] != roll_key:
+            continue
+        ratio = 1.0 if row['name_key'] == name_key else difflib.SequenceMatcher(None, name_key, row['name_key']).ratio()
+        if ratio >= best_ratio:
+            best, best_ratio = row, ratio
+    return best
+
+
+def _resolve_student(conn, personal_details):
+    school_key = normalize_name(personal_details.get('school_name'))
+    roll_key = normalize_roll_number(personal_details.get('roll_number'))
+    name_key = normalize_name(personal_details.get('student_name'))
+    if not roll_key and not name_key:
+        return None
+
+    row = None
+    if roll_key:
+        row = conn.execute(
+            "SELECT student_id, roll_key FROM students WHERE school_key = ? AND roll_key = ?",
+            (school_key, roll_key)
+        ).fetchone()
+    if row is None:
+        row = _match_by_name(conn, school_key, name_key, roll_key)
+
+    if row is not None:
+        if roll_key and not row['roll_key']:
+            conn.execute("UPDATE students SET roll_key = ?, roll_number = ? WHERE student_id = ?",
+                         (roll_key, personal_details.get('roll_number'), row['student_id']))
+        return row['student_id']
+
+    cursor = conn.execute(
+        """INSERT INTO students (school_key, roll_key, name_key, student_name, roll_number, school_name, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (school_key, roll_key, name_key, personal_details.get('student_name'),
+         personal_details.get('roll_number'), personal_details.get('school_name'),
+         datetime.now(timezone.utc).isoformat())
+    )
+    return cursor.lastrowid
+
+
+def _forget_analysis(conn, analysis_id):
+    row = conn.execute(
+        "SELECT student_id, subject FROM student_analyses WHERE analysis_id = ?", (analysis_id,)
+    ).fetchone()
+    if row is None:
+        return
+    conn.execute("DELETE FROM student_topic_points WHERE student_id = ? AND subject = ? AND analysis_id = ?",
+                 (row['student_id'], row['subject'], analysis_id))
+    conn.execute("DELETE FROM student_analyses WHERE analysis_id = ?", (analysis_id,))
+
+
+def _index(conn, analysis_id, analysis, metadata, created_at, replaces=None):
+    if replaces is not None:
+        _forget_analysis(conn, replaces)
+
+    student_id = _resolve_student(conn, analysis.get('personal_details') or {})
+    if student_id is None:
+        return None
+
+    subject = metadata.get('subject') or ''
+    overall_score = analysis.get('overall_score') or {}
+    obtained, total = _number(overall_score.get('total_marks_obtained')), _number(overall_score.get('total_marks'))
+    conn.execute(
+        """INSERT OR REPLACE INTO student_analyses
+           (analysis_id, student_id, class, subject, exam_type, exam_date, score_percentage, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (analysis_id, student_id, str(metadata.get('class')), subject, metadata.get('exam_type'),
+         (analysis.get('personal_details') or {}).get('date'),
+         obtained / total * 100 if obtained is not None and total else None, created_at)
+    )
+
+    points = {}
+    topic_analysis = analysis.get('topic_wise_performance') or {}
+    for field in ('strong_topics', 'areas_for_improvement'):
+        for topic in topic_analysis.get(field) or []:
+            topic_key, accuracy = normalize_name(topic.get('topic')), _number(topic.get('accuracy'))
+            if topic_key and accuracy is not None:
+                points[topic_key] = (topic['topic'], accuracy)
+    conn.executemany(
+        """INSERT OR REPLACE INTO student_topic_points
+           (student_id, subject, topic_key, created_at, analysis_id, topic, exam_type, accuracy)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(student_id, subject, topic_key, created_at, analysis_id, topic, metadata.get('exam_type'), accuracy)
+         for topic_key, (topic, accuracy) in points.items()]
+    )
+    return student_id
+
+
+def index_student_analysis(analysis_id, analysis, metadata):
+    # Links a freshly stored report to its student and records its topic
+    # results. Returns the student_id, or None if the report names no student.
+    if analysis_id is None:
+        return None
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT replaces, created_at FROM analyses WHERE analysis_id = ?", (analysis_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+                return _index(conn, analysis_id, analysis, metadata, row['created_at'], row['replaces'])
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def backfill_student_index(batch_size=500):
+    # Indexes every current report that has no index entry yet: reports from
+    # before the student index existed, and any whose live indexing failed.
+    # Reports that name no student are looked at again on each run; there
+    # are few of them. Returns how many reports were indexed.
+    indexed, last_id = 0, 0
+    while True:
+        try:
+            conn = _connect()
+            try:
+                rows = conn.execute(
+                    """SELECT analysis_id, class, subject, exam_type, analysis_json FROM analyses
+                       WHERE analysis_id > ? AND superseded = 0
+                         AND analysis_id NOT IN (SELECT analysis_id FROM student_analyses)
+                       ORDER BY analysis_id LIMIT ?""",
+                    (last_id, batch_size)
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return indexed
+
+        for row in rows:
+            metadata = {'class': row['class'], 'subject': row['subject'], 'exam_type': row['exam_type']}
+            if index_student_analysis(row['analysis_id'], json.loads(row['analysis_json']), metadata) is not None:
+                indexed += 1
+        if len(rows) < batch_size:
+            return indexed
+        last_id = rows[-1]['analysis_id']
+
+
+_backfill_started = False
+_backfill_lock = threading.Lock()
+
+
+def start_student_index_backfill():
+    # Called by the app on every script run; the first call per server
+    # process backfills in the background so startup is not held up.
+    global _backfill_started
+    with _backfill_lock:
+        if _backfill_started:
+            return
+        _backfill_started = True
+
+    def run():
+        indexed = backfill_student_index()
+        if indexed:
+            logger.info("Indexed %d stored report(s) by student", indexed)
+
+    threading.Thread(target=run, name='student-index-backfill', daemon=True).start()
+
+
+def find_student(student_name=None, roll_number=None, school_name=None):
+    # Same matching rules as indexing, without creating anything.
+    school_key = normalize_name(school_name)
+    roll_key = normalize_roll_number(roll_number)
+    name_key = normalize_name(student_name)
+    try:
+        conn = _connect()
+        try:
+            row = None
+            if roll_key:
+                row = conn.execute(
+                    "SELECT student_id FROM students WHERE school_key = ? AND roll_key = ?", (school_key, roll_key)
+                ).fetchone()
+            if row is None:
+                row = _match_by_name(conn, school_key, name_key, roll_key)
+            if row is None:
+                return None
+            return dict(conn.execute(
+                "SELECT student_id, student_name, roll_number, school_name FROM students WHERE student_id = ?",
+                (row['student_id'],)
+            ).fetchone())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def find_student_for_analysis(analysis):
+    personal_details = analysis.get('personal_details') or {}
+    return find_student(personal_details.get('student_name'), personal_details.get('roll_number'),
+                        personal_details.get('school_name'))
+
+
+def get_student_analyses(student_id, subject=None):
+    # Oldest first; analysis_id can be loaded with analysis_store.get_analysis.
+    query = "SELECT * FROM student_analyses WHERE student_id = ?"
+    params = [student_id]
+    if subject is not None:
+        query += " AND subject = ?"
+        params.append(subject)
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(query + " ORDER BY subject, created_at", params).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+    return [dict(row) for row in rows]
+
+
+def get_topic_trends(student_id, subject):
+    # {topic: [point, ...]} with points oldest first, each a dict with
+    # created_at, exam_type, accuracy and analysis_id.
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                """SELECT topic_key, topic, created_at, exam_type, accuracy, analysis_id FROM student_topic_points
+                   WHERE student_id = ? AND subject = ? ORDER BY topic_key, created_at""",
+                (student_id, subject)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+    trends, names = {}, {}
+    for row in rows:
+        names.setdefault(row['topic_key'], row['topic'])
+        trends.setdefault(names[row['topic_key']], []).append({
+            'created_at': row['created_at'],
+            'exam_type': row['exam_type'],
+            'accuracy': row['accuracy'],
+            'analysis_id': row['analysis_id'],
+        })
+    return trends
+
+
+def get_topic_trend(student_id, subject, topic):
+    # One topic's series; a slightly different spelling of the topic name
+    # falls back to the closest one the student has results for.
+    topic_key = normalize_name(topic)
+    try:
+        conn = _connect()
+        try:
+            query = """SELECT topic, created_at, exam_type, accuracy, analysis_id FROM student_topic_points
+                       WHERE student_id = ? AND subject = ? AND topic_key = ? ORDER BY created_at"""
+            rows = conn.execute(query, (student_id, subject, topic_key)).fetchall()
+            if not rows:
+                known = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT topic_key FROM student_topic_points WHERE student_id = ? AND subject = ?",
+                    (student_id, subject)
+                )]
+                close = difflib.get_close_matches(topic_key, known, n=1, cutoff=0.6)
+                if close:
+                    rows = conn.execute(query, (student_id, subject, close[0])).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+    return [dict(row) for row in rows]
+
+
+def topic_progress(student_id, subject, topic, since_exam_type=None):
+    # Change in a topic's accuracy from a baseline to the latest report. The
+    # baseline is the earliest result, or with since_exam_type the latest
+    # earlier result from that kind of exam ("since the Unit Test").
+    trend = get_topic_trend(student_id, subject, topic)
+    if len(trend) < 2:
+        return None
+
+    latest = trend[-1]
+    earlier = trend[:-1]
+    if since_exam_type:
+        earlier = [point for point in earlier if point['exam_type'] == since_exam_type]
+        if not earlier:
+            return None
+    baseline = earlier[-1] if since_exam_type else earlier[0]
+    return {
+        'topic': latest['topic'],
+        'baseline': baseline,
+        'latest': latest,
+        'change': latest['accuracy'] - baseline['accuracy'],
+        'points': trend,
+    }
+
+
+def main(argv=None):
+    # python student_history.py backfill    # index stored reports not indexed yet
+    parser = argparse.ArgumentParser(description="Maintain the per-student index of stored reports.")
+    parser.add_argument('command', choices=['backfill'], help="Index stored reports that are not indexed yet")
+    parser.parse_args(argv)
+
+    start = time.perf_counter()
+    indexed = backfill_student_index()
+    print(f"Indexed {indexed} report(s) in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
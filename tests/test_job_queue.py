@@ -0,0 +1,85 @@
+import os
+import socket
+import importlib
+import threading
+
+import pytest
+
+import job_queue
+
+
+@pytest.fixture
+def start_process(tmp_path, monkeypatch):
+    # Each call stands in for a fresh server process on the same host: the
+    # module is reloaded in place against the same database, with the same
+    # hostname and PID. The heartbeat loop never ticks, so the tests drive it.
+    monkeypatch.setenv('EXAM_JOBS_DB', str(tmp_path / 'jobs.sqlite'))
+    monkeypatch.setenv('JOB_HEARTBEAT_SECONDS', '3600')
+    releases = []
+
+    def start(stale_seconds):
+        monkeypatch.setenv('JOB_STALE_SECONDS', str(stale_seconds))
+        return importlib.reload(job_queue)
+
+    def blocking_job(process):
+        release = threading.Event()
+        releases.append(release)
+        return process.submit_job('test', lambda context: release.wait() and {})
+
+    yield start, blocking_job
+    for release in releases:
+        release.set()
+    importlib.reload(job_queue)
+
+
+def wait_for_status(process, job_id, status):
+    for _ in range(500):
+        if process.get_job_status(job_id) == status:
+            return
+        threading.Event().wait(0.01)
+    assert process.get_job_status(job_id) == status
+
+
+def test_restart_with_same_hostname_and_pid_fails_orphaned_jobs(start_process):
+    start, blocking_job = start_process
+    hostname, pid = socket.gethostname(), os.getpid()
+
+    old = start(stale_seconds=0)
+    job_id = blocking_job(old)
+    wait_for_status(old, job_id, 'running')
+    old_boot_id = old.BOOT_ID
+
+    new = start(stale_seconds=0)
+    assert (socket.gethostname(), os.getpid()) == (hostname, pid)
+    assert new.BOOT_ID != old_boot_id
+    new.start_job_queue()
+
+    job = new.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert 'restart' in job['error']
+
+
+def test_jobs_of_a_live_process_sharing_the_database_are_kept(start_process):
+    start, blocking_job = start_process
+
+    other = start(stale_seconds=60)
+    job_id = blocking_job(other)
+
+    current = start(stale_seconds=60)
+    current.recover_interrupted_jobs()
+    assert current.get_job_status(job_id) in ('queued', 'running')
+
+
+def test_stale_heartbeat_is_failed_but_own_jobs_are_not(start_process):
+    start, blocking_job = start_process
+
+    other = start(stale_seconds=0)
+    orphaned = blocking_job(other)
+
+    current = start(stale_seconds=0)
+    own = blocking_job(current)
+    current._heartbeat()
+    current.recover_interrupted_jobs()
+
+    assert current.get_job_status(orphaned) == 'failed'
+    assert current.get_job_status(own) in ('queued', 'running')
@@ -0,0 +1,150 @@
+import time
+import threading
+
+import httpx
+import pytest
+from google.genai import errors, types
+
+from benchmarks.fake_client import FakeClient
+from scheduler import RequestScheduler, set_request_session
+
+
+RECORDING = {
+    'upload': {'latency_seconds': 0},
+    'cache_create': {'latency_seconds': 0},
+    'chat_summary': {'latency_seconds': 0, 'text': 'ok'},
+    'chat': {'first_chunk_seconds': 0, 'chunk_interval_seconds': 0, 'chunks': ['a', 'b', 'c']},
+}
+
+
+def api_error(code):
+    error_class = errors.ServerError if code >= 500 else errors.ClientError
+    return error_class(code, {'error': {'code': code, 'message': 'injected', 'status': 'INJECTED'}})
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the scheduler"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def scheduler():
+    return RequestScheduler(rpm={}, default_rpm=1_000_000, max_concurrency=4, max_retries=3,
+                            retry_base_seconds=0)
+
+
+@pytest.fixture
+def client():
+    return FakeClient(RECORDING, latency_scale=0)
+
+
+def summarize(scheduler, client):
+    return scheduler.call('chat_summary', 'model', client.models.generate_content,
+                          model='model', contents='hi', config=types.GenerateContentConfig())
+
+
+def stream(scheduler, client):
+    return scheduler.stream('chat', 'model', client.models.generate_content_stream,
+                            model='model', contents='hi')
+
+
+@pytest.mark.parametrize('error', [api_error(429), api_error(503), httpx.ConnectError('reset'), TimeoutError()],
+                         ids=['429', '503', 'transport', 'timeout'])
+def test_call_retries_retryable_errors(scheduler, client, error):
+    client.failures.inject('chat_summary', error, error)
+
+    assert summarize(scheduler, client).text == 'ok'
+    assert client.calls['chat_summary'] == 3
+    assert scheduler.stats()['stages']['chat_summary']['retries'] == 2
+
+
+def test_call_gives_up_after_max_retries(scheduler, client):
+    client.failures.inject('chat_summary', *[api_error(429)] * 5)
+
+    with pytest.raises(errors.ClientError):
+        summarize(scheduler, client)
+    assert client.calls['chat_summary'] == 4
+    assert scheduler.stats()['stages']['chat_summary']['failures'] == 1
+
+
+def test_call_does_not_retry_client_errors(scheduler, client):
+    client.failures.inject('chat_summary', api_error(400))
+
+    with pytest.raises(errors.ClientError):
+        summarize(scheduler, client)
+    assert client.calls['chat_summary'] == 1
+
+
+def test_non_idempotent_call_is_not_retried(scheduler, client):
+    client.failures.inject('cache_create', api_error(503))
+
+    with pytest.raises(errors.ServerError):
+        scheduler.call('context_cache', 'model', client.caches.create, idempotent=False, model='model')
+    assert client.calls['cache_create'] == 1
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_stream_retries_before_first_chunk(scheduler, client):
+    client.failures.inject('chat', api_error(503), httpx.ReadTimeout('slow'))
+
+    assert ''.join(chunk.text for chunk in stream(scheduler, client)) == 'abc'
+    assert client.calls['chat'] == 3
+
+
+def test_stream_is_not_retried_after_first_chunk(scheduler, client):
+    client.failures.inject('chat', (1, api_error(503)))
+
+    received = []
+    with pytest.raises(errors.ServerError):
+        for chunk in stream(scheduler, client):
+            received.append(chunk.text)
+    assert received == ['a']
+    assert client.calls['chat'] == 1
+    assert scheduler.stats()['stages']['chat']['failures'] == 1
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_slots_are_granted_round_robin_across_sessions():
+    scheduler = RequestScheduler(rpm={}, default_rpm=1_000_000, max_concurrency=1)
+    release = threading.Event()
+    order = []
+
+    def request(session, fn):
+        set_request_session(session)
+        scheduler.call('analysis', 'model', fn)
+
+    blocker = threading.Thread(target=request, args=('blocker', release.wait))
+    blocker.start()
+    wait_until(lambda: scheduler.stats()['in_flight'] == 1)
+
+    # A batch queues three requests before a single student queues one; the
+    # student is served after the batch's first, not after all three.
+    threads = []
+    for session, label in [('batch', 'batch-1'), ('batch', 'batch-2'), ('batch', 'batch-3'),
+                           ('student', 'student-1')]:
+        thread = threading.Thread(target=request, args=(session, lambda label=label: order.append(label)))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: scheduler.stats()['queue_depth'] == len(threads))
+
+    release.set()
+    for thread in [blocker] + threads:
+        thread.join(timeout=5)
+    assert order == ['batch-1', 'student-1', 'batch-2', 'batch-3']
+
+
+def test_throttled_model_does_not_hold_a_slot():
+    # One request per 10 s on 'slow'; its second call waits for a token and
+    # must not keep the only slot from a call on another model.
+    scheduler = RequestScheduler(rpm={'slow': 6}, default_rpm=1_000_000, max_concurrency=1)
+    scheduler.call('analysis', 'slow', lambda: None)
+
+    throttled = threading.Thread(target=scheduler.call, args=('analysis', 'slow', lambda: None), daemon=True)
+    throttled.start()
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    scheduler.call('chat', 'fast', lambda: None)
+    assert time.monotonic() - start < 1.0